@@ -1,29 +1,38 @@
 # PACKAGES *********************************************************************************************************************
 
-import pandas as pd
-import numpy as np
+import os
+import sys
+import json
+import functools
 
-import plotly.graph_objects as go
+import numpy as np
 
 import warnings
 warnings.filterwarnings('ignore')
 
+# pandas and plotly.graph_objects (the latter alone pulls in hundreds of validator modules) are imported lazily, inside the
+# functions that prepare the raw data or build the figure. Serving a cached figure needs nothing but the standard library.
 
-# THE DATA *********************************************************************************************************************
 
+# PROFILING ********************************************************************************************************************
 
-df = pd.read_csv('WPP2022_DeathsBySingleAgeSex_Medium_1950-2021.csv')
+# Each stage of the pipeline runs inside a named span, and every file here is written to a temporary file first, then moved
+# into place (tmp_path()). Both come from common/profiling.py, shared by the three charts (with how to switch profiling on).
 
-# We need only the world data: year, age group, and the number of deaths:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-df = df[df['Location'] == 'World'][['Time', 'AgeGrp', 'DeathTotal']]
+from common.profiling import profiled, tmp_path
+from common.figures import default_template, dumps, hover_label
 
-df['DeathTotal'] = df[
-    'DeathTotal'] * 1000  # deaths are given in thousands by the UN
 
-# Uniting ages into larger age groups:
+# THE DATA *********************************************************************************************************************
 
-df['AgeGrp'] = df['AgeGrp'].replace('100+', '100').astype('int')
+
+WPP_PATH = 'WPP2022_DeathsBySingleAgeSex_Medium_1950-2021.csv'
+FIGURE_CACHE = 'figure_cache'  # built figures as json
+
+
+# Uniting ages into larger age groups:
 
 
 def age_group(s):
@@ -32,9 +41,6 @@ def age_group(s):
             return age
 
 
-df['Age_Group_5Y'] = df.apply(age_group, axis=1)  # bars coordinates
-
-
 def age_group_label(s):
     for age in np.arange(4, 105, 5).tolist():
         if age < 100:
@@ -44,565 +50,1112 @@ def age_group_label(s):
             return '100+'
 
 
-df['Age_Group_Label'] = df.apply(age_group_label, axis=1)  # bars labels
+@profiled('day_08.prepare_data')
+def prepare_data(path=WPP_PATH, location='World'):
+    import pandas as pd
+
+    df = pd.read_csv(path)
+
+    # We need only the world data (or the data of another location): year, age group, and the number of deaths:
+
+    df = df[df['Location'] == location][['Time', 'AgeGrp', 'DeathTotal']]
+
+    df['DeathTotal'] = df[
+        'DeathTotal'] * 1000  # deaths are given in thousands by the UN
+
+    df['AgeGrp'] = df['AgeGrp'].replace('100+', '100').astype('int')
+
+    df['Age_Group_5Y'] = df.apply(age_group, axis=1)  # bars coordinates
+    df['Age_Group_Label'] = df.apply(age_group_label, axis=1)  # bars labels
+
+    # Re-group the data frame with the new 5-year groups:
 
-# Re-group the data frame with the new 5-year groups:
+    dff = df.groupby(['Time', 'Age_Group_5Y',
+                      'Age_Group_Label']).sum().reset_index()
+    dff['Location'] = location
 
-dff = df.groupby(['Time', 'Age_Group_5Y',
-                  'Age_Group_Label']).sum().reset_index()
+    dff['DeathTotal_Total'] = dff.groupby('Time')['DeathTotal'].transform(
+        'sum')  # total deaths per year
 
-dff['DeathTotal_Total'] = dff.groupby('Time')['DeathTotal'].transform(
-    'sum')  # total deaths per year
+    dff['DeathTotal_Perc'] = dff['DeathTotal'] / dff[
+        'DeathTotal_Total']  # each age group deaths as a percentage of total yearly deaths
 
-dff['DeathTotal_Perc'] = dff['DeathTotal'] / dff[
-    'DeathTotal_Total']  # each age group deaths as a percentage of total yearly deaths
+    # Besides the bars, I want to draw a dynamic line with difference for 0-4-year-olds, so two points are needed:
 
-# Besides the bars, I want to draw a dynamic line with difference for 0-4-year-olds, so two points are needed:
+    # moving point
 
-# moving point
+    dffl1 = dff[dff['Age_Group_5Y'] == 4]
+    dffl1['Chart'] = 'line'
+    dffl1['Age_Group_5Y'] = 7  # line's X1 coordinate
+    dffl1['Order'] = 1
 
-dffl1 = dff[dff['Age_Group_5Y'] == 4]
-dffl1['Chart'] = 'line'
-dffl1['Age_Group_5Y'] = 7  # line's X1 coordinate
-dffl1['Order'] = 1
+    # constant point
 
-# constant point
+    dffl2 = dffl1.copy()
+    dffl2['DeathTotal'] = dffl1[dffl1['Time'] == 1950]['DeathTotal'].iloc[
+        0]  # line's Y0 coordinate: deaths in 1950 (19780141 for the world)
+    dffl2['DeathTotal_Perc'] = dffl1[dffl1['Time'] == 1950][
+        'DeathTotal_Perc'].iloc[0]  # percentage of the total as of 1950
+    dffl2['Order'] = 0
 
-dffl2 = dffl1.copy()
-dffl2['DeathTotal'] = 19780141.0  # line's Y0 coordinate: deaths in 1950
-dffl2['DeathTotal_Perc'] = 0.405426  # percentage of the total as of 1950
-dffl2['Order'] = 0
+    dffl = pd.concat(
+        [dffl1, dffl2],
+        ignore_index=True).sort_values(by=['Time', 'Age_Group_5Y', 'Order'])
 
-dffl = pd.concat(
-    [dffl1, dffl2],
-    ignore_index=True).sort_values(by=['Time', 'Age_Group_5Y', 'Order'])
+    # Adding the comparison data for 1950 to the bars:
 
-# Adding the comparison data for 1950 to the bars:
+    df1950 = dff[dff['Time'] == 1950][[
+        'Age_Group_5Y', 'DeathTotal', 'DeathTotal_Perc', 'DeathTotal_Total'
+    ]].drop_duplicates().set_index('Age_Group_5Y').rename(
+        columns={
+            'DeathTotal': 'DeathTotal_1950',
+            'DeathTotal_Perc': 'DeathTotal_Perc_1950',
+            'DeathTotal_Total': 'DeathTotal_Total_1950'
+        })
 
-df1950 = dff[dff['Time'] == 1950][[
-    'Age_Group_5Y', 'DeathTotal', 'DeathTotal_Perc', 'DeathTotal_Total'
-]].drop_duplicates().set_index('Age_Group_5Y').rename(
-    columns={
-        'DeathTotal': 'DeathTotal_1950',
-        'DeathTotal_Perc': 'DeathTotal_Perc_1950',
-        'DeathTotal_Total': 'DeathTotal_Total_1950'
-    })
+    dff = dff.set_index('Age_Group_5Y').join(df1950).reset_index()
 
-dff = dff.set_index('Age_Group_5Y').join(df1950).reset_index()
+    return dff, dffl
 
 
 # THE CHART ********************************************************************************************************************
 
 
-# The initial figure ***********************************************************************************************************
+# Hover labels of the moving bars (in the animation frames, they are compared with 1950):
 
-df_bar = dff[dff['Time'] == 1950]
-df_line = dffl[dffl['Time'] == 1950]
-
-fig = go.Figure(
-    go.Bar(x=df_bar["Age_Group_5Y"],
-           y=df_bar["DeathTotal"],
-           width=4,
-           marker_color='#404040',
-           marker_line=dict(color='#010101', width=4.5),
-           hoverinfo='none',
-           name='1950'))  # 1950 bars
-
-fig.add_trace(
-    go.Bar(
-        x=df_bar[df_bar['Age_Group_5Y'] != 4]["Age_Group_5Y"],
-        y=df_bar[df_bar['Age_Group_5Y'] != 4]["DeathTotal"],
-        width=4,
-        marker_color='rgba(217, 217, 217, 0.4)',
-        marker_line=dict(color='rgba(217, 217, 217, 1.0)', width=0.5),
-        customdata=np.stack(
-            (df_bar[df_bar['Age_Group_5Y'] != 4]['Time'],
-             df_bar[df_bar['Age_Group_5Y'] != 4]['Age_Group_Label'],
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal_Perc'],
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal_Total'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal_1950'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal_Perc_1950'],
-             df_bar[df_bar['Age_Group_5Y'] != 4]['DeathTotal_Total_1950'] /
-             1000000),
-            axis=-1),
-        hovertemplate='<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
-           <br><br>%{customdata[2]:,.1f}M people died in %{customdata[0]}\
-           <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)',
-        name='Other Groups'))  # moving bars without the 0-4-year-olds
-
-fig.add_trace(
-    go.Bar(
-        x=df_bar[df_bar['Age_Group_5Y'] == 4]["Age_Group_5Y"],
-        y=df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"],
-        width=4,
-        marker_color='rgba(204, 129, 46, 0.4)',
-        marker_line=dict(color='rgba(204, 129, 46, 1.0)', width=0.5),
-        customdata=np.stack(
-            (df_bar[df_bar['Age_Group_5Y'] == 4]['Time'],
-             df_bar[df_bar['Age_Group_5Y'] == 4]['Age_Group_Label'],
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal_Perc'],
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal_Total'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal_1950'] / 1000000,
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal_Perc_1950'],
-             df_bar[df_bar['Age_Group_5Y'] == 4]['DeathTotal_Total_1950'] /
-             1000000),
-            axis=-1),
-        hovertemplate='<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
+hovertemplate = '<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
            <br><br>%{customdata[2]:,.1f}M people died in %{customdata[0]}\
-           <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)',
-        name='5YO'))  # a moving bar for the 0-4-year-olds
-
-fig.add_trace(
-    go.Scatter(x=df_line["Age_Group_5Y"],
-               y=df_line["DeathTotal"],
-               mode='lines',
-               line=dict(color='rgba(204, 129, 46, 1.0)', width=2,
-                         dash='dash'),
-               hoverinfo='none',
-               name='Line'))  # a moving difference line
-
-fig.add_trace(
-    go.Scatter(
-        x=[14],
-        y=(df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"] + 19780141.0) / 2,
-        mode='text',
-        text=(df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"] - 19780141.0) /
-        1000000,
-        texttemplate="%{text:,.1f}M",
-        textfont=dict(color='#010101', family='American Typewriter', size=18),
-        textposition='middle left',
-        hoverinfo='none',
-        name='Line Label'))  # a moving difference line label
-
-# Title
-
-# The title is dynamic here, so the chart needs more traces.
-
-fig.add_trace(
-    go.Scatter(x=[45.5],
-               y=[18900000],
-               mode='text',
-               text='CHILDREN UNDER AGE 5:',
-               textfont=dict(color='rgba(204, 129, 46, 1.0)',
-                             family='Californian FB',
-                             size=33),
-               textposition='middle right',
-               name='Title-1',
-               hoverinfo='none'))  # title-1
-
-fig.add_trace(
-    go.Scatter(x=[64],
-               y=[15800000],
-               mode='text',
-               text=df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal_Perc"],
-               texttemplate="%{text:,.0%}",
-               textfont=dict(color='rgba(204, 129, 46, 0.9)',
-                             family='Californian FB',
-                             size=71),
-               textposition='middle left',
-               name='Title-2',
-               hoverinfo='none'))  # title-2
-
-fig.add_trace(
-    go.Scatter(x=[66],
-               y=[16750000],
-               mode='text',
-               text="OF THE WORLD'S DEATHS",
-               textfont=dict(color='rgba(217, 217, 217, 1.0)',
-                             family='Californian FB',
-                             size=21),
-               textposition='middle right',
-               name='Title-3',
-               hoverinfo='none'))  # title-3
-
-fig.add_trace(
-    go.Scatter(x=[66],
-               y=[15250000],
-               mode='text',
-               text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
-               texttemplate="IN %{text:.0f}",
-               textfont=dict(color='rgba(217, 217, 217, 1.0)',
-                             family='Californian FB',
-                             size=21),
-               textposition='middle right',
-               name='Title-4',
-               hoverinfo='none'))  # title-4
-
-# Legend
-
-# Same story with the legend.
-
-fig.add_trace(
-    go.Scatter(x=[106],
-               y=[11200000],
-               mode='text',
-               text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
-               texttemplate="DEATHS DISTRIBUTION BY AGE, UN:",
-               textfont=dict(color='rgba(217, 217, 217, 0.7)',
-                             family='Californian FB',
-                             size=18),
-               textposition='middle left',
-               name='Legend-Header',
-               hoverinfo='none'))  # legend-header
-
-fig.add_trace(
-    go.Scatter(x=[87.5],
-               y=[9800000],
-               mode='markers+text',
-               marker_symbol='square',
-               marker_size=14,
-               marker_color='rgba(217, 217, 217, 0.3)',
-               marker_line=dict(color='rgba(217, 217, 217, 1.0)', width=0.3),
-               text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
-               texttemplate=" %{text:.0f}",
-               textfont=dict(color='rgba(217, 217, 217, 0.7)',
-                             family='Californian FB',
-                             size=18),
-               textposition='middle right',
-               name='Legend-Marker-1',
-               hoverinfo='none'))  # legend-label-1
-
-fig.add_trace(
-    go.Scatter(x=[98.5],
-               y=[9800000],
-               mode='markers+text',
-               marker_symbol='square',
-               marker_size=14,
+           <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)'
+
+hovertemplate_frames = '<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
+               <br><br>%{customdata[2]:,.1f}M people died in %{customdata[0]}\
+               <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)\
+               <br><br>%{customdata[5]:,.1f}M people died in 1950\
+               <br>(%{customdata[6]:,.0%} of the %{customdata[7]:,.1f}M worldwide deaths)'
+
+
+# The chart was laid out for the world: the titles and the legend sit at fixed heights, in deaths. For another location, these
+# heights and the y axis are scaled by its tallest bar relative to the world's tallest one (the under-5s in 1950), and the
+# line starts at the location's own 1950 under-5 deaths.
+
+world_max = 19780141.0
+
+
+def chart_params(dff, dffl):
+    location = dff['Location'].iloc[0]
+
+    params = dict(
+        location=location,
+        anchor=float(dffl[dffl['Order'] == 0]['DeathTotal'].iloc[0]),
+        scale=float('{:.3g}'.format(dff['DeathTotal'].max() / world_max)),
+        hovertemplate=hovertemplate,
+        hovertemplate_frames=hovertemplate_frames,
+        title="OF THE WORLD'S DEATHS")
+
+    if location != 'World':
+        for key in ['hovertemplate', 'hovertemplate_frames']:
+            params[key] = params[key].replace('worldwide deaths',
+                                              'deaths in ' + location)
+        params['title'] = "OF {}'S DEATHS".format(location.upper())
+
+    return params
+
+
+def bar_customdata(bars):
+    return np.stack(
+        (bars['Time'], bars['Age_Group_Label'], bars['DeathTotal'] / 1000000,
+         bars['DeathTotal_Perc'], bars['DeathTotal_Total'] / 1000000,
+         bars['DeathTotal_1950'] / 1000000, bars['DeathTotal_Perc_1950'],
+         bars['DeathTotal_Total_1950'] / 1000000),
+        axis=-1)
+
+
+# With hover='lazy' (see "Lazy hover"), a moving bar carries just its key, the row of the data frame (+ the number of rows in
+# the frames, which are hovered with the other template), and its hover label is asked from the server when it's hovered:
+
+
+def bar_hover(bars, template=None, hover='embedded', offset=0):
+    if hover == 'lazy':
+        trace = dict(customdata=bars.index.to_numpy() + offset)
+        if template is not None:
+            trace['hoverinfo'] = 'none'
+        return trace
+
+    trace = dict(customdata=bar_customdata(bars))
+    if template is not None:
+        trace['hovertemplate'] = template
+    return trace
+
+
+# The initial figure ***********************************************************************************************************
+
+
+@profiled('day_08.build_figure')
+def build_figure(dff, dffl):
+    import plotly.graph_objects as go
+
+    params = chart_params(dff, dffl)
+
+    df_bar = dff[dff['Time'] == 1950]
+    df_line = dffl[dffl['Time'] == 1950]
+
+    fig = go.Figure(
+        go.Bar(x=df_bar["Age_Group_5Y"],
+               y=df_bar["DeathTotal"],
+               width=4,
                marker_color='#404040',
                marker_line=dict(color='#010101', width=4.5),
-               text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
-               texttemplate=" %{text:.0f}",
-               textfont=dict(color='rgba(217, 217, 217, 0.7)',
-                             family='Californian FB',
-                             size=18),
-               textposition='middle right',
-               name='Legend-Marker-2',
-               hoverinfo='none'))  # legend-label-2
+               hoverinfo='none',
+               name='1950'))  # 1950 bars
+
+    fig.add_trace(
+        go.Bar(
+            x=df_bar[df_bar['Age_Group_5Y'] != 4]["Age_Group_5Y"],
+            y=df_bar[df_bar['Age_Group_5Y'] != 4]["DeathTotal"],
+            width=4,
+            marker_color='rgba(217, 217, 217, 0.4)',
+            marker_line=dict(color='rgba(217, 217, 217, 1.0)', width=0.5),
+            customdata=bar_customdata(df_bar[df_bar['Age_Group_5Y'] != 4]),
+            hovertemplate=params['hovertemplate'],
+            name='Other Groups'))  # moving bars without the 0-4-year-olds
+
+    fig.add_trace(
+        go.Bar(
+            x=df_bar[df_bar['Age_Group_5Y'] == 4]["Age_Group_5Y"],
+            y=df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"],
+            width=4,
+            marker_color='rgba(204, 129, 46, 0.4)',
+            marker_line=dict(color='rgba(204, 129, 46, 1.0)', width=0.5),
+            customdata=bar_customdata(df_bar[df_bar['Age_Group_5Y'] == 4]),
+            hovertemplate=params['hovertemplate'],
+            name='5YO'))  # a moving bar for the 0-4-year-olds
+
+    fig.add_trace(
+        go.Scatter(x=df_line["Age_Group_5Y"],
+                   y=df_line["DeathTotal"],
+                   mode='lines',
+                   line=dict(color='rgba(204, 129, 46, 1.0)', width=2,
+                             dash='dash'),
+                   hoverinfo='none',
+                   name='Line'))  # a moving difference line
+
+    fig.add_trace(
+        go.Scatter(
+            x=[14],
+            y=(df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"] + params['anchor']) / 2,
+            mode='text',
+            text=(df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal"] - params['anchor']) /
+            1000000,
+            texttemplate="%{text:,.1f}M",
+            textfont=dict(color='#010101', family='American Typewriter', size=18),
+            textposition='middle left',
+            hoverinfo='none',
+            name='Line Label'))  # a moving difference line label
+
+    # Title
+
+    # The title is dynamic here, so the chart needs more traces.
+
+    fig.add_trace(
+        go.Scatter(x=[45.5],
+                   y=[18900000 * params['scale']],
+                   mode='text',
+                   text='CHILDREN UNDER AGE 5:',
+                   textfont=dict(color='rgba(204, 129, 46, 1.0)',
+                                 family='Californian FB',
+                                 size=33),
+                   textposition='middle right',
+                   name='Title-1',
+                   hoverinfo='none'))  # title-1
+
+    fig.add_trace(
+        go.Scatter(x=[64],
+                   y=[15800000 * params['scale']],
+                   mode='text',
+                   text=df_bar[df_bar['Age_Group_5Y'] == 4]["DeathTotal_Perc"],
+                   texttemplate="%{text:,.0%}",
+                   textfont=dict(color='rgba(204, 129, 46, 0.9)',
+                                 family='Californian FB',
+                                 size=71),
+                   textposition='middle left',
+                   name='Title-2',
+                   hoverinfo='none'))  # title-2
+
+    fig.add_trace(
+        go.Scatter(x=[66],
+                   y=[16750000 * params['scale']],
+                   mode='text',
+                   text=params['title'],
+                   textfont=dict(color='rgba(217, 217, 217, 1.0)',
+                                 family='Californian FB',
+                                 size=21),
+                   textposition='middle right',
+                   name='Title-3',
+                   hoverinfo='none'))  # title-3
+
+    fig.add_trace(
+        go.Scatter(x=[66],
+                   y=[15250000 * params['scale']],
+                   mode='text',
+                   text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
+                   texttemplate="IN %{text:.0f}",
+                   textfont=dict(color='rgba(217, 217, 217, 1.0)',
+                                 family='Californian FB',
+                                 size=21),
+                   textposition='middle right',
+                   name='Title-4',
+                   hoverinfo='none'))  # title-4
+
+    # Legend
+
+    # Same story with the legend.
+
+    fig.add_trace(
+        go.Scatter(x=[106],
+                   y=[11200000 * params['scale']],
+                   mode='text',
+                   text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
+                   texttemplate="DEATHS DISTRIBUTION BY AGE, UN:",
+                   textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                                 family='Californian FB',
+                                 size=18),
+                   textposition='middle left',
+                   name='Legend-Header',
+                   hoverinfo='none'))  # legend-header
+
+    fig.add_trace(
+        go.Scatter(x=[87.5],
+                   y=[9800000 * params['scale']],
+                   mode='markers+text',
+                   marker_symbol='square',
+                   marker_size=14,
+                   marker_color='rgba(217, 217, 217, 0.3)',
+                   marker_line=dict(color='rgba(217, 217, 217, 1.0)', width=0.3),
+                   text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
+                   texttemplate=" %{text:.0f}",
+                   textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                                 family='Californian FB',
+                                 size=18),
+                   textposition='middle right',
+                   name='Legend-Marker-1',
+                   hoverinfo='none'))  # legend-label-1
+
+    fig.add_trace(
+        go.Scatter(x=[98.5],
+                   y=[9800000 * params['scale']],
+                   mode='markers+text',
+                   marker_symbol='square',
+                   marker_size=14,
+                   marker_color='#404040',
+                   marker_line=dict(color='#010101', width=4.5),
+                   text=df_bar[df_bar['Age_Group_5Y'] == 4]["Time"],
+                   texttemplate=" %{text:.0f}",
+                   textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                                 family='Californian FB',
+                                 size=18),
+                   textposition='middle right',
+                   name='Legend-Marker-2',
+                   hoverinfo='none'))  # legend-label-2
+
+    frames, years = animation_frames(dff, dffl)
+    fig.update(frames=frames)
+
+    sliders, play_buttons = sliders_and_buttons(years)
+
+    update_layout(fig, sliders, play_buttons, params['scale'])
+    add_annotations(fig)
+
+    return fig
+
 
 # Animation frames *************************************************************************************************************
 
 # For each year of comparison, an animation frame is needed:
 
-years = dff['Time'].unique().tolist()
-n_frames = len(years)
 
-frames = []
+@profiled('day_08.animation_frames')
+def animation_frames(dff, dffl):
+    import plotly.graph_objects as go
 
-for i in range(n_frames):
+    params = chart_params(dff, dffl)
 
-    year = years[i]
-    dataframe = dff[dff['Time'] == year]
-    dataframe_l = dffl[dffl['Time'] == year]
-    data_for_frame = []
+    years = dff['Time'].unique().tolist()
+    n_frames = len(years)
 
-    data_for_frame.append(go.Bar())  # 1950 bars
+    frames = []
 
-    data_for_frame.append(
-        go.Bar(
-            x=dataframe[dataframe['Age_Group_5Y'] != 4]['Age_Group_5Y'],
-            y=dataframe[dataframe['Age_Group_5Y'] != 4]["DeathTotal"],
-            customdata=np.stack(
-                (dataframe[dataframe['Age_Group_5Y'] != 4]['Time'],
-                 dataframe[dataframe['Age_Group_5Y'] != 4]['Age_Group_Label'],
-                 dataframe[dataframe['Age_Group_5Y'] != 4]['DeathTotal'] /
-                 1000000,
-                 dataframe[dataframe['Age_Group_5Y'] != 4]['DeathTotal_Perc'],
-                 dataframe[dataframe['Age_Group_5Y'] != 4]['DeathTotal_Total']
-                 / 1000000,
-                 dataframe[dataframe['Age_Group_5Y'] != 4]['DeathTotal_1950'] /
-                 1000000, dataframe[
-                     dataframe['Age_Group_5Y'] != 4]['DeathTotal_Perc_1950'],
-                 dataframe[dataframe['Age_Group_5Y'] != 4]
-                 ['DeathTotal_Total_1950'] / 1000000),
-                axis=-1),
-            hovertemplate=
-            '<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
-               <br><br>%{customdata[2]:,.1f}M people died in %{customdata[0]}\
-               <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)\
-               <br><br>%{customdata[5]:,.1f}M people died in 1950\
-               <br>(%{customdata[6]:,.0%} of the %{customdata[7]:,.1f}M worldwide deaths)'
-        ))  # moving bars without the 0-4-year-olds
+    for i in range(n_frames):
 
-    data_for_frame.append(
-        go.Bar(
-            x=dataframe[dataframe['Age_Group_5Y'] == 4]['Age_Group_5Y'],
-            y=dataframe[dataframe['Age_Group_5Y'] == 4]["DeathTotal"],
-            customdata=np.stack(
-                (dataframe[dataframe['Age_Group_5Y'] == 4]['Time'],
-                 dataframe[dataframe['Age_Group_5Y'] == 4]['Age_Group_Label'],
-                 dataframe[dataframe['Age_Group_5Y'] == 4]['DeathTotal'] /
-                 1000000,
-                 dataframe[dataframe['Age_Group_5Y'] == 4]['DeathTotal_Perc'],
-                 dataframe[dataframe['Age_Group_5Y'] == 4]['DeathTotal_Total']
-                 / 1000000,
-                 dataframe[dataframe['Age_Group_5Y'] == 4]['DeathTotal_1950'] /
-                 1000000, dataframe[dataframe['Age_Group_5Y'] ==
-                                    4]['DeathTotal_Perc_1950'],
-                 dataframe[dataframe['Age_Group_5Y'] ==
-                           4]['DeathTotal_Total_1950'] / 1000000),
-                axis=-1),
-            hovertemplate=
-            '<extra></extra><b>Age Group: %{customdata[1]} y.o.</b>\
-               <br><br>%{customdata[2]:,.1f}M people died in %{customdata[0]}\
-               <br>(%{customdata[3]:,.0%} of the %{customdata[4]:,.1f}M worldwide deaths)\
-               <br><br>%{customdata[5]:,.1f}M people died in 1950\
-               <br>(%{customdata[6]:,.0%} of the %{customdata[7]:,.1f}M worldwide deaths)'
-        ))  # a moving bar for the 0-4-year-olds
+        year = years[i]
+        dataframe = dff[dff['Time'] == year]
+        dataframe_l = dffl[dffl['Time'] == year]
+        data_for_frame = []
 
-    data_for_frame.append(
-        go.Scatter(
-            y=dataframe_l["DeathTotal"],
-            line=dict(
-                color='rgba(204, 129, 46, 0.7)')))  # a moving difference line
+        data_for_frame.append(go.Bar())  # 1950 bars
 
-    data_for_frame.append(
-        go.Scatter(
-            y=(dataframe["DeathTotal"] + 19780141.0) / 2,
-            text=(dataframe[dataframe['Age_Group_5Y'] == 4]["DeathTotal"] -
-                  19780141.0) / 1000000,
-            textfont=dict(color='rgba(204, 129, 46, 0.7)',
-                          family='Bodoni MT Condensed',
-                          size=22)))  # a moving difference line label
+        data_for_frame.append(
+            go.Bar(
+                x=dataframe[dataframe['Age_Group_5Y'] != 4]['Age_Group_5Y'],
+                y=dataframe[dataframe['Age_Group_5Y'] != 4]["DeathTotal"],
+                customdata=bar_customdata(
+                    dataframe[dataframe['Age_Group_5Y'] != 4]),
+                hovertemplate=params['hovertemplate_frames']
+            ))  # moving bars without the 0-4-year-olds
 
-    data_for_frame.append(go.Scatter())  # title-1
+        data_for_frame.append(
+            go.Bar(
+                x=dataframe[dataframe['Age_Group_5Y'] == 4]['Age_Group_5Y'],
+                y=dataframe[dataframe['Age_Group_5Y'] == 4]["DeathTotal"],
+                customdata=bar_customdata(
+                    dataframe[dataframe['Age_Group_5Y'] == 4]),
+                hovertemplate=params['hovertemplate_frames']
+            ))  # a moving bar for the 0-4-year-olds
 
-    data_for_frame.append(
-        go.Scatter(text=dataframe[dataframe['Age_Group_5Y'] == 4]
-                   ["DeathTotal_Perc"]))  # title-2
+        data_for_frame.append(
+            go.Scatter(
+                y=dataframe_l["DeathTotal"],
+                line=dict(
+                    color='rgba(204, 129, 46, 0.7)')))  # a moving difference line
 
-    data_for_frame.append(go.Scatter())  # title-3
+        data_for_frame.append(
+            go.Scatter(
+                y=(dataframe["DeathTotal"] + params['anchor']) / 2,
+                text=(dataframe[dataframe['Age_Group_5Y'] == 4]["DeathTotal"] -
+                      params['anchor']) / 1000000,
+                textfont=dict(color='rgba(204, 129, 46, 0.7)',
+                              family='Bodoni MT Condensed',
+                              size=22)))  # a moving difference line label
 
-    data_for_frame.append(
-        go.Scatter(
-            text=dataframe[dataframe['Age_Group_5Y'] == 4]["Time"]))  # title-4
+        data_for_frame.append(go.Scatter())  # title-1
 
-    data_for_frame.append(go.Scatter())  # legend-header
+        data_for_frame.append(
+            go.Scatter(text=dataframe[dataframe['Age_Group_5Y'] == 4]
+                       ["DeathTotal_Perc"]))  # title-2
 
-    data_for_frame.append(
-        go.Scatter(text=dataframe[dataframe['Age_Group_5Y'] == 4]
-                   ["Time"]))  # legend-label-1
+        data_for_frame.append(go.Scatter())  # title-3
 
-    data_for_frame.append(go.Scatter())  # legend-label-2
+        data_for_frame.append(
+            go.Scatter(
+                text=dataframe[dataframe['Age_Group_5Y'] == 4]["Time"]))  # title-4
 
-    frames.append(
-        go.Frame(data=data_for_frame,
-                 traces=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
-                 name=f"fr{i}"))
+        data_for_frame.append(go.Scatter())  # legend-header
+
+        data_for_frame.append(
+            go.Scatter(text=dataframe[dataframe['Age_Group_5Y'] == 4]
+                       ["Time"]))  # legend-label-1
+
+        data_for_frame.append(go.Scatter())  # legend-label-2
+
+        frames.append(
+            go.Frame(data=data_for_frame,
+                     traces=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+                     name=f"fr{i}"))
+
+    return frames, years
 
-fig.update(frames=frames)
 
 # Slider and buttons ***********************************************************************************************************
 
-steps = []
-
-for i in range(n_frames):
-    year = years[i]
-    step = dict(label=year,
-                method='animate',
-                args=[[f"fr{i}"],
-                      dict(mode='immediate',
-                           frame=dict(duration=1000, redraw=False),
-                           transition=dict(duration=500))])
-    steps.append(step)
-
-sliders = [
-    dict(transition=dict(duration=250),
-         x=0.164,
-         y=-0.13,
-         len=0.811,
-         currentvalue=dict(visible=False),
-         steps=steps,
-         active=0,
-         bgcolor='rgba(217, 217, 217, 1.0)',
-         bordercolor='#010101',
-         borderwidth=4,
-         activebgcolor='rgba(204, 129, 46, 1.0)',
-         font=dict(color='#010101', family='Bodoni MT Condensed', size=1),
-         ticklen=3,
-         minorticklen=3,
-         tickcolor='#010101')
-]
-
-play_buttons = [{
-    'type':
-    'buttons',
-    'showactive':
-    False,
-    'bgcolor':
-    'rgba(217, 217, 217, 0.3)',
-    'bordercolor':
-    'rgba(217, 217, 217, 1.0)',
-    'font': {
-        'color': 'rgba(217, 217, 217, 1.0)',
-        'family': 'Bodoni MT Condensed',
-        'size': 15
-    },
-    "direction":
-    "left",
-    'x':
-    0.11,
-    'y':
-    -0.17,
-    'buttons': [{
-        'label':
-        '▶',
-        'method':
-        'animate',
-        'args': [
-            None, {
+
+def sliders_and_buttons(years):
+    n_frames = len(years)
+
+    steps = []
+
+    for i in range(n_frames):
+        year = years[i]
+        step = dict(label=str(year),
+                    method='animate',
+                    args=[[f"fr{i}"],
+                          dict(mode='immediate',
+                               frame=dict(duration=1000, redraw=False),
+                               transition=dict(duration=500))])
+        steps.append(step)
+
+    sliders = [
+        dict(transition=dict(duration=250),
+             x=0.164,
+             y=-0.13,
+             len=0.811,
+             currentvalue=dict(visible=False),
+             steps=steps,
+             active=0,
+             bgcolor='rgba(217, 217, 217, 1.0)',
+             bordercolor='#010101',
+             borderwidth=4,
+             activebgcolor='rgba(204, 129, 46, 1.0)',
+             font=dict(color='#010101', family='Bodoni MT Condensed', size=1),
+             ticklen=3,
+             minorticklen=3,
+             tickcolor='#010101')
+    ]
+
+    play_buttons = [{
+        'type':
+        'buttons',
+        'showactive':
+        False,
+        'bgcolor':
+        'rgba(217, 217, 217, 0.3)',
+        'bordercolor':
+        'rgba(217, 217, 217, 1.0)',
+        'font': {
+            'color': 'rgba(217, 217, 217, 1.0)',
+            'family': 'Bodoni MT Condensed',
+            'size': 15
+        },
+        "direction":
+        "left",
+        'x':
+        0.11,
+        'y':
+        -0.17,
+        'buttons': [{
+            'label':
+            '▶',
+            'method':
+            'animate',
+            'args': [
+                None, {
+                    'frame': {
+                        'duration': 250,
+                        'redraw': False
+                    },
+                    'transition': {
+                        'duration': 250
+                    },
+                    'fromcurrent': True,
+                    'mode': 'immediate',
+                }
+            ]
+        }, {
+            'label':
+            '◼',
+            'method':
+            'animate',
+            'args': [[None], {
                 'frame': {
-                    'duration': 250,
+                    'duration': 0,
                     'redraw': False
                 },
                 'transition': {
-                    'duration': 250
+                    'duration': 0
                 },
-                'fromcurrent': True,
                 'mode': 'immediate',
-            }
-        ]
-    }, {
-        'label':
-        '◼',
-        'method':
-        'animate',
-        'args': [[None], {
-            'frame': {
-                'duration': 0,
-                'redraw': False
-            },
-            'transition': {
-                'duration': 0
-            },
-            'mode': 'immediate',
+            }]
         }]
     }]
-}]
+
+    return sliders, play_buttons
+
 
 # Layout ***********************************************************************************************************************
 
-fig.update_layout(sliders=sliders,
-                  updatemenus=play_buttons,
-                  margin={
-                      'l': 93,
-                      'r': 63,
-                      't': 11,
-                      'b': 164,
-                      'pad': 5.5
-                  },
-                  barmode='overlay',
-                  width=850,
-                  height=630,
-                  bargap=0.2,
-                  plot_bgcolor='#010101',
-                  paper_bgcolor='#010101',
-                  showlegend=False,
-                  hoverlabel={'font': {
-                      'size': 17,
-                      'family': 'Californian FB'
-                  }},
-                  xaxis={
-                      'range': [1, 110],
-                      'title':
-                      None,
-                      'showgrid':
-                      False,
-                      'zeroline':
-                      False,
-                      'tickvals': [
-                          2.5, 7.5, 13, 18, 23, 28, 33, 38, 43, 48, 53, 58, 63,
-                          68, 73, 78, 83, 88, 93, 98, 103.5
-                      ],
-                      'ticktext': [
-                          0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65,
-                          70, 75, 80, 85, 90, 95, 100
-                      ],
-                      'tickfont': {
-                          'color': 'rgba(217, 217, 217, 0.6)',
-                          'family': 'Bodoni MT Condensed',
-                          'size': 15
-                      }
-                  },
-                  yaxis={
-                      'range': [-5, 23000000.0],
-                      'title': None,
-                      'showgrid': False,
-                      'zeroline': False,
-                      'tickvals': [5000000, 10000000, 15000000],
-                      'ticktext': ['5M', '10M', '15M'],
-                      'tickfont': {
-                          'color': 'rgba(217, 217, 217, 0.6)',
-                          'family': 'Bodoni MT Condensed',
-                          'size': 15
-                      }
-                  })
+
+def y_ticks(scale=1.0):
+
+    # 5M, 10M, 15M for the world; for a smaller location, the closest round step to 5M x scale:
+
+    step = 5000000 * scale
+    power = 10**np.floor(np.log10(step))
+    step = min([1, 2, 2.5, 5, 10], key=lambda m: abs(m * power - step)) * power
+
+    tickvals = [float(step * k) for k in range(1, 4)]
+    ticktext = [
+        '{:g}M'.format(v / 1000000) if step >= 1000000 else '{:g}K'.format(
+            v / 1000) for v in tickvals
+    ]
+
+    return tickvals, ticktext
+
+
+def layout_dict(sliders, play_buttons, scale=1.0):
+    tickvals, ticktext = y_ticks(scale)
+
+    return dict(sliders=sliders,
+                updatemenus=play_buttons,
+                margin={
+                    'l': 93,
+                    'r': 63,
+                    't': 11,
+                    'b': 164,
+                    'pad': 5.5
+                },
+                barmode='overlay',
+                width=850,
+                height=630,
+                bargap=0.2,
+                plot_bgcolor='#010101',
+                paper_bgcolor='#010101',
+                showlegend=False,
+                hoverlabel={'font': {
+                    'size': 17,
+                    'family': 'Californian FB'
+                }},
+                xaxis={
+                    'range': [1, 110],
+                    'title':
+                    None,
+                    'showgrid':
+                    False,
+                    'zeroline':
+                    False,
+                    'tickvals': [
+                        2.5, 7.5, 13, 18, 23, 28, 33, 38, 43, 48, 53, 58, 63,
+                        68, 73, 78, 83, 88, 93, 98, 103.5
+                    ],
+                    'ticktext': [
+                        0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65,
+                        70, 75, 80, 85, 90, 95, 100
+                    ],
+                    'tickfont': {
+                        'color': 'rgba(217, 217, 217, 0.6)',
+                        'family': 'Bodoni MT Condensed',
+                        'size': 15
+                    }
+                },
+                yaxis={
+                    'range': [-5, 23000000.0 * scale],
+                    'title': None,
+                    'showgrid': False,
+                    'zeroline': False,
+                    'tickvals': tickvals,
+                    'ticktext': ticktext,
+                    'tickfont': {
+                        'color': 'rgba(217, 217, 217, 0.6)',
+                        'family': 'Bodoni MT Condensed',
+                        'size': 15
+                    }
+                })
+
+
+@profiled('day_08.update_layout')
+def update_layout(fig, sliders, play_buttons, scale=1.0):
+    fig.update_layout(**layout_dict(sliders, play_buttons, scale))
+
 
 # Annotations ******************************************************************************************************************
 
 # This part has to be done because of Plotly's properties, just for the sake of beauty. The slider ticks don't divide values
 # by 5 or 10 automatically (by 3 for some reason), so I'll do it manually.
 
-t = 1950
-x = 20.25
-for n in range(16):
-    fig.add_annotation(x=x,
-                       y=-0.28,
-                       yref='paper',
-                       text=t,
-                       showarrow=False,
-                       font=dict(color='rgba(217, 217, 217, 5.0)',
-                                 family='Bodoni MT Condensed',
-                                 size=15),
-                       align='center')  # labels
-    t += 5
-    x += 6.01
-
-t = '|'
-x = 20.5
-for n in range(16):
-    fig.add_annotation(x=x,
-                       y=-0.23,
-                       yref='paper',
-                       text=t,
-                       showarrow=False,
-                       font=dict(color='rgba(217, 217, 217, 1.0)',
-                                 family='Bodoni MT Condensed',
-                                 size=4),
-                       align='center')  # 'ticks'
-    x += 6.01
-
-# Axis names I'll also make manually just for designing purposes:
-
-fig.add_annotation(xref="paper",
-                   yref="paper",
-                   showarrow=False,
-                   text="Age:",
-                   x=-0.05,
-                   y=-0.063,
-                   font=dict(color='rgba(217, 217, 217, 0.6)',
-                             family='Bodoni MT Condensed',
-                             size=18))  # X-axes-1
-
-fig.add_annotation(xref="paper",
-                   yref="paper",
-                   showarrow=False,
-                   text="y. o.",
-                   x=1.015,
-                   y=-0.063,
-                   font=dict(color='rgba(217, 217, 217, 0.6)',
-                             family='Bodoni MT Condensed',
-                             size=18))  # X-axes-2
-
-fig.add_annotation(xref="paper",
-                   yref="paper",
-                   showarrow=False,
-                   text="Deaths",
-                   x=-0.065,
-                   y=0.93,
-                   font=dict(color='rgba(217, 217, 217, 0.6)',
-                             family='Bodoni MT Condensed',
-                             size=18))  # Y-axes
-
-fig.show()
\ No newline at end of file
+
+def annotations():
+
+    annotations = []
+
+    t = 1950
+    x = 20.25
+    for n in range(16):
+        annotations.append(dict(x=x,
+                                y=-0.28,
+                                yref='paper',
+                                text=str(t),
+                                showarrow=False,
+                                font=dict(color='rgba(217, 217, 217, 5.0)',
+                                          family='Bodoni MT Condensed',
+                                          size=15),
+                                align='center'))  # labels
+        t += 5
+        x += 6.01
+
+    t = '|'
+    x = 20.5
+    for n in range(16):
+        annotations.append(dict(x=x,
+                                y=-0.23,
+                                yref='paper',
+                                text=t,
+                                showarrow=False,
+                                font=dict(color='rgba(217, 217, 217, 1.0)',
+                                          family='Bodoni MT Condensed',
+                                          size=4),
+                                align='center'))  # 'ticks'
+        x += 6.01
+
+    # Axis names I'll also make manually just for designing purposes:
+
+    annotations.append(dict(xref="paper",
+                            yref="paper",
+                            showarrow=False,
+                            text="Age:",
+                            x=-0.05,
+                            y=-0.063,
+                            font=dict(color='rgba(217, 217, 217, 0.6)',
+                                      family='Bodoni MT Condensed',
+                                      size=18)))  # X-axes-1
+
+    annotations.append(dict(xref="paper",
+                            yref="paper",
+                            showarrow=False,
+                            text="y. o.",
+                            x=1.015,
+                            y=-0.063,
+                            font=dict(color='rgba(217, 217, 217, 0.6)',
+                                      family='Bodoni MT Condensed',
+                                      size=18)))  # X-axes-2
+
+    annotations.append(dict(xref="paper",
+                            yref="paper",
+                            showarrow=False,
+                            text="Deaths",
+                            x=-0.065,
+                            y=0.93,
+                            font=dict(color='rgba(217, 217, 217, 0.6)',
+                                      family='Bodoni MT Condensed',
+                                      size=18)))  # Y-axes
+
+    return annotations
+
+
+@profiled('day_08.add_annotations')
+def add_annotations(fig):
+    for annotation in annotations():
+        fig.add_annotation(**annotation)
+
+
+@profiled('day_08.make_figure')
+def make_figure(path=WPP_PATH, location='World'):
+    dff, dffl = prepare_data(path, location)
+    return build_figure(dff, dffl)
+
+
+# Figure cache *****************************************************************************************************************
+
+# The built figure is kept as json. A cache hit is served as is: neither pandas nor plotly is imported then. The cached figure
+# is stale once the WPP file is newer (with path=None, it never is, e.g. in a refresh snapshot). The lazy-hover figure (see
+# "Lazy hover") is cached under its own name, with its hover table next to it.
+
+
+# (the hits and misses, for dashboard/server.py's /metrics)
+
+figure_cache_stats = dict(hits=0, misses=0)
+
+
+@profiled('day_08.figure_json')
+def figure_json(path=WPP_PATH,
+                cache_dir=FIGURE_CACHE,
+                location='World',
+                hover='embedded'):
+    cache_path = os.path.join(
+        cache_dir, 'day_08_{}{}.json'.format(
+            location, '' if hover == 'embedded' else '_' + hover))
+
+    if os.path.exists(cache_path) and (path is None or
+                                       not os.path.exists(path) or
+                                       os.path.getmtime(cache_path) >=
+                                       os.path.getmtime(path)):
+        figure_cache_stats['hits'] += 1
+        with open(cache_path) as f:
+            return f.read()
+
+    figure_cache_stats['misses'] += 1
+
+    if hover == 'lazy':
+        dff, dffl = prepare_data(path, location)
+        write_hover_table(dff, dffl, hover_table_path(cache_dir, location))
+        fig_json = dumps(figure_dict(dff, dffl, hover='lazy'))
+    else:
+        fig_json = make_figure(path, location).to_json()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(tmp_path(cache_path), 'w') as f:
+        f.write(fig_json)
+    os.replace(tmp_path(cache_path), cache_path)
+
+    return fig_json
+
+
+# Plain-dict figure ************************************************************************************************************
+
+# With 72 frames x 12 traces, most of the build time goes to plotly's validators (every property assignment goes through them)
+# and then to fig.to_json(). figure_dict() is an opt-in builder of the same figure as plain dicts of numpy arrays: it is never
+# validated, unless validate=True, in which case the whole thing is passed through go.Figure once at the end. dumps() then
+# serializes it with orjson, which handles the arrays natively (or with the standard json module, if orjson isn't installed).
+# benchmarks/figure_benchmark.py checks that the output is the same as build_figure() + to_json().
+
+
+# The parts of the frame traces that are the same in every year:
+
+
+def frame_template(params, hover='embedded'):
+    frame_hover = dict(hoverinfo='none') if hover == 'lazy' else dict(
+        hovertemplate=params['hovertemplate_frames'])
+
+    return [
+        dict(type='bar'),  # 1950 bars
+        dict(type='bar', **frame_hover),  # moving bars without the 0-4-year-olds
+        dict(type='bar', **frame_hover),  # a moving bar for the 0-4-year-olds
+        dict(type='scatter', line=dict(color='rgba(204, 129, 46, 0.7)')
+             ),  # a moving difference line
+        dict(type='scatter',
+             textfont=dict(color='rgba(204, 129, 46, 0.7)',
+                           family='Bodoni MT Condensed',
+                           size=22)),  # a moving difference line label
+        dict(type='scatter'),  # title-1
+        dict(type='scatter'),  # title-2
+        dict(type='scatter'),  # title-3
+        dict(type='scatter'),  # title-4
+        dict(type='scatter'),  # legend-header
+        dict(type='scatter'),  # legend-label-1
+        dict(type='scatter')  # legend-label-2
+    ]
+
+
+@profiled('day_08.figure_dict')
+def figure_dict(dff, dffl, validate=False, with_frames=True, hover='embedded'):
+    params = chart_params(dff, dffl)
+
+    df_bar = dff[dff['Time'] == 1950]
+    df_line = dffl[dffl['Time'] == 1950]
+    df_bar_5 = df_bar[df_bar['Age_Group_5Y'] == 4]
+    df_bar_other = df_bar[df_bar['Age_Group_5Y'] != 4]
+
+    data = [
+        dict(type='bar',
+             x=df_bar['Age_Group_5Y'].to_numpy(),
+             y=df_bar['DeathTotal'].to_numpy(),
+             width=4,
+             marker=dict(color='#404040',
+                         line=dict(color='#010101', width=4.5)),
+             hoverinfo='none',
+             name='1950'),  # 1950 bars
+        dict(type='bar',
+             x=df_bar_other['Age_Group_5Y'].to_numpy(),
+             y=df_bar_other['DeathTotal'].to_numpy(),
+             width=4,
+             marker=dict(color='rgba(217, 217, 217, 0.4)',
+                         line=dict(color='rgba(217, 217, 217, 1.0)',
+                                   width=0.5)),
+             **bar_hover(df_bar_other, params['hovertemplate'], hover),
+             name='Other Groups'),  # moving bars without the 0-4-year-olds
+        dict(type='bar',
+             x=df_bar_5['Age_Group_5Y'].to_numpy(),
+             y=df_bar_5['DeathTotal'].to_numpy(),
+             width=4,
+             marker=dict(color='rgba(204, 129, 46, 0.4)',
+                         line=dict(color='rgba(204, 129, 46, 1.0)',
+                                   width=0.5)),
+             **bar_hover(df_bar_5, params['hovertemplate'], hover),
+             name='5YO'),  # a moving bar for the 0-4-year-olds
+        dict(type='scatter',
+             x=df_line['Age_Group_5Y'].to_numpy(),
+             y=df_line['DeathTotal'].to_numpy(),
+             mode='lines',
+             line=dict(color='rgba(204, 129, 46, 1.0)', width=2, dash='dash'),
+             hoverinfo='none',
+             name='Line'),  # a moving difference line
+        dict(type='scatter',
+             x=[14],
+             y=((df_bar_5['DeathTotal'] + params['anchor']) / 2).to_numpy(),
+             mode='text',
+             text=((df_bar_5['DeathTotal'] - params['anchor']) / 1000000).to_numpy(),
+             texttemplate='%{text:,.1f}M',
+             textfont=dict(color='#010101',
+                           family='American Typewriter',
+                           size=18),
+             textposition='middle left',
+             hoverinfo='none',
+             name='Line Label'),  # a moving difference line label
+        dict(type='scatter',
+             x=[45.5],
+             y=[18900000 * params['scale']],
+             mode='text',
+             text='CHILDREN UNDER AGE 5:',
+             textfont=dict(color='rgba(204, 129, 46, 1.0)',
+                           family='Californian FB',
+                           size=33),
+             textposition='middle right',
+             name='Title-1',
+             hoverinfo='none'),  # title-1
+        dict(type='scatter',
+             x=[64],
+             y=[15800000 * params['scale']],
+             mode='text',
+             text=df_bar_5['DeathTotal_Perc'].to_numpy(),
+             texttemplate='%{text:,.0%}',
+             textfont=dict(color='rgba(204, 129, 46, 0.9)',
+                           family='Californian FB',
+                           size=71),
+             textposition='middle left',
+             name='Title-2',
+             hoverinfo='none'),  # title-2
+        dict(type='scatter',
+             x=[66],
+             y=[16750000 * params['scale']],
+             mode='text',
+             text=params['title'],
+             textfont=dict(color='rgba(217, 217, 217, 1.0)',
+                           family='Californian FB',
+                           size=21),
+             textposition='middle right',
+             name='Title-3',
+             hoverinfo='none'),  # title-3
+        dict(type='scatter',
+             x=[66],
+             y=[15250000 * params['scale']],
+             mode='text',
+             text=df_bar_5['Time'].to_numpy(),
+             texttemplate='IN %{text:.0f}',
+             textfont=dict(color='rgba(217, 217, 217, 1.0)',
+                           family='Californian FB',
+                           size=21),
+             textposition='middle right',
+             name='Title-4',
+             hoverinfo='none'),  # title-4
+        dict(type='scatter',
+             x=[106],
+             y=[11200000 * params['scale']],
+             mode='text',
+             text=df_bar_5['Time'].to_numpy(),
+             texttemplate='DEATHS DISTRIBUTION BY AGE, UN:',
+             textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                           family='Californian FB',
+                           size=18),
+             textposition='middle left',
+             name='Legend-Header',
+             hoverinfo='none'),  # legend-header
+        dict(type='scatter',
+             x=[87.5],
+             y=[9800000 * params['scale']],
+             mode='markers+text',
+             marker=dict(symbol='square',
+                         size=14,
+                         color='rgba(217, 217, 217, 0.3)',
+                         line=dict(color='rgba(217, 217, 217, 1.0)',
+                                   width=0.3)),
+             text=df_bar_5['Time'].to_numpy(),
+             texttemplate=' %{text:.0f}',
+             textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                           family='Californian FB',
+                           size=18),
+             textposition='middle right',
+             name='Legend-Marker-1',
+             hoverinfo='none'),  # legend-label-1
+        dict(type='scatter',
+             x=[98.5],
+             y=[9800000 * params['scale']],
+             mode='markers+text',
+             marker=dict(symbol='square',
+                         size=14,
+                         color='#404040',
+                         line=dict(color='#010101', width=4.5)),
+             text=df_bar_5['Time'].to_numpy(),
+             texttemplate=' %{text:.0f}',
+             textfont=dict(color='rgba(217, 217, 217, 0.7)',
+                           family='Californian FB',
+                           size=18),
+             textposition='middle right',
+             name='Legend-Marker-2',
+             hoverinfo='none')  # legend-label-2
+    ]
+
+    # Animation frames: the same traces as in animation_frames(), only the moving parts (the rest is in frame_template()).
+
+    years = dff['Time'].unique().tolist()
+    template = frame_template(params, hover)
+
+    frames = []
+
+    for i, year in enumerate(years if with_frames else []):
+        dataframe = dff[dff['Time'] == year]
+        dataframe_l = dffl[dffl['Time'] == year]
+        dataframe_5 = dataframe[dataframe['Age_Group_5Y'] == 4]
+        dataframe_other = dataframe[dataframe['Age_Group_5Y'] != 4]
+
+        moving = [
+            dict(),  # 1950 bars
+            dict(x=dataframe_other['Age_Group_5Y'].to_numpy(),
+                 y=dataframe_other['DeathTotal'].to_numpy(),
+                 **bar_hover(dataframe_other, hover=hover, offset=len(dff))
+                 ),  # moving bars without the 0-4-year-olds
+            dict(x=dataframe_5['Age_Group_5Y'].to_numpy(),
+                 y=dataframe_5['DeathTotal'].to_numpy(),
+                 **bar_hover(dataframe_5, hover=hover, offset=len(dff))
+                 ),  # a moving bar for the 0-4-year-olds
+            dict(y=dataframe_l['DeathTotal'].to_numpy()
+                 ),  # a moving difference line
+            dict(y=((dataframe['DeathTotal'] + params['anchor']) / 2).to_numpy(),
+                 text=((dataframe_5['DeathTotal'] - params['anchor']) /
+                       1000000).to_numpy()),  # a moving difference line label
+            dict(),  # title-1
+            dict(text=dataframe_5['DeathTotal_Perc'].to_numpy()),  # title-2
+            dict(),  # title-3
+            dict(text=dataframe_5['Time'].to_numpy()),  # title-4
+            dict(),  # legend-header
+            dict(text=dataframe_5['Time'].to_numpy()),  # legend-label-1
+            dict()  # legend-label-2
+        ]
+
+        frames.append(
+            dict(data=[dict(trace, **update) for trace, update in zip(template, moving)],
+                 traces=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+                 name=f"fr{i}"))
+
+    sliders, play_buttons = sliders_and_buttons(years)
+
+    layout = layout_dict(sliders, play_buttons, params['scale'])
+    layout['annotations'] = annotations()
+    layout['template'] = default_template()
+
+    fig = dict(data=data, layout=layout)
+    if with_frames:
+        fig['frames'] = frames
+
+    if validate:
+        import plotly.graph_objects as go
+        go.Figure(fig)
+
+    return fig
+
+
+# Compact frames ***************************************************************************************************************
+
+# The 72 frames are most of the figure's json, and they repeat the same structure, hovertemplates and fonts with different
+# numbers. For the html export (export/html_export.py), the figure goes without its frames (figure_dict(with_frames=False)),
+# with the numbers that move as one year x age group matrix (plus the yearly totals and the anchor of the line) and the frame
+# template above. frames_script() runs in the page right after the plot is drawn: it rebuilds the same frames from these, in
+# the browser, and adds them under the same names (fr0, fr1...), so the slider and the play buttons work as before. The
+# customdata comes as numbers rather than numpy's strings; the hovertemplates format them the same way.
+
+
+def compact_frames(dff, dffl):
+    params = chart_params(dff, dffl)
+
+    deaths = dff.pivot(index='Time', columns='Age_Group_5Y', values='DeathTotal')
+    labels = dff.drop_duplicates('Age_Group_5Y').set_index(
+        'Age_Group_5Y')['Age_Group_Label']
+
+    return dict(years=deaths.index.to_numpy(),
+                ages=deaths.columns.to_numpy(),
+                labels=labels[deaths.columns].tolist(),
+                deaths=deaths.to_numpy(),
+                totals=dff.groupby('Time')['DeathTotal_Total'].first().to_numpy(),
+                anchor=params['anchor'],
+                template=frame_template(params))
+
+
+frames_js = """
+(function () {
+    var gd = document.getElementById('{plot_id}');
+    var c = COMPACT_FRAMES;
+
+    var five = c.ages.indexOf(4);
+    var others = c.ages.map(function (age, k) { return k; }).filter(function (k) { return k !== five; });
+    var base = c.years.indexOf(1950);
+
+    var frames = c.years.map(function (year, i) {
+        var deaths = c.deaths[i];
+        var total = c.totals[i];
+
+        function customdata(k) {
+            return [year, c.labels[k], deaths[k] / 1000000, deaths[k] / total, total / 1000000,
+                    c.deaths[base][k] / 1000000, c.deaths[base][k] / c.totals[base], c.totals[base] / 1000000];
+        }
+
+        var moving = [
+            {},
+            {x: others.map(function (k) { return c.ages[k]; }),
+             y: others.map(function (k) { return deaths[k]; }),
+             customdata: others.map(customdata)},
+            {x: [c.ages[five]], y: [deaths[five]], customdata: [customdata(five)]},
+            {y: [c.anchor, deaths[five]]},
+            {y: deaths.map(function (d) { return (d + c.anchor) / 2; }),
+             text: [(deaths[five] - c.anchor) / 1000000]},
+            {},
+            {text: [deaths[five] / total]},
+            {},
+            {text: [year]},
+            {},
+            {text: [year]},
+            {}
+        ];
+
+        return {
+            name: 'fr' + i,
+            traces: c.template.map(function (trace, k) { return k; }),
+            data: c.template.map(function (trace, k) { return Object.assign({}, trace, moving[k]); })
+        };
+    });
+
+    Plotly.addFrames(gd, frames);
+})();
+"""
+
+
+def frames_script(compact):
+    return frames_js.replace('COMPACT_FRAMES', dumps(compact))
+
+
+# Lazy hover *******************************************************************************************************************
+
+# Most of the figure's json is the hover data of the moving bars: 8 customdata columns for every bar of every frame, and hardly
+# any of them is ever hovered. With hover='lazy', a bar carries a single integer key instead (see bar_hover()) and
+# hoverinfo='none': plotly.js draws no label then, but still sends the hover event, and the page asks the server for the label
+# of that key (see dashboard/server.py). The labels are made here from a small table written next to the cached figure (the
+# year x age group matrix of compact_frames() and the location's hovertemplates), filled in as plotly.js fills them.
+
+
+def hover_table_path(cache_dir=FIGURE_CACHE, location='World'):
+    return os.path.join(cache_dir, 'day_08_{}_hover.json'.format(location))
+
+
+def write_hover_table(dff, dffl, table_path):
+    params = chart_params(dff, dffl)
+
+    table = compact_frames(dff, dffl)
+    del table['template']
+    table['hovertemplates'] = [
+        params['hovertemplate'], params['hovertemplate_frames']
+    ]
+
+    os.makedirs(os.path.dirname(table_path) or '.', exist_ok=True)
+    with open(tmp_path(table_path), 'w') as f:
+        f.write(dumps(table))
+    os.replace(tmp_path(table_path), table_path)
+
+
+@functools.lru_cache(maxsize=8)
+def read_hover_table(table_path, mtime):
+    with open(table_path) as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=4096)
+def table_label(table_path, mtime, key):
+    table = read_hover_table(table_path, mtime)
+
+    years, ages, deaths, totals = (table['years'], table['ages'],
+                                   table['deaths'], table['totals'])
+
+    frames, row = divmod(key, len(years) * len(ages))  # (see bar_hover())
+    i, k = divmod(row, len(ages))
+    base = years.index(1950)
+
+    return hover_label(table['hovertemplates'][min(frames, 1)], [
+        years[i], table['labels'][k], deaths[i][k] / 1000000,
+        deaths[i][k] / totals[i], totals[i] / 1000000,
+        deaths[base][k] / 1000000, deaths[base][k] / totals[base],
+        totals[base] / 1000000
+    ])
+
+
+@profiled('day_08.hover_text')
+def hover_text(key, location='World', path=WPP_PATH, cache_dir=FIGURE_CACHE):
+    table_path = hover_table_path(cache_dir, location)
+
+    if not os.path.exists(table_path) or (
+            path is not None and os.path.exists(path) and
+            os.path.getmtime(path) > os.path.getmtime(table_path)):
+        figure_json(path, cache_dir, location, hover='lazy')
+
+    # (the labels are cached by key, and by the table's mtime, so a rebuilt table isn't served from the old labels)
+
+    return table_label(table_path, os.path.getmtime(table_path), int(key))
+
+
+if __name__ == '__main__':
+
+    fig = make_figure()
+
+    fig.show()
@@ -1,84 +1,372 @@
 # PACKAGES *********************************************************************************************************************
 
-import pandas as pd
-import numpy as np
+import os
+import sys
+import json
+import functools
 
-import plotly.graph_objects as go
+import numpy as np
 
 import warnings
 
 warnings.filterwarnings('ignore')
 
+# pandas and plotly.graph_objects (the latter alone pulls in hundreds of validator modules) are imported lazily, inside the
+# functions that prepare the raw data or build the figure. Loading the store or serving a cached figure needs only json and
+# numpy.
+
+# PROFILING ********************************************************************************************************************
+
+# Each stage of the pipeline runs inside a named span, and every file here is written to a temporary file first, then moved
+# into place (tmp_path()). Both come from common/profiling.py, shared by the three charts (with how to switch profiling on).
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.profiling import profiled, tmp_path
+from common.figures import default_template, dumps, hover_label, roll_up
+
+
 # THE DATA *********************************************************************************************************************
 
-df = pd.read_csv(
-    'globalterrorismdb.csv', index_col=0
-)  # I merged the databases for 1970-2020 and for 2021 from https://www.start.umd.edu/gtd/
+GTD_PATH = 'globalterrorismdb.csv'  # I merged the databases for 1970-2020 and for 2021 from https://www.start.umd.edu/gtd/
+
+# Reading the whole GTD and ranking it takes a while, and on the dashboard every worker process would keep its own pandas copy
+# of the result. So the country x year attacks and ranks are written once into a flat binary table (.npy) with a small json
+# index of the countries. Each worker only memory-maps the table read-only, so the pages are shared through the OS page cache,
+# and a cold start is just an mmap plus an index load.
+
+STORE_PATH = 'day_09_ranks'  # -> day_09_ranks.npy (attacks/rank x country x year) + day_09_ranks.json (the index)
+FIGURE_CACHE = 'figure_cache'  # built figures as json
+PAYLOAD_PATH = 'day_09_payloads'  # -> day_09_payloads.npz, the traces of every country (see "Country payloads")
+
+# Besides the number of attacks (events), the countries can be ranked by their fatalities, wounded, or casualties (fatalities +
+# wounded). All four are summed in the same groupby and kept in the store, so switching the metric doesn't touch the GTD
+# again:
+
+metrics = ['events', 'fatalities', 'wounded', 'casualties']
+metric_units = {
+    'events': 'attacks',
+    'fatalities': 'killed',
+    'wounded': 'wounded',
+    'casualties': 'casualties'
+}
+
+# The windows the dashboard offers (any number of years works, see "Time windows") and the levels of the store (see "Binary
+# store"): a refresh snapshot has the payloads of every window, metric and level.
+
+windows = [1, 3, 5, 'decade']
+level_names = ['country', 'region', 'world']
 
 # In this example, I'll build a chart for the U.S. and for Afghanistan, the first in 1970 and the first in 2020, respectively.
 # On the dashboard, you can choose whether to show the second country, and you can also select countries. To do that, dash and
 # bootstrap components are needed (I didn't include them here).
 
-# Grouping the dataframe by the number of terrorist attacks in each country/year
 
-df = df[df['iyear'] < 2021]
+@profiled('day_09.prepare_data')
+def prepare_data(path=GTD_PATH):
+    import pandas as pd
 
-dff = df.groupby([
-    'iyear', 'country_txt'
-])['eventid'].nunique().reset_index().sort_values(by=['iyear', 'eventid'],
-                                                  ascending=[True, False])
+    df = pd.read_csv(path, index_col=0)
 
-# I'll keep only the countries which had attacks after 2010:
+    # Grouping the dataframe by the number of terrorist attacks in each country/year
 
-dff['min_year'] = dff.groupby('country_txt')['iyear'].transform(
-    'min')  # the first ranking year for each country
-dff['max_year'] = dff.groupby('country_txt')['iyear'].transform(
-    'max')  # the last ranking year for each country
+    df = df[df['iyear'] < 2021]
 
-min_year_dict = dff.set_index('country_txt')['min_year'].to_dict(
-)  # dicts for filling nan values (further)
-max_year_dict = dff.set_index('country_txt')['max_year'].to_dict()
+    dff = df.groupby(['iyear', 'country_txt']).agg(
+        eventid=('eventid', 'nunique'),
+        nkill=('nkill', 'sum'),  # (the sums skip the missing values)
+        nwound=('nwound', 'sum')).reset_index().sort_values(
+            by=['iyear', 'eventid'], ascending=[True, False])
 
-dff = dff[dff['max_year'] >= 2011]
+    # All the countries, with their regions, are kept aside for the regions and the world (see roll_up()); a country stays in
+    # the region of its first attack:
 
-# Defining the rank of each country for each year (countries with the same number of attacks will get the same rank)
+    dff_all = dff.copy()
+    dff_all['region_txt'] = dff_all['country_txt'].map(
+        df.drop_duplicates('country_txt').set_index('country_txt')['region_txt'])
 
-dff_list = []
-years = np.arange(1970, 1993).tolist() + np.arange(
-    1994, 2021).tolist()  # no ranks for the 1993
+    # I'll keep only the countries which had attacks after 2010:
 
-for year in years:
-    dff_ = dff[dff['iyear'] == year]
-    dff_['rank'] = dff_.groupby('eventid', sort=False).ngroup() + 1
-    dff_list.append(dff_)
-dff1 = pd.concat(dff_list)
+    dff['min_year'] = dff.groupby('country_txt')['iyear'].transform(
+        'min')  # the first ranking year for each country
+    dff['max_year'] = dff.groupby('country_txt')['iyear'].transform(
+        'max')  # the last ranking year for each country
 
-# Background matrix ************************************************************************************************************
+    dff = dff[dff['max_year'] >= 2011]
+
+    # Defining the rank of each country for each year (countries with the same number of attacks will get the same rank)
+
+    dff_list = []
+    years = np.arange(1970, 1993).tolist() + np.arange(
+        1994, 2021).tolist()  # no ranks for the 1993
+
+    for year in years:
+        dff_ = dff[dff['iyear'] == year]
+        dff_['rank'] = dff_.groupby('eventid', sort=False).ngroup() + 1
+        dff_list.append(dff_)
+    dff1 = pd.concat(dff_list)
+
+    return dff1, years, dff_all
+
+
+# Binary store *****************************************************************************************************************
+
+# The table is indexed by [0 - attacks / 1 - rank / 2 - fatalities / 3 - wounded / 4 - casualties, country, year position];
+# the years and the first/last ranking year of each country go to the index (the dicts for filling nan values further are made
+# from it). The files are written under temporary names and then renamed, so a worker never maps a half-written table; the
+# index goes last, since its presence is what marks the store as complete.
+#
+# After the countries, the table has a row for each GTD region and one for the world, with their names in the same list of
+# the index ('levels' says which row is which). They are the sums of all their countries (the ones that stopped before 2011
+# included), and a region is ranked among the regions. A chart is made of one level at a time (see level_table()), so a pair
+# of regions is charted exactly as a pair of countries is.
+
+
+def parent_table(dff_all, years):
+    import pandas as pd
+
+    countries = dff_all.drop_duplicates('country_txt')
+
+    country_codes = pd.Categorical(dff_all['country_txt'],
+                                   categories=countries['country_txt']).codes
+    year_codes = pd.Categorical(dff_all['iyear'], categories=years).codes
+    known = year_codes >= 0
+
+    sums = np.zeros((4, len(countries), len(years)))
+    sums[:, country_codes[known], year_codes[known]] = np.stack(
+        (dff_all['eventid'], dff_all['nkill'], dff_all['nwound'],
+         dff_all['nkill'] + dff_all['nwound']))[:, known]
+
+    parents, parent_sums = roll_up(sums, countries['region_txt'].to_numpy())
+
+    # (the regions ranked among the regions, the world by itself; no attacks is no row, as for a country)
+
+    ranks = np.concatenate(
+        (dense_ranks(parent_sums[0, :-1]), dense_ranks(parent_sums[0, -1:])))
+
+    table = np.stack((parent_sums[0], ranks, parent_sums[1], parent_sums[2],
+                      parent_sums[3]))
+    table[:, parent_sums[0] == 0] = np.nan
+
+    return parents, table
+
+
+@profiled('day_09.write_store')
+def write_store(dff1, years, dff_all, store_path=STORE_PATH):
+    import pandas as pd
+
+    countries = dff1[['country_txt', 'min_year',
+                      'max_year']].drop_duplicates('country_txt')
+
+    country_codes = pd.Categorical(dff1['country_txt'],
+                                   categories=countries['country_txt']).codes
+    year_codes = pd.Categorical(dff1['iyear'], categories=years).codes
+
+    table = np.full((5, len(countries), len(years)), np.nan)
+    table[:, country_codes, year_codes] = np.stack(
+        (dff1['eventid'], dff1['rank'], dff1['nkill'], dff1['nwound'],
+         dff1['nkill'] + dff1['nwound']))
+
+    parents, parents_table = parent_table(dff_all, years)
+    table = np.concatenate((table, parents_table), axis=1)
+
+    ranked = ~np.isnan(parents_table[1])
+    first = ranked.argmax(axis=1)
+    last = ranked.shape[1] - 1 - ranked[:, ::-1].argmax(axis=1)
+
+    index = {
+        'countries': countries['country_txt'].tolist() + parents,
+        'levels': ['country'] * len(countries) + ['region'] *
+        (len(parents) - 1) + ['world'],
+        'years': years,
+        'metrics': metrics,
+        'min_year': countries['min_year'].tolist() +
+        np.asarray(years)[first].tolist(),
+        'max_year': countries['max_year'].tolist() +
+        np.asarray(years)[last].tolist()
+    }
 
-matrix_df = dff1.groupby(['rank', 'iyear']).agg('count')[[
-    'country_txt'
-]].rename(columns={
-    'country_txt': 'n_countries'
-}).reset_index()
+    with open(tmp_path(store_path + '.npy'), 'wb') as f:
+        np.save(f, table)
+    os.replace(tmp_path(store_path + '.npy'), store_path + '.npy')
 
-# A matrix must have values for each rank & year, incl when there are no ranked countries -> adding zero values:
+    with open(tmp_path(store_path + '.json'), 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path(store_path + '.json'), store_path + '.json')
 
-ranks = np.arange(1, 63, 1).tolist()
-countries = dff1['country_txt'].unique().tolist()
 
-dff_1 = pd.DataFrame(pd.Series(years), columns=['iyear'])
-dff_2 = pd.DataFrame(pd.Series(ranks), columns=['rank'])
+def store_is_fresh(path=GTD_PATH, store_path=STORE_PATH):
 
-dff_1['key'] = 0
-dff_2['key'] = 0
+    # (path=None: no raw file to compare with, the store is served as it is, e.g. from a refresh snapshot)
 
-dff_index = dff_1.merge(dff_2, on='key', how='outer')
-dff_index = dff_index.drop('key', axis=1)
+    if not os.path.exists(store_path + '.json'):
+        return False
+    return path is None or not os.path.exists(path) or os.path.getmtime(
+        path) <= os.path.getmtime(store_path + '.json')
 
-matrix_df = dff_index.set_index(['iyear', 'rank']).join(
-    matrix_df.set_index(['iyear', 'rank'])).reset_index()
 
-matrix_df['n_countries'] = matrix_df['n_countries'].fillna(0)
+@profiled('day_09.load_store')
+def load_store(store_path=STORE_PATH):
+    table = np.load(store_path + '.npy', mmap_mode='r')
+    with open(store_path + '.json') as f:
+        index = json.load(f)
+    return table, index
+
+
+# The ranked rows back as the table the chart is built from:
+
+
+@profiled('day_09.store_frame')
+def store_frame(table, index):
+    import pandas as pd
+
+    country_codes, year_codes = np.nonzero(~np.isnan(table[1]))
+
+    dff1 = pd.DataFrame({
+        'iyear': np.asarray(index['years'])[year_codes],
+        'country_txt': np.asarray(index['countries'])[country_codes],
+        'eventid': table[0, country_codes, year_codes].astype('int'),
+        'min_year': np.asarray(index['min_year'])[country_codes],
+        'max_year': np.asarray(index['max_year'])[country_codes],
+        'rank': table[1, country_codes, year_codes].astype('int')
+    })
+
+    return dff1.sort_values(by=['iyear', 'rank'])
+
+
+def load_data(path=GTD_PATH, store_path=STORE_PATH):
+    if store_is_fresh(path, store_path):
+        table, index = load_store(store_path)
+        if 'levels' in index:  # (a store written before the metrics or the regions is rebuilt)
+            return table, index
+
+    write_store(*prepare_data(path), store_path)
+    return load_store(store_path)
+
+
+# The rows of one level (country, region or world) of the store, a slice of the table, in the shape the rest of the chart
+# takes; the level of a chart is the level of its first country:
+
+
+def level_table(table, index, level='country'):
+    levels = index['levels']
+    level_rows = slice(levels.index(level), len(levels) - levels[::-1].index(level))
+
+    return table[:, level_rows], {
+        'countries': index['countries'][level_rows],
+        'years': index['years'],
+        'metrics': index['metrics'],
+        'min_year': index['min_year'][level_rows],
+        'max_year': index['max_year'][level_rows]
+    }
+
+
+def level_of(country, path=GTD_PATH, store_path=STORE_PATH):
+    _, index = load_data(path, store_path)
+    if country not in index['countries']:
+        raise ValueError('{}: not a country, region or the world of the store'.format(country))
+    return index['levels'][index['countries'].index(country)]
+
+
+def pair_level(country_1, country_2, path=GTD_PATH, store_path=STORE_PATH):
+
+    # (the two lines are ranked among the same rows, countries or regions: a country next to a region has no line in the
+    # figure's table)
+
+    level = level_of(country_1, path, store_path)
+    if country_2 is not None and level_of(country_2, path, store_path) != level:
+        raise ValueError('{}: not a {} as {} is, the pair is of one level'.format(country_2, level, country_1))
+    return level
+
+
+# Time windows *****************************************************************************************************************
+
+# Single-year counts are noisy, so the countries can also be ranked on the attacks over several years: window=3 or window=5
+# for rolling windows (the window ends at the chart year), or window='decade' for per-decade totals (one point per decade).
+# The window totals of every country and year come from one cumulative sum over the dense country x calendar year matrix
+# (1993, which the GTD doesn't have, counts as zero there and stays unranked), and all the windows are ranked at once. The
+# result has the shape of the store, so the rest of the chart doesn't know the difference.
+
+
+def dense_ranks(totals):
+
+    # Each column ranked separately, the most attacks first; equal totals get the same rank, as in prepare_data(), and no
+    # attacks means no rank:
+
+    order = np.argsort(-totals, axis=0, kind='stable')
+    ordered = np.take_along_axis(totals, order, axis=0)
+
+    steps = np.ones(totals.shape, dtype='bool')
+    steps[1:] = ordered[1:] != ordered[:-1]
+
+    ranks = np.empty(totals.shape)
+    np.put_along_axis(ranks, order, np.cumsum(steps, axis=0), axis=0)
+    ranks[totals == 0] = np.nan
+
+    return ranks
+
+
+@profiled('day_09.window_table')
+def window_table(table, index, window=1):
+    if window == 1:
+        return table, index
+
+    years = np.asarray(index['years'])
+    calendar = np.arange(years[0], years[-1] + 1)
+
+    attacks = np.zeros((table.shape[1], len(calendar)))
+    attacks[:, years - calendar[0]] = np.nan_to_num(table[0])
+
+    cumulative = np.zeros((attacks.shape[0], len(calendar) + 1))
+    np.cumsum(attacks, axis=1, out=cumulative[:, 1:])
+
+    if window == 'decade':
+        window_years = np.unique(calendar // 10 * 10)
+        starts = window_years - calendar[0]
+        ends = np.minimum(window_years + 10, calendar[-1] + 1) - calendar[0]
+    else:
+        window_years = years
+        ends = years - calendar[0] + 1
+        starts = np.maximum(ends - window, 0)
+
+    return ranked_table(cumulative[:, ends] - cumulative[:, starts],
+                        window_years, index)
+
+
+def ranked_table(totals, years, index):
+
+    # The totals ranked, with the first/last ranking year of each country, in the shape of the store:
+
+    ranks = dense_ranks(totals)
+
+    ranked = ~np.isnan(ranks)
+    first = ranked.argmax(axis=1)
+    last = ranked.shape[1] - 1 - ranked[:, ::-1].argmax(axis=1)
+
+    ranked_index = {
+        'countries': index['countries'],
+        'years': years.tolist(),
+        'min_year': years[first].tolist(),
+        'max_year': years[last].tolist()
+    }
+
+    return np.stack((np.where(ranked, totals, np.nan), ranks)), ranked_index
+
+
+@profiled('day_09.metric_table')
+def metric_table(table, index, metric='events'):
+
+    # The store ranked by another metric (the attacks are ranked in the store already). A country with no victims in a year
+    # isn't ranked in it, the same as a country with no attacks:
+
+    if metric == 'events':
+        return table, index
+
+    totals = np.nan_to_num(table[[0, 2, 3, 4][metrics.index(metric)]])
+    return ranked_table(totals, np.asarray(index['years']), index)
+
+
+# Background matrix ************************************************************************************************************
 
 # Color for the matrix markers. Besides the filled and zero markers, there are also "invisible" ones in the bottom, to fix the
 # chart from twitching while using dropdowns.
@@ -93,8 +381,6 @@ def color(s):
         return 0
 
 
-matrix_df['color'] = matrix_df.apply(color, axis=1)
-
 # Separating each ten points (for better looks):
 
 
@@ -113,32 +399,41 @@ def index(s):
         return s['rank'] + 5
 
 
-matrix_df['index'] = matrix_df.apply(index, axis=1)
+@profiled('day_09.background_matrix')
+def background_matrix(dff1, years):
+    import pandas as pd
 
-# Lines ************************************************************************************************************************
+    matrix_df = dff1.groupby(['rank', 'iyear']).agg('count')[[
+        'country_txt'
+    ]].rename(columns={
+        'country_txt': 'n_countries'
+    }).reset_index()
+
+    # A matrix must have values for each rank & year, incl when there are no ranked countries -> adding zero values:
 
-# Each country must have values for each year (the line must "fall" to the bottom when the country is not ranked, not stay
-# in the ranking area) -> adding zero values:
+    ranks = np.arange(1, 63, 1).tolist()
 
-dff_1 = pd.DataFrame(pd.Series(years), columns=['iyear'])
-dff_2 = pd.DataFrame(pd.Series(countries), columns=['country_txt'])
+    dff_1 = pd.DataFrame(pd.Series(years), columns=['iyear'])
+    dff_2 = pd.DataFrame(pd.Series(ranks), columns=['rank'])
 
-dff_1['key'] = 0
-dff_2['key'] = 0
+    dff_1['key'] = 0
+    dff_2['key'] = 0
 
-dff_index = dff_1.merge(dff_2, on='key', how='outer')
-dff_index = dff_index.drop('key', axis=1)
+    dff_index = dff_1.merge(dff_2, on='key', how='outer')
+    dff_index = dff_index.drop('key', axis=1)
 
-dff1 = dff_index.set_index(['iyear', 'country_txt'
-                            ]).join(dff1.set_index(['iyear', 'country_txt'
-                                                    ])).reset_index()
+    matrix_df = dff_index.set_index(['iyear', 'rank']).join(
+        matrix_df.set_index(['iyear', 'rank'])).reset_index()
 
-dff1['eventid'] = dff1['eventid'].fillna(0)
+    matrix_df['n_countries'] = matrix_df['n_countries'].fillna(0)
 
-# Filling the missing values in the added rows with earlier created year dictionaries:
+    matrix_df['color'] = matrix_df.apply(color, axis=1)
+    matrix_df['index'] = matrix_df.apply(index, axis=1)
 
-dff1['min_year'] = dff1['country_txt'].map(min_year_dict)
-dff1['max_year'] = dff1['country_txt'].map(max_year_dict)
+    return matrix_df
+
+
+# Lines ************************************************************************************************************************
 
 
 # If there were no attacks during the year, and so the country had no rank,
@@ -153,9 +448,6 @@ def rank_line(s):
         return s['rank']
 
 
-dff1['rank_line'] = dff1.apply(rank_line, axis=1)
-
-
 # Separating each 10 ranks in the grid
 def index_line(s):
     if s['rank_line'] <= 10:
@@ -172,275 +464,940 @@ def index_line(s):
         return s['rank_line'] + 5
 
 
-dff1['index_line'] = dff1.apply(index_line, axis=1)
+# Custom data for the hoverlabels (1 will be '1st', etc.). The labels of all the countries and years are made at once, as
+# array operations (numpy.strings); a value is formatted only once, through a lookup table of the distinct values (there are
+# only a few hundred ranks and attack counts among the thousands of cells).
 
-# Custom data for the hoverlabels (1 will be '1st', etc.):
 
-dff1['rank'] = dff1['rank'].fillna(0).astype('int').astype('str').replace(
-    '0', '')
+def ordinal_suffixes(numbers):
+    numbers = np.asarray(numbers)
+    suffixes = np.array(['th', 'st', 'nd', 'rd'] + ['th'] * 6)[numbers % 10]
+    return np.where((numbers % 100 >= 11) & (numbers % 100 <= 13), 'th',
+                    suffixes)  # 11th, 12th, 13th, 111th...
 
 
-def rank_txt(s):
-    if s['rank'] == '1' or s['rank'] == '21' or s['rank'] == '31' or s[
-            'rank'] == '41' or s['rank'] == '51':
-        return 'st'
-    elif s['rank'] == '2' or s['rank'] == '22' or s['rank'] == '32' or s[
-            'rank'] == '42' or s['rank'] == '52':
-        return 'nd'
-    elif s['rank'] == '3' or s['rank'] == '23' or s['rank'] == '33' or s[
-            'rank'] == '43' or s['rank'] == '53':
-        return 'rd'
-    elif s['rank'] == '':
-        return ''
-    else:
-        return 'th'
+@functools.lru_cache()
+def rank_lookup(size):
+    numbers = np.arange(size)
+    lookup = np.strings.add(numbers.astype('str'), ordinal_suffixes(numbers))
+    lookup[0] = ''  # (no rank)
+    return lookup
+
+
+def rank_labels(ranks):
+    ranks = np.asarray(ranks, dtype='int')
+    size = 64
+    while size <= ranks.max(initial=0):
+        size *= 2  # (a few sizes only, so the cached tables stay few)
+    return rank_lookup(size)[ranks]
+
+
+def thousands_labels(values, unit='attacks'):
+    distinct, positions = np.unique(np.asarray(values, dtype='int'),
+                                    return_inverse=True)
+    lookup = np.array(['{:,} {}'.format(value, unit) for value in distinct.tolist()],
+                      dtype='str')
+    return lookup[positions]
+
+
+def dot_padded(left, right, width=44):
 
+    # 'left....right', with the dots filling the line up to the width:
 
-dff1['rank_txt'] = dff1.apply(rank_txt, axis=1)
+    left = np.asarray(left).astype('str')
+    right = np.asarray(right).astype('str')
+    dots = np.strings.multiply('.', np.maximum(
+        width - np.strings.str_len(left) - np.strings.str_len(right), 0))
+    return np.strings.add(np.strings.add(left, dots), right)
 
 
-def rank_label(s):
-    return s['rank'] + s['rank_txt']
+# Shorten the country names length to show them correctly on the sides of the chart: the names are wrapped into lines of up
+# to label_width characters (a hyphen is a place to break too: 'Bosnia-<br>Herzegovina'), except for a few where I prefer
+# another break. Each name is wrapped once, however many years it has in the table:
 
+label_width = 13
 
-dff1['rank_label'] = dff1.apply(rank_label, axis=1)
+wrapped_countries = {
+    'Democratic Republic of the Congo': 'Democratic<br>Republic<br>of the Congo',
+    'Papua New Guinea': 'Papua<br>New Guinea',
+    'Republic of the Congo': 'Republic<br>of the Congo'
+}
 
 
-def attacks_label(s):
-    return str('{:,}'.format(int(s['eventid']))) + ' attacks'
+@functools.lru_cache(maxsize=None)
+def country_label(country, width=label_width):
+    import textwrap
 
+    if country in wrapped_countries:
+        return wrapped_countries[country]
+    return '<br>'.join(textwrap.wrap(country, width, break_long_words=False))
 
-dff1['attacks_label'] = dff1.apply(attacks_label, axis=1)
 
+def country_labels(countries, width=label_width):
+    import pandas as pd
 
-def table_label_len(s):
-    return len(str(s['iyear'])) + len(s['rank_label']) + len(
-        s['attacks_label'])
+    codes, names = pd.factorize(countries)
+    labels = np.array([country_label(name, width) for name in names], dtype='object')
+    return labels[codes]
 
 
-dff1['table_label_len'] = dff1.apply(table_label_len, axis=1)
+@profiled('day_09.country_lines')
+def country_lines(dff1, years, min_year_dict, max_year_dict, unit='attacks'):
+    import pandas as pd
 
+    # Each country must have values for each year (the line must "fall" to the bottom when the country is not ranked, not stay
+    # in the ranking area) -> adding zero values:
 
-def fill_table(s):
-    return '.' * (44 - s['table_label_len'])
+    countries = dff1['country_txt'].unique().tolist()
 
+    dff_1 = pd.DataFrame(pd.Series(years), columns=['iyear'])
+    dff_2 = pd.DataFrame(pd.Series(countries), columns=['country_txt'])
 
-dff1['fill_table'] = dff1.apply(fill_table, axis=1)
-dff1['table_label'] = dff1['iyear'].astype('str') + dff1['fill_table'] + dff1[
-    'rank_label'] + ' (' + dff1['attacks_label'] + ')'
+    dff_1['key'] = 0
+    dff_2['key'] = 0
 
-# Shorten the country names length to show them correctly on the sides of the chart:
+    dff_index = dff_1.merge(dff_2, on='key', how='outer')
+    dff_index = dff_index.drop('key', axis=1)
 
-dff1['country_label'] = dff1['country_txt'].replace('Bosnia-Herzegovina',
-                                                    'Bosnia-<br>Herzegovina')
+    dff1 = dff_index.set_index(['iyear', 'country_txt'
+                                ]).join(dff1.set_index(['iyear', 'country_txt'
+                                                        ])).reset_index()
 
-old_countries = [
-    'Central African Republic', 'United Kingdom',
-    'Democratic Republic of the Congo', 'Dominican Republic',
-    'Papua New Guinea', 'Slovak Republic', 'Republic of the Congo',
-    'Trinidad and Tobago', 'United Arab Emirates', 'West Bank and Gaza Strip'
-]
-new_countries = [
-    'Central<br>African<br>Republic', 'United<br>Kingdom',
-    'Democratic<br>Republic<br>of the Congo', 'Dominican<br>Republic',
-    'Papua<br>New Guinea', 'Slovak<br>Republic', 'Republic<br>of the Congo',
-    'Trinidad and<br>Tobago', 'United Arab<br>Emirates',
-    'West Bank and<br>Gaza Strip'
-]
+    dff1['eventid'] = dff1['eventid'].fillna(0)
 
-for i in range(10):
-    dff1['country_label'] = dff1['country_label'].replace(
-        old_countries[i], new_countries[i])
+    # Filling the missing values in the added rows with the year dictionaries from the store index:
+
+    dff1['min_year'] = dff1['country_txt'].map(min_year_dict)
+    dff1['max_year'] = dff1['country_txt'].map(max_year_dict)
+
+    dff1['rank_line'] = dff1.apply(rank_line, axis=1)
+    dff1['index_line'] = dff1.apply(index_line, axis=1)
+
+    ranks = dff1['rank'].fillna(0).astype('int').to_numpy()
+    dff1['rank'] = ranks.astype('str')
+    dff1.loc[ranks == 0, 'rank'] = ''
+
+    rank_label = rank_labels(ranks)
+    attacks_label = thousands_labels(dff1['eventid'], unit)
+
+    dff1['rank_label'] = rank_label
+    dff1['attacks_label'] = attacks_label
+    dff1['table_label'] = dot_padded(
+        dff1['iyear'],
+        np.strings.add(np.strings.add(rank_label, ' ('),
+                       np.strings.add(attacks_label, ')')),
+        47)  # (44 for the year, the rank and the attacks, and the brackets)
+
+    dff1['country_label'] = country_labels(dff1['country_txt'])
+
+    return dff1
 
 
 # THE CHART ********************************************************************************************************************
 
-    
-dff211 = dff1[dff1['country_txt'] == 'United States']
-dff212 = dff1[dff1['country_txt'] == 'Afghanistan']
-
-fig = go.Figure()
-
-fig.add_trace(
-    go.Scatter(x=matrix_df['iyear'],
-               y=matrix_df['index'],
-               mode='markers',
-               marker_color=matrix_df['color'],
-               marker_colorscale=['#010101', '#777777', '#333333'],
-               marker_size=3,
-               name='matrix',
-               hoverinfo='none'))
-
-fig.add_trace(
-    go.Scatter(
-        x=dff211['iyear'],
-        y=dff211['index_line'],
-        mode='markers+lines',
-        line_shape='hvh',
-        line_width=2,
-        line_color='#d9d9d9',
-        marker_size=1,
-        marker_color='rgba(255, 255, 255, 0)',
-        name='United States',
-        customdata=np.stack(
-            (dff211['iyear'], dff211['rank_label'], dff211['attacks_label']),
-            axis=-1),
-        hovertemplate='<extra></extra><b>%{customdata[0]}</b>\
-               <br>%{customdata[1]}: %{customdata[2]}'))
-
-fig.add_trace(
-    go.Scatter(
-        x=[1969],
-        y=dff211[dff211['iyear'] == dff211['min_year']]['index_line'],
-        mode='text',
-        text=dff211[dff211['iyear'] == dff211['min_year']]['country_label'],
-        textfont=dict(color='#d9d9d9', family='Bodoni MT Condensed', size=20),
-        textposition='middle left',
-        name='United States',
-        hoverinfo='none'))
-
-fig.add_trace(
-    go.Scatter(
-        x=dff211[(dff211['iyear'] == dff211['min_year']) |
-                 (dff211['iyear'] == dff211['max_year'])]['iyear'],
-        y=dff211[(dff211['iyear'] == dff211['min_year']) |
-                 (dff211['iyear'] == dff211['max_year'])]['index_line'],
-        mode='markers',
-        marker_size=7,
-        marker_color='#d9d9d9',
-        customdata=np.stack(
-            (dff211[(dff211['iyear'] == dff211['min_year']) |
-                    (dff211['iyear'] == dff211['max_year'])]['iyear'],
-             dff211[(dff211['iyear'] == dff211['min_year']) |
-                    (dff211['iyear'] == dff211['max_year'])]['rank_label'],
-             dff211[(dff211['iyear'] == dff211['min_year']) |
-                    (dff211['iyear'] == dff211['max_year'])]['attacks_label']),
-            axis=-1),
-        hovertemplate='<extra></extra><b>%{customdata[0]}</b>\
-        <br>%{customdata[1]}: %{customdata[2]}',
-        name='United States'))
-
-fig.add_trace(
-    go.Scatter(
-        x=dff212['iyear'],
-        y=dff212['index_line'],
-        mode='markers+lines',
-        line_shape='hvh',
-        line_width=2,
-        line_color='#cc812e',
-        marker_size=1,
-        marker_color='rgba(204, 129, 46, 0)',
-        customdata=np.stack(
-            (dff212['iyear'], dff212['rank_label'], dff212['attacks_label']),
-            axis=-1),
-        hovertemplate='<extra></extra><b>%{customdata[0]}</b>\
-               <br>%{customdata[1]}: %{customdata[2]}',
-        name='Afghanistan'))
-
-fig.add_trace(
-    go.Scatter(
-        x=[2021],
-        y=dff212[dff212['iyear'] == dff212['max_year']]['index_line'],
-        mode='text',
-        text=dff212[dff212['iyear'] == dff212['max_year']]['country_label'],
-        textfont=dict(color='#cc812e', family='Bodoni MT Condensed', size=20),
-        textposition='middle right',
-        name='Afghanistan',
-        hoverinfo='none'))
-
-fig.add_trace(
-    go.Scatter(
-        x=dff212[(dff212['iyear'] == dff212['min_year']) |
-                 (dff212['iyear'] == dff212['max_year'])]['iyear'],
-        y=dff212[(dff212['iyear'] == dff212['min_year']) |
-                 (dff212['iyear'] == dff212['max_year'])]['index_line'],
-        mode='markers',
-        marker_size=7,
-        marker_color='#cc812e',
-        customdata=np.stack(
-            (dff212[(dff212['iyear'] == dff212['min_year']) |
-                    (dff212['iyear'] == dff212['max_year'])]['iyear'],
-             dff212[(dff212['iyear'] == dff212['min_year']) |
-                    (dff212['iyear'] == dff212['max_year'])]['rank_label'],
-             dff212[(dff212['iyear'] == dff212['min_year']) |
-                    (dff212['iyear'] == dff212['max_year'])]['attacks_label']),
-            axis=-1),
-        hovertemplate='<extra></extra><b>%{customdata[0]}</b>\
-        <br>%{customdata[1]}: %{customdata[2]}',
-        name='Afghanistan'))
-
-fig.update_layout(
-    margin={
-        't': 60,
-        'r': 20,
-        'l': 20,
-        'b': 40
-    },
-    height=700,
-    width=800,
-    hoverlabel=dict(font=dict(size=30, family="Bodoni MT Condensed")),
-    showlegend=False,
-    plot_bgcolor='#010101',
-    paper_bgcolor='#010101',
-    legend=dict(itemclick='toggleothers'))
-
-fig.update_xaxes(title=None,
-                  range=[1959, 2031],
-                  tickvals=[1970, 1980, 1990, 2000, 2010, 2020],
-                  showticklabels=True,
-                  tickfont=dict(color='#a6a6a6',
-                                family='Bodoni MT Condensed',
-                                size=12),
-                  showgrid=False,
-                  zeroline=False)
-
-fig.update_yaxes(title=None,
-                  range=[1, 63],
-                  showticklabels=False,
-                  showgrid=False,
-                  zeroline=False,
-                  autorange="reversed")
-
-tickvals = [1, 12, 23, 34, 45, 56]
-ticktext = [1, 11, 21, 31, 41, 51]
-
-for i in range(6):
-    fig.add_annotation(x=1968,
-                        y=tickvals[i],
-                        yref='y',
-                        text=ticktext[i],
-                        showarrow=False,
-                        font=dict(color='rgba(217, 217, 217, 0.5)',
-                                  family='Bodoni MT Condensed',
-                                  size=12),
-                        align='left')
-
-fig.add_annotation(x=1966,
-                    y=67,
-                    yref='y',
-                    text='No Rank',
-                    showarrow=False,
-                    font=dict(color='rgba(217, 217, 217, 0.5)',
+# Hover labels of the lines and of their end points:
+
+hovertemplate = '<extra></extra><b>%{customdata[0]}</b>\
+               <br>%{customdata[1]}: %{customdata[2]}'
+
+hovertemplate_ends = '<extra></extra><b>%{customdata[0]}</b>\
+        <br>%{customdata[1]}: %{customdata[2]}'
+
+# The first country is labeled on the left (at its first ranking year), the second one on the right (at its last ranking
+# year). On the dashboard, the second country can be switched off (country_2=None).
+
+
+@profiled('day_09.build_figure')
+def build_figure(matrix_df,
+                 dff1,
+                 country_1='United States',
+                 country_2='Afghanistan'):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    fig.add_trace(
+        go.Scatter(x=matrix_df['iyear'],
+                   y=matrix_df['index'],
+                   mode='markers',
+                   marker_color=matrix_df['color'],
+                   marker_colorscale=['#010101', '#777777', '#333333'],
+                   marker_size=3,
+                   name='matrix',
+                   hoverinfo='none'))
+
+    dff211 = dff1[dff1['country_txt'] == country_1]
+
+    fig.add_trace(
+        go.Scatter(
+            x=dff211['iyear'],
+            y=dff211['index_line'],
+            mode='markers+lines',
+            line_shape='hvh',
+            line_width=2,
+            line_color='#d9d9d9',
+            marker_size=1,
+            marker_color='rgba(255, 255, 255, 0)',
+            name=country_1,
+            customdata=np.stack((dff211['iyear'], dff211['rank_label'],
+                                 dff211['attacks_label']),
+                                axis=-1),
+            hovertemplate=hovertemplate))
+
+    fig.add_trace(
+        go.Scatter(
+            x=[1969],
+            y=dff211[dff211['iyear'] == dff211['min_year']]['index_line'],
+            mode='text',
+            text=dff211[dff211['iyear'] == dff211['min_year']]
+            ['country_label'],
+            textfont=dict(color='#d9d9d9',
+                          family='Bodoni MT Condensed',
+                          size=20),
+            textposition='middle left',
+            name=country_1,
+            hoverinfo='none'))
+
+    fig.add_trace(
+        go.Scatter(
+            x=dff211[(dff211['iyear'] == dff211['min_year']) |
+                     (dff211['iyear'] == dff211['max_year'])]['iyear'],
+            y=dff211[(dff211['iyear'] == dff211['min_year']) |
+                     (dff211['iyear'] == dff211['max_year'])]['index_line'],
+            mode='markers',
+            marker_size=7,
+            marker_color='#d9d9d9',
+            customdata=np.stack(
+                (dff211[(dff211['iyear'] == dff211['min_year']) |
+                        (dff211['iyear'] == dff211['max_year'])]['iyear'],
+                 dff211[(dff211['iyear'] == dff211['min_year']) |
+                        (dff211['iyear'] == dff211['max_year'])]['rank_label'],
+                 dff211[(dff211['iyear'] == dff211['min_year']) |
+                        (dff211['iyear'] == dff211['max_year'])]
+                 ['attacks_label']),
+                axis=-1),
+            hovertemplate=hovertemplate_ends,
+            name=country_1))
+
+    if country_2 is not None:
+
+        dff212 = dff1[dff1['country_txt'] == country_2]
+
+        fig.add_trace(
+            go.Scatter(
+                x=dff212['iyear'],
+                y=dff212['index_line'],
+                mode='markers+lines',
+                line_shape='hvh',
+                line_width=2,
+                line_color='#cc812e',
+                marker_size=1,
+                marker_color='rgba(204, 129, 46, 0)',
+                customdata=np.stack((dff212['iyear'], dff212['rank_label'],
+                                     dff212['attacks_label']),
+                                    axis=-1),
+                hovertemplate=hovertemplate,
+                name=country_2))
+
+        fig.add_trace(
+            go.Scatter(
+                x=[2021],
+                y=dff212[dff212['iyear'] == dff212['max_year']]['index_line'],
+                mode='text',
+                text=dff212[dff212['iyear'] == dff212['max_year']]
+                ['country_label'],
+                textfont=dict(color='#cc812e',
                               family='Bodoni MT Condensed',
-                              size=15),
-                    align='left')
-
-fig.add_annotation(
-    x=0.625,
-    y=0.95,
-    ax=0.625,
-    ay=1.007,
-    xref='x domain',
-    yref='y domain',
-    axref='x domain',
-    ayref='y domain',
-    text='Light Positions Have Countries Ranked;<br>Dark Positions Are Empty',
-    showarrow=True,
-    arrowhead=3,
-    arrowcolor='rgba(217, 217, 217, 0.5)',
-    font=dict(color='rgba(217, 217, 217, 0.5)',
-              family='Bodoni MT Condensed',
-              size=15),
-    align='center')
-
-fig.show()
\ No newline at end of file
+                              size=20),
+                textposition='middle right',
+                name=country_2,
+                hoverinfo='none'))
+
+        fig.add_trace(
+            go.Scatter(
+                x=dff212[(dff212['iyear'] == dff212['min_year']) |
+                         (dff212['iyear'] == dff212['max_year'])]['iyear'],
+                y=dff212[(dff212['iyear'] == dff212['min_year']) |
+                         (dff212['iyear'] == dff212['max_year'])]
+                ['index_line'],
+                mode='markers',
+                marker_size=7,
+                marker_color='#cc812e',
+                customdata=np.stack(
+                    (dff212[(dff212['iyear'] == dff212['min_year']) |
+                            (dff212['iyear'] == dff212['max_year'])]['iyear'],
+                     dff212[(dff212['iyear'] == dff212['min_year']) |
+                            (dff212['iyear'] == dff212['max_year'])]
+                     ['rank_label'],
+                     dff212[(dff212['iyear'] == dff212['min_year']) |
+                            (dff212['iyear'] == dff212['max_year'])]
+                     ['attacks_label']),
+                    axis=-1),
+                hovertemplate=hovertemplate_ends,
+                name=country_2))
+
+    update_layout(fig)
+
+    return fig
+
+
+# Layout ***********************************************************************************************************************
+
+
+def layout_dict():
+
+    # Rank ticks on the left, the "No Rank" label under the grid and the note about the matrix colors:
+
+    tickvals = [1, 12, 23, 34, 45, 56]
+    ticktext = [1, 11, 21, 31, 41, 51]
+
+    annotations = []
+
+    for i in range(6):
+        annotations.append(
+            dict(x=1968,
+                 y=tickvals[i],
+                 yref='y',
+                 text=str(ticktext[i]),
+                 showarrow=False,
+                 font=dict(color='rgba(217, 217, 217, 0.5)',
+                           family='Bodoni MT Condensed',
+                           size=12),
+                 align='left'))
+
+    annotations.append(
+        dict(x=1966,
+             y=67,
+             yref='y',
+             text='No Rank',
+             showarrow=False,
+             font=dict(color='rgba(217, 217, 217, 0.5)',
+                       family='Bodoni MT Condensed',
+                       size=15),
+             align='left'))
+
+    annotations.append(
+        dict(x=0.625,
+             y=0.95,
+             ax=0.625,
+             ay=1.007,
+             xref='x domain',
+             yref='y domain',
+             axref='x domain',
+             ayref='y domain',
+             text=
+             'Light Positions Have Countries Ranked;<br>Dark Positions Are Empty',
+             showarrow=True,
+             arrowhead=3,
+             arrowcolor='rgba(217, 217, 217, 0.5)',
+             font=dict(color='rgba(217, 217, 217, 0.5)',
+                       family='Bodoni MT Condensed',
+                       size=15),
+             align='center'))
+
+    return dict(
+        margin={
+            't': 60,
+            'r': 20,
+            'l': 20,
+            'b': 40
+        },
+        height=700,
+        width=800,
+        hoverlabel=dict(font=dict(size=30, family="Bodoni MT Condensed")),
+        showlegend=False,
+        plot_bgcolor='#010101',
+        paper_bgcolor='#010101',
+        legend=dict(itemclick='toggleothers'),
+        xaxis=dict(title=None,
+                   range=[1959, 2031],
+                   tickvals=[1970, 1980, 1990, 2000, 2010, 2020],
+                   showticklabels=True,
+                   tickfont=dict(color='#a6a6a6',
+                                 family='Bodoni MT Condensed',
+                                 size=12),
+                   showgrid=False,
+                   zeroline=False),
+        yaxis=dict(title=None,
+                   range=[1, 63],
+                   showticklabels=False,
+                   showgrid=False,
+                   zeroline=False,
+                   autorange="reversed"),
+        annotations=annotations)
+
+
+@profiled('day_09.update_layout')
+def update_layout(fig):
+    fig.update_layout(**layout_dict())
+
+
+@profiled('day_09.chart_data')
+def chart_data(path=GTD_PATH,
+               store_path=STORE_PATH,
+               window=1,
+               metric='events',
+               level='country'):
+    table, store_index = window_table(
+        *metric_table(*level_table(*load_data(path, store_path), level),
+                      metric), window)
+
+    dff1 = store_frame(table, store_index)
+    years = store_index['years']
+
+    min_year_dict = dict(zip(store_index['countries'], store_index['min_year']))
+    max_year_dict = dict(zip(store_index['countries'], store_index['max_year']))
+
+    matrix_df = background_matrix(dff1, years)
+    dff1 = country_lines(dff1, years, min_year_dict, max_year_dict,
+                         metric_units[metric])
+
+    return matrix_df, dff1
+
+
+@profiled('day_09.make_figure')
+def make_figure(country_1='United States',
+                country_2='Afghanistan',
+                path=GTD_PATH,
+                store_path=STORE_PATH,
+                window=1,
+                metric='events'):
+    matrix_df, dff1 = chart_data(path, store_path, window, metric,
+                                 pair_level(country_1, country_2, path, store_path))
+    return build_figure(matrix_df, dff1, country_1, country_2)
+
+
+# Figure cache *****************************************************************************************************************
+
+# The built figures are kept as json next to the store. A cache hit is served with json alone: neither pandas nor plotly is
+# imported then. The cached figure is stale once the store has been rebuilt.
+
+
+@profiled('day_09.figure_json')
+def figure_json(country_1='United States',
+                country_2='Afghanistan',
+                path=GTD_PATH,
+                store_path=STORE_PATH,
+                cache_dir=FIGURE_CACHE,
+                window=1,
+                metric='events'):
+    cache_path = os.path.join(
+        cache_dir, 'day_09_{}_{}_{}_{}.json'.format(country_1, country_2,
+                                                    window, metric))
+
+    if store_is_fresh(path, store_path) and os.path.exists(
+            cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(
+                store_path + '.json'):
+        with open(cache_path) as f:
+            return f.read()
+
+    fig_json = make_figure(country_1, country_2, path, store_path, window,
+                           metric).to_json()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(tmp_path(cache_path), 'w') as f:
+        f.write(fig_json)
+    os.replace(tmp_path(cache_path), cache_path)
+
+    return fig_json
+
+
+# Matrix image *****************************************************************************************************************
+
+# The background matrix (62 ranks x 51 years of markers, with the "invisible" ones at the bottom) is the same whatever
+# countries are picked, and still it is sent and redrawn on every pick. So it can also be drawn once per dataset into a png
+# (kept in the payloads) and put under the country lines as a layout image that covers the axes exactly: x from 1959 to 2031,
+# y from 1 to 63 (reversed), the plot area without the margins. The markers are drawn as plotly draws them: 3 px discs,
+# colored through the colorscale between the lowest and the highest color value. The image is drawn at twice the size of the
+# plot area, so it stays sharp on high-density screens.
+
+matrix_colorscale = [[0.0, '#010101'], [0.5, '#777777'], [1.0, '#333333']]
+
+
+def png_bytes(rgba):
+    import zlib
+    import struct
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack(
+            '>I', zlib.crc32(kind + data))
+
+    height, width = rgba.shape[:2]
+    scanlines = np.hstack((np.zeros((height, 1), dtype='uint8'),
+                           rgba.reshape(height, width * 4)))  # (filter 0 on every line)
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(
+        b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) + chunk(
+            b'IDAT', zlib.compress(scanlines.tobytes(), 9)) + chunk(b'IEND', b'')
+
+
+@profiled('day_09.raster_matrix')
+def raster_matrix(x, y, colors, scale=2, marker_size=3):
+    layout = layout_dict()
+    x0, x1 = layout['xaxis']['range']
+    y0, y1 = layout['yaxis']['range']
+
+    width = (layout['width'] - layout['margin']['l'] - layout['margin']['r']) * scale
+    height = (layout['height'] - layout['margin']['t'] - layout['margin']['b']) * scale
+
+    colors = np.asarray(colors, dtype='float')
+    color_range = colors.max() - colors.min()
+    positions = (colors - colors.min()) / (color_range if color_range > 0 else 1)
+
+    stops = [stop for stop, _ in matrix_colorscale]
+    channels = np.array([[int(hex_color[k:k + 2], 16) for k in (1, 3, 5)]
+                         for _, hex_color in matrix_colorscale])
+    rgba = np.full((len(colors), 4), 255, dtype='uint8')
+    for k in range(3):
+        rgba[:, k] = np.rint(np.interp(positions, stops, channels[:, k]))
+
+    # The centers in pixels (y grows downwards, as the reversed axis does), and each disc pixel by pixel around them:
+
+    center_x = (np.asarray(x) - x0) / (x1 - x0) * width
+    center_y = (np.asarray(y) - y0) / (y1 - y0) * height
+    radius = marker_size / 2 * scale
+
+    image = np.zeros((height, width, 4), dtype='uint8')
+    reach = int(np.ceil(radius))
+
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            pixel_x = np.floor(center_x).astype('int') + dx
+            pixel_y = np.floor(center_y).astype('int') + dy
+            inside = (pixel_x + 0.5 - center_x)**2 + (pixel_y + 0.5 -
+                                                      center_y)**2 <= radius**2
+            inside &= (pixel_x >= 0) & (pixel_x < width) & (pixel_y >= 0) & (
+                pixel_y < height)
+            image[pixel_y[inside], pixel_x[inside]] = rgba[inside]
+
+    return png_bytes(image)
+
+
+def matrix_image(payloads):
+    import base64
+
+    layout = layout_dict()
+    x0, x1 = layout['xaxis']['range']
+    y0, y1 = layout['yaxis']['range']
+
+    return dict(source='data:image/png;base64,' +
+                base64.b64encode(payloads['matrix_png'].tobytes()).decode(),
+                xref='x',
+                yref='y',
+                x=x0,
+                y=y0,
+                sizex=x1 - x0,
+                sizey=y1 - y0,
+                xanchor='left',
+                yanchor='top',
+                sizing='stretch',
+                layer='below')
+
+
+# Country payloads *************************************************************************************************************
+
+# On the dashboard, any two of the ranked countries can be picked, and rebuilding six traces from the pandas frame on every pick
+# is the slow part of the callback. So the traces of every country are precomputed once per store: the line (index_line), its
+# hover data, the end points and the side label, as compact country x year arrays in one .npz, together with the background
+# matrix. The comparison figure is then just two rows of these arrays put next to the static matrix and layout, as plain dicts
+# (no pandas, no plotly validators), and dumps() turns it into json.
+
+
+@profiled('day_09.write_payloads')
+def write_payloads(path=GTD_PATH,
+                   store_path=STORE_PATH,
+                   payload_path=PAYLOAD_PATH,
+                   window=1,
+                   metric='events',
+                   level='country'):
+    matrix_df, dff1 = chart_data(path, store_path, window, metric, level)
+
+    # One row per country, one column per year:
+
+    dff1 = dff1.sort_values(by=['country_txt', 'iyear'])
+
+    countries = dff1['country_txt'].unique().to_numpy(dtype='str')
+    years = dff1['iyear'].unique().astype('int')
+    shape = (len(countries), len(years))
+
+    index_line = dff1['index_line'].to_numpy(dtype='float').reshape(shape)
+    labels = np.stack((dff1['rank_label'], dff1['attacks_label']),
+                      axis=-1).astype('str').reshape(shape + (2, ))
+
+    first = (dff1['iyear'] == dff1['min_year']).to_numpy().reshape(shape)
+    last = (dff1['iyear'] == dff1['max_year']).to_numpy().reshape(shape)
+
+    with open(tmp_path(payload_path + '.npz'), 'wb') as f:
+        np.savez(f,
+                 countries=countries,
+                 years=years,
+                 index_line=index_line,
+                 labels=labels,
+                 first=first,
+                 last=last,
+                 country_label=dff1['country_label'].to_numpy().reshape(
+                     shape)[:, 0].astype('str'),
+                 matrix_x=matrix_df['iyear'].to_numpy(),
+                 matrix_y=matrix_df['index'].to_numpy(),
+                 matrix_color=matrix_df['color'].to_numpy(),
+                 matrix_png=np.frombuffer(raster_matrix(
+                     matrix_df['iyear'], matrix_df['index'], matrix_df['color']),
+                                          dtype='uint8'))
+    os.replace(tmp_path(payload_path + '.npz'), payload_path + '.npz')
+
+
+@functools.lru_cache(maxsize=len(windows) * len(metrics) * len(level_names))  # (every file of a snapshot)
+def read_payloads(payload_path, mtime):
+    with np.load(payload_path + '.npz') as npz:
+        payloads = dict(npz)
+
+    # The pair index: country -> row of the arrays
+
+    payloads['position'] = {
+        country: i
+        for i, country in enumerate(payloads['countries'].tolist())
+    }
+
+    # The background image once per file as well (a file written before it had one gets it here):
+
+    if 'matrix_png' not in payloads:
+        payloads['matrix_png'] = np.frombuffer(raster_matrix(
+            payloads['matrix_x'], payloads['matrix_y'], payloads['matrix_color']),
+                                               dtype='uint8')
+    payloads['matrix_image'] = matrix_image(payloads)
+
+    return payloads
+
+
+def payload_file(payload_path=PAYLOAD_PATH,
+                 window=1,
+                 metric='events',
+                 level='country'):
+    if (window, metric) != (1, 'events'):
+        payload_path = '{}_{}_{}'.format(payload_path, window,
+                                         metric)  # one file per window/metric
+    if level != 'country':
+        payload_path += '_' + level  # (and per level, see level_table())
+    return payload_path
+
+
+@profiled('day_09.load_payloads')
+def load_payloads(path=GTD_PATH,
+                  store_path=STORE_PATH,
+                  payload_path=PAYLOAD_PATH,
+                  window=1,
+                  metric='events',
+                  level='country'):
+    payload_path = payload_file(payload_path, window, metric, level)
+
+    # (path=None: the payloads are served as they are, e.g. from a refresh snapshot, and never written from a request)
+
+    if path is None:
+        if not os.path.exists(payload_path + '.npz'):
+            raise ValueError('window={}, metric={}, level={}: no such payloads in {}'.format(
+                window, metric, level, os.path.dirname(payload_path) or '.'))
+    elif not store_is_fresh(path, store_path) or not os.path.exists(
+            payload_path + '.npz') or os.path.getmtime(
+                payload_path + '.npz') < os.path.getmtime(store_path + '.json'):
+        write_payloads(path, store_path, payload_path, window, metric, level)
+
+    # (re-read only when the file has changed)
+
+    return read_payloads(payload_path,
+                         os.path.getmtime(payload_path + '.npz'))
+
+
+def customdata(payloads, i, mask=slice(None)):
+
+    # (the year stays a number in the hover data, as in the pandas figure; a numpy row of strings would turn it into text)
+
+    return [[year, rank, attacks] for year, (rank, attacks) in zip(
+        payloads['years'][mask].tolist(), payloads['labels'][i][mask].tolist())]
+
+
+# With hover='lazy' (see "Lazy hover"), a point carries just its key, its cell in the country x year arrays:
+
+
+def point_hover(payloads, i, template, hover='embedded', mask=slice(None)):
+    if hover == 'lazy':
+        years = len(payloads['years'])
+        return dict(customdata=i * years + np.arange(years)[mask],
+                    hoverinfo='none')
+    return dict(customdata=customdata(payloads, i, mask),
+                hovertemplate=template)
+
+
+def country_traces(payloads,
+                   country,
+                   color,
+                   marker_color,
+                   label_x,
+                   label_position,
+                   label_at,
+                   hover='embedded'):
+    i = payloads['position'][country]
+    ends = payloads['first'][i] | payloads['last'][i]
+
+    return [
+        dict(type='scatter',
+             x=payloads['years'],
+             y=payloads['index_line'][i],
+             mode='markers+lines',
+             line=dict(shape='hvh', width=2, color=color),
+             marker=dict(size=1, color=marker_color),
+             name=country,
+             **point_hover(payloads, i, hovertemplate, hover)),
+        dict(type='scatter',
+             x=[label_x],
+             y=payloads['index_line'][i][payloads[label_at][i]],
+             mode='text',
+             text=payloads['country_label'][i:i + 1],
+             textfont=dict(color=color, family='Bodoni MT Condensed', size=20),
+             textposition=label_position,
+             name=country,
+             hoverinfo='none'),
+        dict(type='scatter',
+             x=payloads['years'][ends],
+             y=payloads['index_line'][i][ends],
+             mode='markers',
+             marker=dict(size=7, color=color),
+             **point_hover(payloads, i, hovertemplate_ends, hover, ends),
+             name=country)
+    ]
+
+
+@profiled('day_09.pair_figure')
+def pair_figure(payloads,
+                country_1='United States',
+                country_2='Afghanistan',
+                background='markers',
+                hover='embedded'):
+
+    # (background='image': the matrix is the pre-drawn image, see "Matrix image", and only the countries are traces;
+    # hover='lazy': the points carry keys instead of their hover data, see "Lazy hover")
+
+    for country in (country_1, country_2):
+        if country is not None and country not in payloads['position']:
+            raise ValueError('{}: no line in these payloads (not of their level, or not in the store)'.format(country))
+
+    data = [] if background == 'image' else [
+        dict(type='scatter',
+             x=payloads['matrix_x'],
+             y=payloads['matrix_y'],
+             mode='markers',
+             marker=dict(color=payloads['matrix_color'],
+                         colorscale=matrix_colorscale,
+                         size=3),
+             name='matrix',
+             hoverinfo='none')
+    ]
+
+    data += country_traces(payloads, country_1, '#d9d9d9',
+                           'rgba(255, 255, 255, 0)', 1969, 'middle left',
+                           'first', hover)
+
+    if country_2 is not None:
+        data += country_traces(payloads, country_2, '#cc812e',
+                               'rgba(204, 129, 46, 0)', 2021, 'middle right',
+                               'last', hover)
+
+    layout = layout_dict()
+    layout['template'] = default_template()
+    if background == 'image':
+        layout['images'] = [payloads['matrix_image']]
+
+    return dict(data=data, layout=layout)
+
+
+@profiled('day_09.pair_json')
+def pair_json(country_1='United States',
+              country_2='Afghanistan',
+              path=GTD_PATH,
+              store_path=STORE_PATH,
+              payload_path=PAYLOAD_PATH,
+              window=1,
+              metric='events',
+              background='markers',
+              hover='embedded'):
+    return dumps(
+        pair_figure(
+            load_payloads(path, store_path, payload_path, window, metric,
+                          pair_level(country_1, country_2, path, store_path)),
+            country_1, country_2, background, hover))
+
+
+# Lazy hover *******************************************************************************************************************
+
+# Each point of the two lines carries its year, rank and attacks as hover strings, but hardly any of them is ever hovered. With
+# hover='lazy', a point carries a single integer key instead (see point_hover()) and hoverinfo='none': plotly.js draws no label
+# then, but still sends the hover event, and the page asks the server for the label of that key (see dashboard/server.py).
+# The labels come from the payload arrays, filled into the hovertemplate as plotly.js fills it.
+
+
+@functools.lru_cache(maxsize=4096)
+def payload_label(payload_path, mtime, key):
+    payloads = read_payloads(payload_path, mtime)
+
+    i, j = divmod(key, len(payloads['years']))  # (see point_hover())
+    rank, attacks = payloads['labels'][i][j].tolist()
+
+    return hover_label(hovertemplate,
+                       [int(payloads['years'][j]), rank, attacks])
+
+
+@profiled('day_09.hover_text')
+def hover_text(key,
+               country_1='United States',
+               path=GTD_PATH,
+               store_path=STORE_PATH,
+               payload_path=PAYLOAD_PATH,
+               window=1,
+               metric='events'):
+
+    # (country_1 is only for the level of the figure's payloads)
+
+    level = level_of(country_1, path, store_path)
+    load_payloads(path, store_path, payload_path, window, metric, level)  # (rebuilt if stale)
+
+    # (the labels are cached by key, and by the file's mtime, so a rebuilt file isn't served from the old labels)
+
+    payload_path = payload_file(payload_path, window, metric, level)
+    return payload_label(payload_path,
+                         os.path.getmtime(payload_path + '.npz'), int(key))
+
+
+# A key is also what a click sends: the country and the years of its point, for the list of the point's attacks (see
+# query/events.py); with a window, the point stands for the years of its window.
+
+
+def event_cell(key,
+               country_1='United States',
+               path=GTD_PATH,
+               store_path=STORE_PATH,
+               payload_path=PAYLOAD_PATH,
+               window=1,
+               metric='events'):
+    payloads = load_payloads(path, store_path, payload_path, window, metric,
+                             level_of(country_1, path, store_path))
+
+    i, j = divmod(int(key), len(payloads['years']))  # (see point_hover())
+    country, year = str(payloads['countries'][i]), int(payloads['years'][j])
+
+    if window == 'decade':
+        return country, year, year + 9
+    return country, year - window + 1, year
+
+
+# Biggest movers ***************************************************************************************************************
+
+# The chart is about the countries that rose or fell the most, but it shows them one pair at a time. Here the rank lines of
+# all the countries of a level are one dense country x year matrix (rank_line() as a whole-matrix operation: the rank, or 62
+# when it isn't in the top 57 between the first and last ranking year, no line outside them), and the change of every
+# country between every two years of the chart is computed at once, as a year x year x country array: the year-over-year
+# changes and those over any longer span alike (kept in an LRU by window, metric and level, see below). "Top K between year A
+# and year B" is then one argpartition over a row of it, no pass over the rows:
+#
+#     biggest_movers(2010, 2015, k=5)                        # the 5 risers: [{'country': ..., 'rank_a': 40, 'rank_b': 3, ...}]
+#     mover_names(2014, 2015, k=10, direction='fallers')     # the names only, for the country selector
+#
+# A risen country has a lower rank number (change is the places gained, negative for the fallers); falling out of the top
+# 57 counts as falling to 62, the bottom of the chart. A country with no line in either year, or at the same rank in both,
+# isn't a mover (so fewer than k may come back).
+#
+# The size: years x years x countries float32, on the full GTD (51 years, about 200 countries) 51 x 51 x 205 x 4 bytes = 2.1 MB
+# per window, metric and level, so the 8 entries of the LRU are 17 MB at most. A rebuilt store has a new mtime, and the
+# entries of the old one are dropped then (not left to age out of the LRU).
+
+deltas_mtimes = dict()  # store_path -> the mtime of the cached entries
+
+
+def rank_line_matrix(table, index):
+    ranks = table[1]
+    years = np.asarray(index['years'])
+
+    alive = (years >= np.asarray(index['min_year'])[:, None]) & (
+        years <= np.asarray(index['max_year'])[:, None])
+    unranked = np.isnan(ranks) | (ranks > 57)
+
+    return np.where(alive, np.where(unranked, 62, ranks), np.nan)
+
+
+@functools.lru_cache(maxsize=8)
+def rank_deltas(store_path, mtime, window, metric, level):
+    table, index = window_table(
+        *metric_table(*level_table(*load_store(store_path), level), metric),
+        window)
+
+    lines = rank_line_matrix(table, index).astype('float32').T  # (year x country)
+
+    return dict(countries=np.asarray(index['countries']),
+                years={year: i for i, year in enumerate(index['years'])},
+                lines=lines,
+                deltas=lines[None, :, :] - lines[:, None, :])  # [a, b]: the change from year a to year b
+
+
+def load_deltas(path=GTD_PATH,
+                store_path=STORE_PATH,
+                window=1,
+                metric='events',
+                level='country'):
+    load_data(path, store_path)  # (rebuilt if stale)
+
+    mtime = os.path.getmtime(store_path + '.json')
+    if deltas_mtimes.get(store_path, mtime) != mtime:
+        rank_deltas.cache_clear()
+    deltas_mtimes[store_path] = mtime
+
+    return rank_deltas(store_path, mtime, window, metric, level)
+
+
+def biggest_movers(year_a,
+                   year_b,
+                   k=10,
+                   direction='risers',
+                   path=GTD_PATH,
+                   store_path=STORE_PATH,
+                   window=1,
+                   metric='events',
+                   level='country'):
+    if direction not in ('risers', 'fallers'):
+        raise ValueError(direction)
+
+    movers = load_deltas(path, store_path, window, metric, level)
+
+    a, b = movers['years'][year_a], movers['years'][year_b]  # (KeyError: not a year of the chart)
+    delta = movers['deltas'][a, b]
+
+    # (only the countries that moved the asked way: with fewer than k risers, the list is shorter, not padded with the ones
+    # that stayed or fell)
+
+    score = -delta if direction == 'risers' else delta
+    score = np.where(np.isnan(score), 0, score)
+
+    k = min(k, int((score > 0).sum()))
+    if k <= 0:
+        return []
+
+    top = np.argpartition(-score, k - 1)[:k]
+    top = top[np.argsort(-score[top], kind='stable')]
+
+    return [
+        dict(country=str(movers['countries'][i]),
+             rank_a=int(movers['lines'][a, i]),
+             rank_b=int(movers['lines'][b, i]),
+             change=int(-delta[i])) for i in top
+    ]
+
+
+def mover_names(year_a, year_b, k=10, direction='risers', **kwargs):
+    return [
+        mover['country']
+        for mover in biggest_movers(year_a, year_b, k, direction, **kwargs)
+    ]
+
+
+if __name__ == '__main__':
+
+    fig = make_figure('United States', 'Afghanistan')
+
+    fig.show()
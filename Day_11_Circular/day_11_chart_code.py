@@ -1,26 +1,56 @@
 # PACKAGES *********************************************************************************************************************
 
-import pandas as pd
-import numpy as np
+import os
+import sys
+import json
+import functools
 
-import plotly.graph_objects as go
+import numpy as np
 
 import warnings
 
 warnings.filterwarnings('ignore')
 
+# pandas and plotly.graph_objects (the latter alone pulls in hundreds of validator modules) are imported lazily, inside the
+# functions that prepare the raw data or build the figure. Loading the store or serving a cached figure needs only json and
+# numpy.
+
+# PROFILING ********************************************************************************************************************
+
+# Each stage of the pipeline runs inside a named span, and every file here is written to a temporary file first, then moved
+# into place (tmp_path()). Both come from common/profiling.py, shared by the three charts (with how to switch profiling on).
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.profiling import profiled, tmp_path
+from common.figures import default_template, dumps, hover_label, roll_up
+
+
 # THE DATA *********************************************************************************************************************
 
-df = pd.read_csv(
-    'globalterrorismdb.csv', index_col=0
-)  # I merged the databases for 1970-2020 and for 2021 from https://www.start.umd.edu/gtd/
+GTD_PATH = 'globalterrorismdb.csv'  # I merged the databases for 1970-2020 and for 2021 from https://www.start.umd.edu/gtd/
 
-# In this chart, I map the terrorist attacks in France by year and month. On the dashboard, you can select a country.
-# To do that, dash and bootstrap components are needed (I didn't include them here).
+# Reading the whole GTD and aggregating it takes a while, and on the dashboard every worker process would keep its own pandas
+# copy of the result. So the country/month/year counts of all the countries are written once into a flat binary cube (.npy),
+# zeros included, with a small json index of the countries. Each worker only memory-maps the cube read-only, so the pages are
+# shared through the OS page cache, and a cold start is just an mmap plus an index load.
+
+STORE_PATH = 'day_11_counts'  # -> day_11_counts.npy (country x month x year) + day_11_counts.json (the index)
+FIGURE_CACHE = 'figure_cache'  # built figures as json
 
-# There are only a few rows with no information about the month of attack, so we can easily leave them out:
+# Besides the number of attacks (events), the chart can show their fatalities, wounded, or casualties (fatalities + wounded).
+# All four are summed in the same groupby and kept in the store, so switching the metric doesn't touch the GTD again:
 
-df = df[df['imonth'] > 0]
+metrics = ['events', 'fatalities', 'wounded', 'casualties']
+metric_units = {
+    'events': 'attacks',
+    'fatalities': 'killed',
+    'wounded': 'wounded',
+    'casualties': 'casualties'
+}
+
+# In this chart, I map the terrorist attacks in France by year and month. On the dashboard, you can select a country.
+# To do that, dash and bootstrap components are needed (I didn't include them here).
 
 # Mapping the months:
 
@@ -38,7 +68,6 @@ month_dict = {
     11: 'November',
     12: 'December'
 }
-df['month'] = df['imonth'].map(month_dict)
 
 # Re-ordering months for the heatmap (the first is the outer circle, the last is the inner):
 
@@ -56,86 +85,261 @@ month_order = {
     'November': 2,
     'December': 1
 }
-df['month_order'] = df['month'].map(month_order)
-
-# Grouping the dataframe by the number of attacks in each month, year, and country:
-
-dff = df.groupby(['country', 'country_txt', 'month_order', 'month',
-                  'iyear']).agg('count')[['eventid']].reset_index()
-
-# I'll filter out countries where the last terrorist attack took place before 2011;
-# Also, only six months of the year 2021 are available at the moment, so I'll filter it out;
-# Besides that, let's keep only top-50 countries by the total number of terrorist attacks during 2011-2020.
-
-dff = dff[dff['iyear'] < 2021]
-dff['last_year'] = dff.groupby('country_txt')['iyear'].transform('max')
-dff = dff[dff['last_year'] > 2010]
-dff['max_attacks_total'] = dff.groupby('country_txt')['eventid'].transform(
-    'sum')
-top_50_index = dff[[
-    'country_txt', 'max_attacks_total'
-]].drop_duplicates().sort_values(
-    by='max_attacks_total',
-    ascending=False).head(50).set_index('country_txt').drop(
-        'max_attacks_total', axis=1)
-dff = top_50_index.join(dff.set_index('country_txt')).reset_index()
-dff = dff.drop(['last_year', 'max_attacks_total'], axis=1)
-
-# For the heatmap, we need to have a cell for each country, year, and month -> zero values need to be added:
-
-dff_1 = dff[['country',
-             'country_txt']].drop_duplicates().reset_index(drop=True)
-dff_2 = pd.DataFrame(pd.Series(np.arange(1970, 2021, 1)), columns=['iyear'])
-dff_3 = dff[['month_order', 'month']].drop_duplicates().reset_index(drop=True)
-
-dff_1['key'] = 0
-dff_2['key'] = 0
-dff_3['key'] = 0
-
-dff_index_ = dff_1.merge(dff_2, on='key', how='outer')
-dff_index = dff_index_.merge(dff_3, on='key', how='outer')
-dff_index = dff_index.drop('key', axis=1)
-
-dff = dff_index.set_index([
-    'country', 'country_txt', 'month_order', 'month', 'iyear'
-]).join(
-    dff.set_index(['country', 'country_txt', 'month_order', 'month',
-                   'iyear'])).reset_index()
-
-dff['eventid'] = dff['eventid'].fillna(0)
+
+
+@profiled('day_11.prepare_data')
+def prepare_data(path=GTD_PATH):
+    import pandas as pd
+
+    df = pd.read_csv(path, index_col=0)
+
+    # There are only a few rows with no information about the month of attack, so we can easily leave them out:
+
+    df = df[df['imonth'] > 0]
+
+    df['month'] = df['imonth'].map(month_dict)
+    df['month_order'] = df['month'].map(month_order)
+
+    # (the region of each country, for the roll-up in the store; a country stays in the region of its first attack)
+
+    regions = df.drop_duplicates('country_txt').set_index(
+        'country_txt')['region_txt']
+
+    # Grouping the dataframe by the number of attacks in each month, year, and country (and summing up their victims; the
+    # sums skip the missing values, so a month with no known nkill/nwound gets zero):
+
+    dff = df.groupby(['country', 'country_txt', 'month_order', 'month',
+                      'iyear']).agg(eventid=('eventid', 'count'),
+                                    nkill=('nkill', 'sum'),
+                                    nwound=('nwound', 'sum')).reset_index()
+
+    # Only six months of the year 2021 are available at the moment, so I'll filter it out. All the countries are kept: which
+    # of them are charted is decided on the store (see "Top countries"), and the zero cells are added by the store as well.
+
+    dff = dff[dff['iyear'] < 2021]
+    dff['region_txt'] = dff['country_txt'].map(regions)
+
+    return dff
+
+
+# Binary store *****************************************************************************************************************
+
+# The cube is indexed by [metric, country, month_order - 1, year - first year], so the first month row is December (the inner
+# circle); the metrics go in the order of the list above.
+#
+# After the countries, the cube has a row for each GTD region and one for the world (see roll_up()), with their names in the
+# same list of the index ('levels' says which row is which), so a region or the world is charted exactly as a country is.
+# The files are written under temporary names and then renamed, so a worker never maps a half-written cube; the index goes
+# last, since its presence is what marks the store as complete.
+
+
+@profiled('day_11.write_store')
+def write_store(dff, store_path=STORE_PATH):
+    import pandas as pd
+
+    countries = dff[['country', 'country_txt',
+                     'region_txt']].drop_duplicates('country_txt')
+    years = np.arange(1970, dff['iyear'].max() + 1)
+
+    country_codes = pd.Categorical(dff['country_txt'],
+                                   categories=countries['country_txt']).codes
+
+    values = np.stack((dff['eventid'], dff['nkill'], dff['nwound'],
+                       dff['nkill'] + dff['nwound']))
+
+    cube = np.zeros((len(metrics), len(countries), 12, len(years)))
+    cube[:, country_codes, dff['month_order'].to_numpy() - 1,
+         dff['iyear'].to_numpy() - years[0]] = values
+
+    max_attacks = int(cube[0].max())
+
+    parents, parent_cube = roll_up(cube, countries['region_txt'].to_numpy())
+    cube = np.concatenate((cube, parent_cube), axis=1)
+
+    index = {
+        'country': countries['country'].tolist() + [None] * len(parents),
+        'country_txt': countries['country_txt'].tolist() + parents,
+        'levels': ['country'] * len(countries) + ['region'] *
+        (len(parents) - 1) + ['world'],
+        'parents': countries['region_txt'].tolist() + ['World'] *
+        (len(parents) - 1) + [None],
+        'years': years.tolist(),
+        'metrics': metrics,
+        'max_attacks': max_attacks
+    }
+
+    with open(tmp_path(store_path + '.npy'), 'wb') as f:
+        np.save(f, cube)
+    os.replace(tmp_path(store_path + '.npy'), store_path + '.npy')
+
+    with open(tmp_path(store_path + '.json'), 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path(store_path + '.json'), store_path + '.json')
+
+
+def store_is_fresh(path=GTD_PATH, store_path=STORE_PATH):
+
+    # (path=None: no raw file to compare with, the store is served as it is, e.g. from a refresh snapshot)
+
+    if not os.path.exists(store_path + '.json'):
+        return False
+    return path is None or not os.path.exists(path) or os.path.getmtime(
+        path) <= os.path.getmtime(store_path + '.json')
+
+
+@profiled('day_11.load_store')
+def load_store(store_path=STORE_PATH):
+    cube = np.load(store_path + '.npy', mmap_mode='r')
+    with open(store_path + '.json') as f:
+        index = json.load(f)
+    return cube, index
+
+
+# One country's slice of the cube back as the long table the chart is built from (12 months x 51 years = 612 cells):
+
+
+@profiled('day_11.country_frame')
+def country_frame(cube, index, country_txt):
+    import pandas as pd
+
+    i = index['country_txt'].index(country_txt)
+    years = np.asarray(index['years'])
+    counts = np.asarray(cube[i])
+
+    month_orders = np.repeat(np.arange(1, 13), len(years))
+
+    return pd.DataFrame({
+        'country': index['country'][i],
+        'country_txt': country_txt,
+        'month_order': month_orders,
+        'month': [month_dict[13 - m] for m in month_orders],
+        'iyear': np.tile(years, 12),
+        'eventid': counts.ravel().astype('float')
+    })
+
+
+def load_data(path=GTD_PATH, store_path=STORE_PATH):
+    if store_is_fresh(path, store_path):
+        cube, index = load_store(store_path)
+        if 'levels' in index:  # (a store written before the metrics or the regions is rebuilt)
+            return cube, index
+
+    write_store(prepare_data(path), store_path)
+    return load_store(store_path)
+
+
+# Top countries ****************************************************************************************************************
+
+# I'll filter out countries where the last terrorist attack took place before 2011, and keep only the top-50 countries by the
+# total number of terrorist attacks. Both are parameters: n, the window of years the totals are summed over (None: all the
+# years) and active_after (None: every country with an attack). So a top-100 or a 2011-2020 ranking is just another call.
+#
+# The totals come from the country x year sums of the cube, and the top n is picked with a partial sort (argpartition) of the
+# country codes; only those n are then sorted. The codes are the rows of the cube. The regions (or the world) are ranked among
+# themselves, with level='region' (or 'world').
+
+
+@profiled('day_11.top_countries')
+def top_countries(cube,
+                  index,
+                  n=50,
+                  window=None,
+                  active_after=2010,
+                  level='country'):
+    years = np.asarray(index['years'])
+    yearly = np.asarray(cube).sum(axis=1)  # country x year
+
+    attacked = yearly > 0
+    last_year = years[len(years) - 1 - attacked[:, ::-1].argmax(axis=1)]
+
+    candidates = attacked.any(axis=1) & (np.asarray(index['levels']) == level)
+    if active_after is not None:
+        candidates &= last_year > active_after
+    candidates = np.flatnonzero(candidates)
+
+    in_window = slice(None) if window is None else (years >= window[0]) & (
+        years <= window[1])
+    totals = yearly[candidates][:, in_window].sum(axis=1)
+
+    if len(candidates) > n:
+        top = np.argpartition(-totals, n - 1)[:n]
+        candidates, totals = candidates[top], totals[top]
+
+    # (the biggest first; equal totals keep the order of the codes)
+
+    return candidates[np.lexsort((candidates, -totals))]
+
+
+def top_country_names(n=50,
+                      window=None,
+                      active_after=2010,
+                      path=GTD_PATH,
+                      store_path=STORE_PATH,
+                      level='country'):
+    cube, store_index = load_data(path, store_path)
+    return [
+        store_index['country_txt'][i] for i in top_countries(
+            cube[0], store_index, n, window, active_after, level)
+    ]
+
 
 # Making the radials ***********************************************************************************************************
 
-# Defyning angles with each decade separated by space:
+# Defyning angles with each decade separated by space. The geometry doesn't depend on the country (only the colors do), so
+# theta, base and width of every (ring, year) cell are computed once as 12 x 51 arrays, and kept for all the countries:
+#
+#     gap     extra angle between two decades
+#     size    ring (marker) height
+#     base    initial radius (of the inner ring)
+#
+# A year is 4 degrees, all stretched by 1.09 to spread the years over the circle. Other gaps or another number of rings cost
+# one more call, not a pass over the rows.
+
+
+@functools.lru_cache()
+def polar_geometry(years, rings=12, gap=2, size=4, base=90, spacing=3, ticks=None):
+    years = np.asarray(years)
+
+    decades = np.arange(len(years)) // 10
+    angles = ((years - 1970) * 4 + 1 + gap * decades) * 1.09
+
+    ring_bases = base + np.arange(rings) * (size + spacing)  # from the inner to the outer
+
+    geometry = dict(
+        theta=np.broadcast_to(angles, (rings, len(years))),
+        r=np.full((rings, len(years)), size),
+        base=np.broadcast_to(ring_bases[:, None], (rings, len(years))),
+        width=np.full((rings, len(years)), 2.7),
+        ring_ticks=(ring_bases if ticks is None else ring_bases[list(ticks)]) +
+        size / 2 + 0.5,  # the month labels, about the middle of each ring (or of the given rings)
+        guide_r=base - 10)  # the dashed line
+
+    for array in geometry.values():
+        if isinstance(array, np.ndarray):
+            array.setflags(write=False)  # (shared by every figure)
+
+    return geometry
+
 
-angle_dict = dict()
+def cell_geometry(dfff, **params):
+    return polar_geometry(tuple(dfff['iyear'].unique().tolist()), **params)
 
-years = dff['iyear'].unique().tolist()
 
-for year in years[:10]:
-    angle_dict[year] = (year - 1970) * 4 + 1
-for year in years[10:20]:
-    angle_dict[year] = (year - 1970) * 4 + 3
-for year in years[20:30]:
-    angle_dict[year] = (year - 1970) * 4 + 5
-for year in years[30:40]:
-    angle_dict[year] = (year - 1970) * 4 + 7
-for year in years[40:50]:
-    angle_dict[year] = (year - 1970) * 4 + 9
-for year in years[50:]:
-    angle_dict[year] = (year - 1970) * 4 + 11
+# The country frame is ordered ring by ring (see country_frame()), so the per-ring columns are just its reshaped columns:
+
+
+def ring_arrays(dfff, rings=12):
+    colors = dfff['eventid_log_perc'].to_numpy().reshape(rings, -1)
+    customdata = np.stack((dfff['iyear'], dfff['month'], dfff['eventid']),
+                          axis=-1).reshape(rings, -1, 3)
+    return colors, customdata
 
-dff['year_index'] = dff['iyear'].map(angle_dict)
 
 # Colors ***********************************************************************************************************************
 
 # The number of attacks varies from zero to 503, and we still want to see small values, so it's better to use a logarithmic
 # colorscale:
 
-dff['eventid_log'] = np.log10(dff['eventid'])
-dff['eventid_log'] = dff['eventid_log'].replace([np.inf, -np.inf], 0)
-dff['eventid_log_perc'] = dff['eventid_log'] / dff['eventid_log'].max()
-
 colorscale = [
     [0, 'rgba(1,1,3,0.0)'],
     [0.3333333333333333, 'rgba(255,255,255,0.5)'],  #log10 = 1 (tenths)
@@ -147,145 +351,885 @@ colorscale = [
     [1, 'rgba(1,1,3,0.0)']
 ]  # <- ...as well as this one (log10 = 3)
 
+# The colors are scaled to the maximum of the metric over all the top countries:
+
+
+@profiled('day_11.log_colors')
+def log_colors(dfff, max_attacks):
+    dfff['eventid_log'] = np.log10(dfff['eventid'])
+    dfff['eventid_log'] = dfff['eventid_log'].replace([np.inf, -np.inf], 0)
+    dfff['eventid_log_perc'] = dfff['eventid_log'] / np.log10(max(max_attacks, 2))  # (a max of 0 or 1: no division by 0)
+    return dfff
+
+
 # THE CHART ********************************************************************************************************************
 
+# The colorbar (the same for each circle) and the hover labels of the cells:
+
+colorbar = {
+    'x': 0.09,
+    'y': 0.78,
+    'lenmode': 'pixels',
+    'len': 250,
+    'outlinecolor': '#010103',
+    'outlinewidth': 1,
+    'separatethousands': True,
+    'showticklabels': True,
+    'thickness': 12,
+    'ticks': 'inside',
+    'ticklen': 15,
+    'ticklabelstep': 1,
+    'tickcolor': '#010103',
+    'thicknessmode': 'pixels',
+    'tickvals': [0.3333333333333333, 0.6666666666666666],
+    'ticktext': ['  10', '  100'],
+    'tickfont': {
+        'color': 'rgba(217, 217, 217, 0.7)',
+        'family': 'Bodoni MT Condensed',
+        'size': 12
+    },
+    'tickwidth': 6
+}
+
+hovertemplate = '<extra></extra>%{customdata[1]} %{customdata[0]}:\
+            <br>%{customdata[2]:,.0f} attacks'
+
+
+def metric_hovertemplate(dfff):
+    return hovertemplate.replace('attacks',
+                                 metric_units[dfff['metric'].iloc[0]])
+
+
 # In this example, I'll build a circle heatmap for France. To toggle countries, dash + bootstrap components are needed.
 
-dfff = dff[dff['country_txt'] == 'France']
 
-fig = go.Figure()
+@profiled('day_11.build_figure')
+def build_figure(dfff, geometry=None):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
 
-size = 4  # marker height
-base = 90  # initial radius
+    geometry = geometry or cell_geometry(dfff)
+    colors, customdata = ring_arrays(dfff)
 
-month_indexes = dfff['month_order'].unique().tolist()
-titles = dfff['month'].unique().tolist()
-colorscale = colorscale
+    titles = dfff['month'].unique().tolist()
 
-# Circles are built one-by-one, from the inner to the outer:
+    # Circles are built one-by-one, from the inner to the outer:
 
-for i in range(12):
-    data = dfff[dfff['month_order'] == month_indexes[i]]
+    for i in range(12):
+        fig.add_trace(
+            go.Barpolar(
+                r=geometry['r'][i],
+                theta=geometry['theta'][i],
+                base=geometry['base'][i],
+                width=geometry['width'][i],
+                marker_cauto=False,
+                marker_color=colors[i],
+                marker_colorscale=colorscale,
+                marker_colorbar=colorbar,
+                marker_cmin=0.0,
+                marker_cmax=1.0,
+                marker_line_color='rgba(217, 217, 217, 0.7)',
+                marker_line_width=0.3,
+                customdata=customdata[i],
+                hovertemplate=metric_hovertemplate(dfff),
+                name=titles[i]))  # cells
+
+    fig.add_trace(
+        go.Scatterpolar(r=[geometry['guide_r']] * 40,
+                        theta=geometry['theta'][-1],
+                        mode='lines',
+                        line=dict(color='rgba(217, 217, 217, 0.9)',
+                                  width=0.6,
+                                  dash='dot'),
+                        hoverinfo='none'))  # dashed line
 
     fig.add_trace(
-        go.Barpolar(
-            r=[size] * 51,
-            theta=(data['year_index']) * 1.09,
-            base=[base] * 51,
-            width=[2.7] * 51,
-            marker_cauto=False,
-            marker_color=data['eventid_log_perc'],
-            marker_colorscale=colorscale,
-            marker_colorbar={
-                'x': 0.09,
-                'y': 0.78,
-                'lenmode': 'pixels',
-                'len': 250,
-                'outlinecolor': '#010103',
-                'outlinewidth': 1,
-                'separatethousands': True,
-                'showticklabels': True,
-                'thickness': 12,
-                'ticks': 'inside',
-                'ticklen': 15,
-                'ticklabelstep': 1,
-                'tickcolor': '#010103',
-                'thicknessmode': 'pixels',
-                'tickvals': [0.3333333333333333, 0.6666666666666666],
-                'ticktext': ['  10', '  100'],
-                'tickfont': {
-                    'color': 'rgba(217, 217, 217, 0.7)',
-                    'family': 'Bodoni MT Condensed',
-                    'size': 12
-                },
-                'tickwidth': 6
-            },
-            marker_cmin=0.0,
-            marker_cmax=1.0,
-            marker_line_color='rgba(217, 217, 217, 0.7)',
-            marker_line_width=0.3,
-            customdata=np.stack(
-                (data['iyear'], data['month'], data['eventid']), axis=-1),
-            hovertemplate='<extra></extra>%{customdata[1]} %{customdata[0]}:\
-            <br>%{customdata[2]:,.0f} attacks',
-            name=titles[i]))  # cells
-
-    base += (size + 3)
-
-fig.add_trace(
-    go.Scatterpolar(r=[80] * 40,
-                    theta=(data['year_index']) * 1.09,
-                    mode='lines',
-                    line=dict(color='rgba(217, 217, 217, 0.9)',
-                              width=0.6,
-                              dash='dot'),
-                    hoverinfo='none'))  # dashed line
-
-fig.add_trace(
-    go.Scatterpolar(r=[80],
-                    theta=[180],
-                    mode='markers',
-                    marker=dict(size=7, symbol='arrow-left'),
-                    marker_color='rgba(217, 217, 217, 0.9)',
-                    hoverinfo='none'))  # dashed line arrow
+        go.Scatterpolar(r=[geometry['guide_r']],
+                        theta=[180],
+                        mode='markers',
+                        marker=dict(size=7, symbol='arrow-left'),
+                        marker_color='rgba(217, 217, 217, 0.9)',
+                        hoverinfo='none'))  # dashed line arrow
+
+    update_layout(fig, geometry)
+
+    return fig
+
 
 # LAYOUT ***********************************************************************************************************************
 
-fig.update_layout(
-    title_font=dict(color='rgba(217, 217, 217, 0.5)',
-                    family='Bodoni MT Condensed',
-                    size=50),
-    plot_bgcolor='#010103',
-    paper_bgcolor='#010103',
-    height=750,
-    width=750,
-    margin={
-        't': 20,
-        'b': 20,
-        'r': 50,
-        'l': 0
-    },
-    showlegend=False,
-    xaxis=dict(range=[0, 100],
-               showgrid=False,
-               showticklabels=False,
-               zeroline=False),
-    yaxis=dict(range=[0, 100],
-               showgrid=False,
-               showticklabels=False,
-               zeroline=False),
-    hoverlabel=dict(font=dict(size=30, family="Bodoni MT Condensed")),
-    polar=dict(radialaxis=dict(range=[0, 190],
-                               showticklabels=True,
-                               angle=90,
-                               side='counterclockwise',
-                               tickangle=90,
-                               tickvals=[
-                                   92.5, 99.5, 106.5, 113.5, 120.5, 127.5,
-                                   134.5, 141.5, 148.5, 155.5, 162.5, 169.5
-                               ],
-                               ticktext=[
-                                   'December     ', 'November     ',
-                                   'October     ', 'September     ',
-                                   'August     ', 'July     ', 'June     ',
-                                   'May     ', 'April     ', 'March     ',
-                                   'February     ', 'January     '
-                               ],
-                               showgrid=False,
-                               showline=False,
-                               tickfont=dict(color='rgba(217, 217, 217, 0.7)',
-                                             family='Bodoni MT Condensed',
-                                             size=15)),
-               angularaxis=dict(showticklabels=True,
-                                showgrid=False,
-                                showline=False,
-                                direction='clockwise',
-                                tickvals=[1, 46, 92, 139, 184, 230],
-                                ticktext=[1970, 1980, 1990, 2000, 2010, 2020],
-                                tickfont=dict(color='rgba(217, 217, 217, 0.7)',
-                                              family='Bodoni MT Condensed',
-                                              size=15))))
-
-fig.update_polars(bgcolor='rgba(1, 1, 1, 0)')
-
-fig.show()
\ No newline at end of file
+
+def layout_dict(geometry=None):
+
+    # (the month labels follow the rings; the default geometry doesn't depend on the years)
+
+    ring_ticks = (geometry or polar_geometry(()))['ring_ticks'].tolist()
+
+    return dict(
+        title=dict(font=dict(color='rgba(217, 217, 217, 0.5)',
+                             family='Bodoni MT Condensed',
+                             size=50)),
+        plot_bgcolor='#010103',
+        paper_bgcolor='#010103',
+        height=750,
+        width=750,
+        margin={
+            't': 20,
+            'b': 20,
+            'r': 50,
+            'l': 0
+        },
+        showlegend=False,
+        xaxis=dict(range=[0, 100],
+                   showgrid=False,
+                   showticklabels=False,
+                   zeroline=False),
+        yaxis=dict(range=[0, 100],
+                   showgrid=False,
+                   showticklabels=False,
+                   zeroline=False),
+        hoverlabel=dict(font=dict(size=30, family="Bodoni MT Condensed")),
+        polar=dict(radialaxis=dict(range=[0, 190],
+                                   showticklabels=True,
+                                   angle=90,
+                                   side='counterclockwise',
+                                   tickangle=90,
+                                   tickvals=ring_ticks,
+                                   ticktext=[
+                                       'December     ', 'November     ',
+                                       'October     ', 'September     ',
+                                       'August     ', 'July     ',
+                                       'June     ', 'May     ', 'April     ',
+                                       'March     ', 'February     ',
+                                       'January     '
+                                   ],
+                                   showgrid=False,
+                                   showline=False,
+                                   tickfont=dict(
+                                       color='rgba(217, 217, 217, 0.7)',
+                                       family='Bodoni MT Condensed',
+                                       size=15)),
+                   angularaxis=dict(showticklabels=True,
+                                    showgrid=False,
+                                    showline=False,
+                                    direction='clockwise',
+                                    tickvals=[1, 46, 92, 139, 184, 230],
+                                    ticktext=[
+                                        1970, 1980, 1990, 2000, 2010, 2020
+                                    ],
+                                    tickfont=dict(
+                                        color='rgba(217, 217, 217, 0.7)',
+                                        family='Bodoni MT Condensed',
+                                        size=15)),
+                   bgcolor='rgba(1, 1, 1, 0)'))
+
+
+@profiled('day_11.update_layout')
+def update_layout(fig, geometry=None):
+    fig.update_layout(**layout_dict(geometry))
+
+
+@profiled('day_11.chart_data')
+def chart_data(country_txt='France',
+               path=GTD_PATH,
+               store_path=STORE_PATH,
+               n=50,
+               window=None,
+               active_after=2010,
+               metric='events'):
+    cube, store_index = load_data(path, store_path)
+
+    # (a region's colors are scaled to the top regions, the world's to itself)
+
+    level = store_index['levels'][store_index['country_txt'].index(country_txt)]
+    top = top_countries(cube[0], store_index, n, window, active_after, level)
+
+    metric_cube = cube[metrics.index(metric)]
+
+    dfff = country_frame(metric_cube, store_index, country_txt)
+    dfff['metric'] = metric
+
+    return log_colors(dfff, int(metric_cube[top].max()))
+
+
+@profiled('day_11.make_figure')
+def make_figure(country_txt='France',
+                path=GTD_PATH,
+                store_path=STORE_PATH,
+                n=50,
+                window=None,
+                active_after=2010,
+                metric='events'):
+    return build_figure(
+        chart_data(country_txt, path, store_path, n, window, active_after,
+                   metric))
+
+
+# Figure cache *****************************************************************************************************************
+
+# The built figures are kept as json next to the store. A cache hit is served with json alone: neither pandas nor plotly is
+# imported then. The cached figure is stale once the store has been rebuilt. The week and day figures are plain dicts (see
+# "FINER RESOLUTIONS"), and so are the lazy-hover ones (see "Lazy hover").
+
+
+# (the hits and misses, for dashboard/server.py's /metrics)
+
+figure_cache_stats = dict(hits=0, misses=0)
+
+
+@profiled('day_11.figure_json')
+def figure_json(country_txt='France',
+                path=GTD_PATH,
+                store_path=STORE_PATH,
+                cache_dir=FIGURE_CACHE,
+                n=50,
+                window=None,
+                active_after=2010,
+                metric='events',
+                resolution='month',
+                sparse=True,
+                hover='embedded'):
+    cache_path = os.path.join(
+        cache_dir, 'day_11_{}_top{}_{}_{}_{}{}{}.json'.format(
+            country_txt, n, 'all' if window is None else '{}-{}'.format(
+                *window), active_after, metric,
+            '' if resolution == 'month' else '_' + resolution,
+            '' if hover == 'embedded' else '_' + hover))
+
+    if store_is_fresh(path, store_path) and os.path.exists(
+            cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(
+                store_path + '.json'):
+        figure_cache_stats['hits'] += 1
+        with open(cache_path) as f:
+            return f.read()
+
+    figure_cache_stats['misses'] += 1
+
+    if resolution == 'month' and hover == 'lazy':
+        fig_json = dumps(
+            figure_dict(chart_data(country_txt, path, store_path, n, window,
+                                   active_after, metric),
+                        hover='lazy'))
+    elif resolution == 'month':
+        fig_json = make_figure(country_txt, path, store_path, n, window,
+                               active_after, metric).to_json()
+    else:
+        fig_json = dumps(
+            cells_figure(country_txt, path, store_path, n, window,
+                         active_after, metric, resolution, sparse, hover))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(tmp_path(cache_path), 'w') as f:
+        f.write(fig_json)
+    os.replace(tmp_path(cache_path), cache_path)
+
+    return fig_json
+
+
+# Plain-dict figure ************************************************************************************************************
+
+# Every property of the 12 Barpolar traces (with their big colorbar dicts) goes through plotly's validators, and then the
+# figure has to be serialized. figure_dict() is an opt-in builder of the same figure as plain dicts of numpy arrays: it is
+# never validated, unless validate=True, in which case the whole thing is passed through go.Figure once at the end. dumps()
+# then serializes it with orjson, which handles the arrays natively (or with the standard json module, if orjson isn't
+# installed). benchmarks/figure_benchmark.py checks that the output is the same as build_figure() + to_json().
+
+
+@profiled('day_11.figure_dict')
+def figure_dict(dfff, validate=False, geometry=None, hover='embedded'):
+    geometry = geometry or cell_geometry(dfff)
+    colors, customdata = ring_arrays(dfff)
+
+    if hover == 'lazy':
+        customdata = cell_keys(customdata.shape[:2])  # (see "Lazy hover")
+        cell_hover = dict(hoverinfo='none')
+    else:
+        cell_hover = dict(hovertemplate=metric_hovertemplate(dfff))
+
+    titles = dfff['month'].unique().tolist()
+
+    data_for_fig = []
+
+    for i in range(12):
+        data_for_fig.append(
+            dict(type='barpolar',
+                 r=geometry['r'][i],
+                 theta=geometry['theta'][i],
+                 base=geometry['base'][i],
+                 width=geometry['width'][i],
+                 marker=dict(cauto=False,
+                             color=colors[i],
+                             colorscale=colorscale,
+                             colorbar=colorbar,
+                             cmin=0.0,
+                             cmax=1.0,
+                             line=dict(color='rgba(217, 217, 217, 0.7)',
+                                       width=0.3)),
+                 customdata=customdata[i],
+                 **cell_hover,
+                 name=titles[i]))  # cells
+
+    data_for_fig.append(
+        dict(type='scatterpolar',
+             r=[geometry['guide_r']] * 40,
+             theta=geometry['theta'][-1],
+             mode='lines',
+             line=dict(color='rgba(217, 217, 217, 0.9)', width=0.6,
+                       dash='dot'),
+             hoverinfo='none'))  # dashed line
+
+    data_for_fig.append(
+        dict(type='scatterpolar',
+             r=[geometry['guide_r']],
+             theta=[180],
+             mode='markers',
+             marker=dict(size=7,
+                         symbol='arrow-left',
+                         color='rgba(217, 217, 217, 0.9)'),
+             hoverinfo='none'))  # dashed line arrow
+
+    layout = layout_dict(geometry)
+    layout['template'] = default_template()
+
+    fig = dict(data=data_for_fig, layout=layout)
+
+    if validate:
+        import plotly.graph_objects as go
+        go.Figure(fig)
+
+    return fig
+
+
+# FINER RESOLUTIONS ************************************************************************************************************
+
+# GTD also has the day of the attack (iday), so the circles can be the weeks of the year (52 rings) or the days (366 rings)
+# instead of the months: 2,652 or 18,666 cells per country instead of 612.
+#
+# The day of the year is counted on a leap-year calendar, so a date is always on the same ring (the 29th of February is just
+# empty in the other years); the week is the day of the year // 7, with the last one or two days in the 52nd week. An attack
+# with an unknown day (iday = 0, a date that doesn't exist, or no month at all) can't be put on a ring: those are summed per
+# year on the side, and the chart says how many are left out.
+#
+# Storage: the dense day cube of all the countries is 4 metrics x ~200 countries x 366 x 51 floats (~120 MB), mostly zeros.
+# So these stores can be sparse (the default): only the nonzero cells, sorted by country, with the offset of each country's
+# cells, so that a country is a slice put back on its dense grid when it's charted. With sparse=False, the cube is a .npy
+# that is memory-mapped like the month store.
+#
+# Rendering: the weeks are a single Barpolar trace instead of 52. The days are too many svg paths for the browser, so their
+# cells are rasterized here into a png under the polar axes (layout.images), and the hover comes from an invisible WebGL layer
+# (Scatterpolargl) with a point on each nonzero cell only.
+
+resolutions = {'month': 12, 'week': 52, 'day': 366}
+
+# The rings have to fit between the radius 90 and the labels, as the 12 months do:
+
+resolution_shapes = {
+    'month': dict(size=4, spacing=3),
+    'week': dict(size=1.2, spacing=0.4),
+    'day': dict(size=0.23, spacing=0)
+}
+
+month_days = np.array([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+month_starts = np.concatenate(([0], np.cumsum(month_days)[:-1]))  # the day of the (leap) year of the 1st, from 0
+
+
+def day_rings(imonth, iday, resolution='week'):
+    imonth = np.asarray(imonth)
+    iday = np.asarray(iday)
+
+    month = np.clip(imonth, 1, 12) - 1
+    known = (imonth >= 1) & (imonth <= 12) & (iday >= 1) & (iday <= month_days[month])
+
+    slots = month_starts[month] + iday - 1
+    if resolution == 'week':
+        slots = np.minimum(slots // 7, 51)
+
+    # The first slot is the outer circle, as January is; an unknown day goes to -1:
+
+    return np.where(known, resolutions[resolution] - 1 - slots, -1)
+
+
+def ring_labels(resolution):
+    slots = resolutions[resolution] - 1 - np.arange(resolutions[resolution])
+    if resolution == 'week':
+        return ['week {}'.format(slot + 1) for slot in slots]
+
+    months = np.searchsorted(month_starts, slots, side='right') - 1
+    return [
+        '{} {}'.format(month_dict[month + 1], slot - month_starts[month] + 1)
+        for month, slot in zip(months, slots)
+    ]
+
+
+def resolution_geometry(years, resolution='week'):
+
+    # (the month labels go on the rings of the 1st of each month, from December, the inner one, to January)
+
+    ticks = day_rings(np.arange(12, 0, -1), np.ones(12, dtype='int'), resolution)
+    return polar_geometry(tuple(years),
+                          rings=resolutions[resolution],
+                          ticks=tuple(ticks.tolist()),
+                          **resolution_shapes[resolution])
+
+
+# Cell stores ******************************************************************************************************************
+
+
+def cell_store_path(store_path=STORE_PATH, resolution='week', sparse=True):
+    return '{}_{}{}'.format(store_path, resolution, '_sparse' if sparse else '')
+
+
+@profiled('day_11.prepare_cells')
+def prepare_cells(path=GTD_PATH, resolution='week'):
+    import pandas as pd
+
+    df = pd.read_csv(path, index_col=0)
+    df = df[df['iyear'] < 2021]
+
+    df['ring'] = day_rings(df['imonth'], df['iday'], resolution)
+
+    return df.groupby(['country', 'country_txt', 'ring',
+                       'iyear']).agg(eventid=('eventid', 'count'),
+                                     nkill=('nkill', 'sum'),
+                                     nwound=('nwound', 'sum')).reset_index()
+
+
+@profiled('day_11.write_cell_store')
+def write_cell_store(dff, cell_path, resolution='week', sparse=True):
+    import pandas as pd
+
+    countries = dff[['country', 'country_txt']].drop_duplicates('country_txt')  # (one row per name, as in write_store())
+    years = np.arange(1970, dff['iyear'].max() + 1)
+
+    country_codes = pd.Categorical(dff['country_txt'],
+                                   categories=countries['country_txt']).codes
+    rings = dff['ring'].to_numpy()
+    year_codes = dff['iyear'].to_numpy() - years[0]
+
+    values = np.stack((dff['eventid'], dff['nkill'], dff['nwound'],
+                       dff['nkill'] + dff['nwound']))
+
+    placed = rings >= 0
+
+    unknown = np.zeros((len(metrics), len(countries), len(years)))
+    unknown[:, country_codes[~placed], year_codes[~placed]] = values[:, ~placed]
+
+    if sparse:
+        order = np.lexsort(
+            (year_codes[placed], rings[placed], country_codes[placed]))
+        cells = dict(offsets=np.searchsorted(country_codes[placed][order],
+                                             np.arange(len(countries) + 1)),
+                     rings=rings[placed][order].astype('int16'),
+                     years=year_codes[placed][order].astype('int16'),
+                     values=values[:, placed][:, order],
+                     unknown=unknown)
+
+        with open(tmp_path(cell_path + '.npz'), 'wb') as f:
+            np.savez(f, **cells)
+        os.replace(tmp_path(cell_path + '.npz'), cell_path + '.npz')
+    else:
+        cube = np.zeros((len(metrics), len(countries), resolutions[resolution],
+                         len(years)))
+        cube[:, country_codes[placed], rings[placed],
+             year_codes[placed]] = values[:, placed]
+
+        for name, array in (('', cube), ('_unknown', unknown)):
+            with open(tmp_path(cell_path + name + '.npy'), 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path(cell_path + name + '.npy'), cell_path + name + '.npy')
+
+    index = {
+        'country': countries['country'].tolist(),
+        'country_txt': countries['country_txt'].tolist(),
+        'years': years.tolist(),
+        'metrics': metrics,
+        'resolution': resolution,
+        'sparse': sparse
+    }
+
+    with open(tmp_path(cell_path + '.json'), 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path(cell_path + '.json'), cell_path + '.json')
+
+
+@functools.lru_cache(maxsize=2)
+def read_cells(cell_path, sparse, mtime):
+    if sparse:
+        with np.load(cell_path + '.npz') as npz:
+            return dict(npz)
+    return dict(cube=np.load(cell_path + '.npy', mmap_mode='r'),
+                unknown=np.load(cell_path + '_unknown.npy', mmap_mode='r'))
+
+
+def load_cells(path=GTD_PATH,
+               store_path=STORE_PATH,
+               resolution='week',
+               sparse=True):
+    cell_path = cell_store_path(store_path, resolution, sparse)
+
+    if path is None and not store_is_fresh(path, cell_path):  # (e.g. a refresh snapshot: it has the sparse cells only)
+        raise ValueError('{} cells ({}): not in {}, and path=None has no raw file to build them from'.format(
+            resolution, 'sparse' if sparse else 'dense', os.path.dirname(cell_path) or '.'))
+
+    if not store_is_fresh(path, cell_path):
+        write_cell_store(prepare_cells(path, resolution), cell_path,
+                         resolution, sparse)
+
+    with open(cell_path + '.json') as f:
+        index = json.load(f)
+
+    # (re-read only when the store has changed)
+
+    return read_cells(cell_path, sparse,
+                      os.path.getmtime(cell_path + '.json')), index
+
+
+def country_cells(cells, index, country_txt, metric='events'):
+
+    # (the week and day stores have no roll-up rows: a region or the world is charted by month only)
+
+    if country_txt not in index['country_txt']:
+        raise ValueError('{} at {} resolution: not a country of the store (regions and the world: month only)'.format(
+            country_txt, index['resolution']))
+
+    i = index['country_txt'].index(country_txt)
+    m = metrics.index(metric)
+
+    if not index['sparse']:
+        return np.asarray(cells['cube'][m, i]), cells['unknown'][m, i]
+
+    grid = np.zeros((resolutions[index['resolution']], len(index['years'])))
+    country = slice(cells['offsets'][i], cells['offsets'][i + 1])
+    grid[cells['rings'][country],
+         cells['years'][country]] = cells['values'][m, country]
+
+    return grid, cells['unknown'][m, i]
+
+
+def cells_max(cells, index, countries, metric='events'):
+    country_rows = [index['country_txt'].index(country) for country in countries]
+    m = metrics.index(metric)
+
+    if not index['sparse']:
+        return cells['cube'][m, country_rows].max()
+
+    owners = np.repeat(np.arange(len(index['country_txt'])),
+                       np.diff(cells['offsets']))
+    return cells['values'][m, np.isin(owners, country_rows)].max(initial=1)
+
+
+# Cell figures *****************************************************************************************************************
+
+
+def cell_colors(grid, max_value):
+    with np.errstate(divide='ignore'):
+        logs = np.log10(grid)
+    logs[~np.isfinite(logs)] = 0
+    return logs / np.log10(max(max_value, 2))
+
+
+def colorscale_rgba(colors):
+
+    # The colorscale applied here, for the raster: the rgba of every stop, interpolated per channel
+
+    stops = np.array([stop for stop, _ in colorscale])
+    channels = np.array([[float(v) for v in color[5:-1].split(',')]
+                         for _, color in colorscale])
+    channels[:, 3] *= 255
+
+    rgba = np.stack(
+        [np.interp(colors, stops, channels[:, k]) for k in range(4)], axis=-1)
+    return np.rint(rgba).astype('uint8')
+
+
+def png_data_uri(rgba):
+    import zlib
+    import base64
+    import struct
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack(
+            '>I', zlib.crc32(kind + data))
+
+    height, width = rgba.shape[:2]
+    scanlines = np.hstack((np.zeros((height, 1), dtype='uint8'),
+                           rgba.reshape(height, width * 4)))  # (filter 0 on every line)
+
+    png = b'\x89PNG\r\n\x1a\n' + chunk(
+        b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) + chunk(
+            b'IDAT', zlib.compress(scanlines.tobytes(), 1)) + chunk(b'IEND', b'')
+
+    return 'data:image/png;base64,' + base64.b64encode(png).decode()
+
+
+@functools.lru_cache(maxsize=4)
+def raster_lookup(years, resolution='day', pixels=1400, radial_range=190):
+
+    # Each pixel is turned into polar coordinates (theta clockwise from the top, as the angular axis) and looked up in the
+    # grid: the ring from the radius, the year from the nearest bar center, and it's a cell only within the bar's width. This
+    # depends on the geometry only, so it's done once for all the countries: the pixels inside a cell, and their cells.
+
+    geometry = resolution_geometry(years, resolution)
+
+    centers = (np.arange(pixels) + 0.5 - pixels / 2) / (pixels / 2) * radial_range
+    x, y = np.meshgrid(centers, -centers)
+
+    radius = np.hypot(x, y)
+    theta = (90 - np.degrees(np.arctan2(y, x))) % 360
+
+    bases = geometry['base'][:, 0]
+    step = bases[1] - bases[0]
+    size = geometry['r'][0, 0]
+    rings = np.floor((radius - bases[0]) / step).astype('int')
+
+    angles = geometry['theta'][0]
+    year_codes = np.searchsorted((angles[1:] + angles[:-1]) / 2, theta)
+
+    inside = (rings >= 0) & (rings < len(bases))
+    inside &= radius - bases[0] - rings * step <= size
+    inside &= np.abs(theta - angles[year_codes]) <= geometry['width'][0, 0] / 2
+
+    return np.flatnonzero(inside), (rings * len(angles) + year_codes)[inside]
+
+
+@profiled('day_11.raster_cells')
+def raster_cells(rgba, lookup, pixels=1400):
+    pixel_codes, cell_codes = lookup
+
+    image = np.zeros((pixels * pixels, 4), dtype='uint8')
+    image[pixel_codes] = rgba.reshape(-1, 4)[cell_codes]
+    return image.reshape(pixels, pixels, 4)
+
+
+def raster_image(source, layout):
+
+    # The image covers the polar axes: a square in the middle of the plot area (the polar domain is the whole of it)
+
+    plot_width = layout['width'] - layout['margin']['l'] - layout['margin']['r']
+    plot_height = layout['height'] - layout['margin']['t'] - layout['margin']['b']
+    side = min(plot_width, plot_height)
+
+    return dict(source=source,
+                xref='paper',
+                yref='paper',
+                x=(plot_width - side) / 2 / plot_width,
+                y=1 - (plot_height - side) / 2 / plot_height,
+                sizex=side / plot_width,
+                sizey=side / plot_height,
+                xanchor='left',
+                yanchor='top',
+                sizing='stretch',
+                layer='below')
+
+
+@profiled('day_11.cells_figure')
+def cells_figure(country_txt='France',
+                 path=GTD_PATH,
+                 store_path=STORE_PATH,
+                 n=50,
+                 window=None,
+                 active_after=2010,
+                 metric='events',
+                 resolution='week',
+                 sparse=True,
+                 hover='embedded'):
+    cells, index = load_cells(path, store_path, resolution, sparse)
+
+    grid, unknown = country_cells(cells, index, country_txt, metric)
+    max_value = cells_max(cells, index,
+                          top_country_names(n, window, active_after, path,
+                                            store_path), metric)
+
+    years = np.asarray(index['years'])
+    geometry = resolution_geometry(years, resolution)
+    colors = cell_colors(grid, max_value)
+
+    # (an object array, as the month frame's columns give: np.stack over the years, labels and counts would make them all
+    # strings, and the ',.0f' of the hovertemplate would get a string)
+
+    labels = np.array(ring_labels(resolution), dtype='object')
+    customdata = np.empty(grid.shape + (3, ), dtype='object')
+    customdata[..., 0] = years[None, :].tolist()
+    customdata[..., 1] = labels[:, None]
+    customdata[..., 2] = grid.tolist()
+
+    unit = metric_units[metric]
+
+    if hover == 'lazy':
+        customdata = cell_keys(grid.shape)  # (see "Lazy hover")
+        cell_hover = dict(hoverinfo='none')
+    else:
+        cell_hover = dict(hovertemplate=hovertemplate.replace('attacks', unit))
+
+    layout = layout_dict(geometry)
+    layout['template'] = default_template()
+
+    if resolution == 'day':
+        nonzero = grid > 0
+        data_for_fig = [
+            dict(type='scatterpolargl',
+                 r=(geometry['base'] + geometry['r'] / 2)[nonzero],
+                 theta=geometry['theta'][nonzero],
+                 mode='markers',
+                 marker=dict(size=4,
+                             opacity=0,
+                             color=colors[nonzero],
+                             colorscale=colorscale,
+                             colorbar=colorbar,
+                             cmin=0.0,
+                             cmax=1.0),
+                 customdata=customdata[nonzero],
+                 **cell_hover,
+                 name=country_txt)
+        ]  # the hover layer (the cells themselves are in the image)
+
+        layout['images'] = [
+            raster_image(
+                png_data_uri(
+                    raster_cells(
+                        colorscale_rgba(colors),
+                        raster_lookup(tuple(index['years']),
+                                      radial_range=layout['polar']
+                                      ['radialaxis']['range'][1]))), layout)
+        ]
+    else:
+        data_for_fig = [
+            dict(type='barpolar',
+                 r=geometry['r'].ravel(),
+                 theta=geometry['theta'].ravel(),
+                 base=geometry['base'].ravel(),
+                 width=geometry['width'].ravel(),
+                 marker=dict(cauto=False,
+                             color=colors.ravel(),
+                             colorscale=colorscale,
+                             colorbar=colorbar,
+                             cmin=0.0,
+                             cmax=1.0,
+                             line=dict(color='rgba(217, 217, 217, 0.7)',
+                                       width=0.1)),
+                 customdata=customdata.reshape((-1, ) +
+                                               customdata.shape[2:]),
+                 **cell_hover,
+                 name=country_txt)
+        ]  # cells
+
+    data_for_fig.append(
+        dict(type='scatterpolar',
+             r=[geometry['guide_r']] * 40,
+             theta=geometry['theta'][-1],
+             mode='lines',
+             line=dict(color='rgba(217, 217, 217, 0.9)', width=0.6,
+                       dash='dot'),
+             hoverinfo='none'))  # dashed line
+
+    data_for_fig.append(
+        dict(type='scatterpolar',
+             r=[geometry['guide_r']],
+             theta=[180],
+             mode='markers',
+             marker=dict(size=7,
+                         symbol='arrow-left',
+                         color='rgba(217, 217, 217, 0.9)'),
+             hoverinfo='none'))  # dashed line arrow
+
+    if unknown.sum() > 0:
+        layout['annotations'] = [
+            dict(text='{:,.0f} {} with no known day are not shown'.format(
+                unknown.sum(), unit),
+                 xref='paper',
+                 yref='paper',
+                 x=0,
+                 y=0,
+                 xanchor='left',
+                 yanchor='bottom',
+                 showarrow=False,
+                 font=dict(color='rgba(217, 217, 217, 0.5)',
+                           family='Bodoni MT Condensed',
+                           size=15))
+        ]
+
+    return dict(data=data_for_fig, layout=layout)
+
+
+# Lazy hover *******************************************************************************************************************
+
+# Every cell carries its year, ring and count as hover data: 612 cells of a month figure, 2,652 of a week figure, and the
+# nonzero ones of a day figure, and hardly any of them is ever hovered. With hover='lazy', a cell carries a single integer key
+# instead, its place on the rings x years grid, and hoverinfo='none': plotly.js draws no label then, but still sends the hover
+# event, and the page asks the server for the label of that key (see dashboard/server.py). The labels are read from the stores,
+# filled into the hovertemplate as plotly.js fills it.
+
+
+def cell_keys(shape):
+    return np.arange(shape[0] * shape[1]).reshape(shape)
+
+
+@functools.lru_cache(maxsize=4096)
+def cell_label(store_path, mtime, country_txt, metric, resolution, sparse, key):
+    if resolution == 'month':
+        cube, index = load_store(store_path)
+        grid = cube[metrics.index(metric), index['country_txt'].index(country_txt)]
+        labels = [month_dict[12 - ring] for ring in range(12)]  # (the first ring is December, see "Binary store")
+    else:
+        cell_path = cell_store_path(store_path, resolution, sparse)
+        with open(cell_path + '.json') as f:
+            index = json.load(f)
+        grid, _ = country_cells(read_cells(cell_path, sparse, mtime), index,
+                                country_txt, metric)
+        labels = ring_labels(resolution)
+
+    ring, j = divmod(key, len(index['years']))  # (see cell_keys())
+
+    return hover_label(hovertemplate.replace('attacks', metric_units[metric]),
+                       [index['years'][j], labels[ring],
+                        float(grid[ring, j])])
+
+
+@profiled('day_11.hover_text')
+def hover_text(key,
+               country_txt='France',
+               path=GTD_PATH,
+               store_path=STORE_PATH,
+               metric='events',
+               resolution='month',
+               sparse=True):
+
+    # (the stores are rebuilt if stale; the labels are cached by key, and by the store's mtime, so a rebuilt store isn't
+    # served from the old labels)
+
+    if resolution == 'month':
+        load_data(path, store_path)
+        index_path = store_path + '.json'
+    else:
+        load_cells(path, store_path, resolution, sparse)
+        index_path = cell_store_path(store_path, resolution, sparse) + '.json'
+
+    return cell_label(store_path, os.path.getmtime(index_path), country_txt,
+                      metric, resolution, sparse, int(key))
+
+
+# A key is also what a click sends: the country, year and month of its cell, for the list of the cell's attacks (see
+# query/events.py). Only the month figure: a week or a day ring isn't a month of the index.
+
+
+def event_cell(key, country_txt='France', path=GTD_PATH, store_path=STORE_PATH, resolution='month'):
+    if resolution != 'month':
+        raise ValueError('the attacks of a cell: month resolution only')
+
+    _, index = load_data(path, store_path)
+    if country_txt not in index['country_txt']:
+        raise KeyError(country_txt)
+
+    ring, j = divmod(int(key), len(index['years']))  # (see cell_keys())
+    if not 0 <= ring < 12:
+        raise IndexError(key)
+
+    return country_txt, int(index['years'][j]), 12 - ring  # (the first ring is December, see "Binary store")
+
+
+if __name__ == '__main__':
+
+    fig = make_figure('France')
+
+    fig.show()
@@ -0,0 +1,130 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+from query import engine as query_engine
+from golden_figures import synthetic_gtd
+
+# ENGINE BENCHMARK *************************************************************************************************************
+
+# The Day 9 ranking and the Day 11 country/month/year counts, through the pandas path (prepare_data() on the csv) and through
+# each query engine that is installed (see query/engine.py), on a synthetic GTD of scale x the size of the real one (about
+# 210,000 attacks; 10x by default), made as the golden figures' one (a fixed seed). The engines' frames are checked against the
+# pandas ones. Cold is the first run (for an engine, with the conversion of the csv into the columnar cache), warm is the best
+# of the next ones:
+#
+#     python path/to/benchmarks/engine_benchmark.py [scale] [repeats] [engine ...]
+
+GTD_ROWS = 210000
+
+# Run **************************************************************************************************************************
+
+
+def timed(function, repeats):
+    start = time.perf_counter()
+    result = function()
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        warm.append(time.perf_counter() - start)
+
+    return result, cold * 1000, min(warm, default=cold) * 1000
+
+
+def same_frame(expected, found):
+    import pandas as pd
+
+    try:
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True),
+                                      found.reset_index(drop=True),
+                                      check_dtype=False)
+    except AssertionError as error:
+        return str(error).splitlines()[0]
+    return 'same'
+
+
+def main(scale='10', repeats='2', *engines):
+    scale = float(scale)
+    repeats = int(repeats)
+    engines = engines or ('duckdb', 'polars')
+
+    data_dir = tempfile.mkdtemp(prefix='engine_benchmark_')
+    cwd = os.getcwd()
+
+    failed = []
+
+    try:
+        os.chdir(data_dir)
+
+        start = time.perf_counter()
+        synthetic_gtd(day_09.GTD_PATH, n=int(GTD_ROWS * scale))
+        print('{:,} synthetic attacks ({:.0f} MB) in {:.1f} s\n'.format(
+            int(GTD_ROWS * scale),
+            os.path.getsize(day_09.GTD_PATH) / 1024**2,
+            time.perf_counter() - start))
+
+        print('{:<24} {:>10} {:>10} {:>7}   {}'.format('case', 'cold, ms',
+                                                      'warm, ms', 'speed',
+                                                      'frames'))
+
+        day_09_frames, cold, warm = timed(day_09.prepare_data, repeats)
+        day_11_frame, cold_11, warm_11 = timed(day_11.prepare_data, repeats)
+        baseline = dict(day_09=warm, day_11=warm_11)
+
+        print('{:<24} {:>10.1f} {:>10.1f} {:>7}'.format('day_09 pandas', cold,
+                                                        warm, '-'))
+        print('{:<24} {:>10.1f} {:>10.1f} {:>7}'.format('day_11 pandas', cold_11,
+                                                        warm_11, '-'))
+
+        for name in engines:
+            try:
+                start = time.perf_counter()
+                engine = query_engine.open_engine(name, wpp_path=None)
+                opened = (time.perf_counter() - start) * 1000
+            except ImportError as error:
+                print('{:<24} not installed ({})'.format(name, error))
+                continue
+
+            print('{:<24} {:>10.1f} {:>10} {:>7}   (the columnar cache)'.format(
+                name + ' open', opened, '-', '-'))
+
+            for chart, function, expected in (
+                ('day_09', lambda: query_engine.day_09_data(engine),
+                 day_09_frames),
+                ('day_11', lambda: query_engine.day_11_data(engine),
+                 (day_11_frame, ))):
+                found, cold, warm = timed(function, repeats)
+                found = found if isinstance(found, tuple) else (found, )
+
+                status = ', '.join(
+                    same_frame(e, f) if hasattr(e, 'columns') else
+                    ('same' if e == f else 'DIFFERENT')
+                    for e, f in zip(expected, found))
+                if any(part != 'same' for part in status.split(', ')):
+                    failed.append(chart + ' ' + name)
+
+                print('{:<24} {:>10.1f} {:>10.1f} {:>7}   {}'.format(
+                    '{} {}'.format(chart, name), cold, warm,
+                    'x{:.1f}'.format(baseline[chart] / warm), status))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,130 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import time
+import math
+import base64
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+# FIGURE BENCHMARK *************************************************************************************************************
+
+# The current go.* construction + fig.to_json() against the plain-dict builders (figure_dict + dumps) for Day 8 (72 frames x 12
+# traces), Day 9 (pair_figure over the country payloads) and Day 11 (12 Barpolar traces). The data is prepared once, outside
+# the timings. Both outputs are loaded back and compared, so a speedup never comes at the cost of a different figure. Run it
+# from the folder with the data files:
+#
+#     python path/to/benchmarks/figure_benchmark.py [repeats]
+
+# Equivalence ******************************************************************************************************************
+
+
+def normalize(obj):
+
+    # plotly's to_json writes numeric arrays as base64 typed arrays ({'dtype': 'f8', 'bdata': ...}), the dict builders as
+    # plain lists. A property set to None comes out of plotly's validators as {} (e.g. the axis titles), and either way it is
+    # unset in plotly.js, so both are dropped. A NaN in a typed array and a null in a list are the same gap in a line.
+
+    if isinstance(obj, dict):
+        if 'bdata' in obj and 'dtype' in obj:
+            array = np.frombuffer(base64.b64decode(obj['bdata']),
+                                  dtype=obj['dtype'])
+            if 'shape' in obj:
+                array = array.reshape(
+                    [int(n) for n in str(obj['shape']).split(',')])
+            return normalize(array.tolist())
+        return {
+            k: normalize(v)
+            for k, v in obj.items() if v is not None and v != {}
+        }
+    if isinstance(obj, list):
+        return [normalize(v) for v in obj]
+    if isinstance(obj, float) and math.isnan(obj):
+        return None
+    return obj
+
+
+def differences(a, b, path='', found=None, tolerance=1e-9):
+    found = [] if found is None else found
+
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b)):
+            if key not in a or key not in b:
+                found.append('{}/{}: missing'.format(path, key))
+            else:
+                differences(a[key], b[key], '{}/{}'.format(path, key), found,
+                            tolerance)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            found.append('{}: length {} != {}'.format(path, len(a), len(b)))
+        else:
+            for i, (x, y) in enumerate(zip(a, b)):
+                differences(x, y, '{}[{}]'.format(path, i), found, tolerance)
+    elif isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        if not math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance):
+            found.append('{}: {} != {}'.format(path, a, b))
+    elif a != b:
+        found.append('{}: {!r} != {!r}'.format(path, a, b))
+
+    return found
+
+
+# Timing ***********************************************************************************************************************
+
+
+def timed(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def compare(name, go_path, dict_path, repeats):
+    go_time, go_json = timed(go_path, repeats)
+    dict_time, dict_json = timed(dict_path, repeats)
+
+    found = differences(normalize(json.loads(go_json)),
+                        normalize(json.loads(dict_json)))
+
+    print('{:<8} go.* + to_json: {:>8.1f} ms   figure_dict + dumps: {:>8.1f} ms'
+          '   x{:<5.1f} {:>7.0f} KB -> {:>7.0f} KB   {}'.format(
+              name, go_time * 1000, dict_time * 1000, go_time / dict_time,
+              len(go_json) / 1024, len(dict_json) / 1024,
+              'same figure' if not found else 'DIFFERENT'))
+
+    for difference in found[:20]:
+        print('    ' + difference)
+
+    return not found
+
+
+def main(repeats=5):
+    dff, dffl = day_08.prepare_data()
+    matrix_df, dff1 = day_09.chart_data()
+    payloads = day_09.load_payloads()
+    dfff = day_11.chart_data('France')
+
+    same = [
+        compare('Day 8', lambda: day_08.build_figure(dff, dffl).to_json(),
+                lambda: day_08.dumps(day_08.figure_dict(dff, dffl)), repeats),
+        compare('Day 9', lambda: day_09.build_figure(matrix_df, dff1).to_json(),
+                lambda: day_09.dumps(day_09.pair_figure(payloads)), repeats),
+        compare('Day 11', lambda: day_11.build_figure(dfff).to_json(),
+                lambda: day_11.dumps(day_11.figure_dict(dfff)), repeats)
+    ]
+
+    return 0 if all(same) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,273 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+from figure_benchmark import normalize, differences
+
+# GOLDEN FIGURES ***************************************************************************************************************
+
+# Every rewrite of the pipelines for speed can change the figures in small ways: the ties in the ranks, the 1993 gap, the fall
+# to 62 ("No Rank"), the colorscale stops, the contents of the frames. So each chart is built here from small synthetic data
+# files (generated with a fixed seed, so no real data is needed), normalized (see figure_benchmark.py) and compared, with a
+# numeric tolerance, to a stored snapshot of the same figure: golden/<name>.json.gz. The fast paths (the plain-dict builders,
+# the Day 9 payloads) are compared to the snapshot of the figure they replace.
+#
+# Each case is timed as well: the first run (cold: the stores are built) and the best of the next ones (warm), next to the
+# warm time recorded with the snapshots, so one command says whether a change is both the same figure and faster:
+#
+#     python path/to/benchmarks/golden_figures.py [check|update] [repeats]
+#
+# "update" rewrites the snapshots and the times, after a change to the figures that is meant.
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Synthetic data ***************************************************************************************************************
+
+# The GTD: 70 countries (more than the 57 ranks of the chart, so some fall to 62) in 5 regions, two of them with exactly the
+# same attacks (ties in every year), a country that stops in 2005, no 1993 (as in the GTD), some unknown months and days, and
+# missing nkill/nwound.
+
+
+def synthetic_gtd(path, seed=0, n=20000):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+
+    countries = ['Country {}'.format(i) for i in range(64)] + [
+        'United States', 'Afghanistan', 'France', 'Bosnia-Herzegovina',
+        'Central African Republic', 'West Bank and Gaza Strip'
+    ]
+    weights = rng.random(len(countries))**3
+    weights /= weights.sum()
+
+    codes = rng.choice(len(countries), n, p=weights)
+    years = rng.integers(1970, 2022, n)
+    years[years == 1993] = 1994
+    years[codes == 0] = np.minimum(years[codes == 0], 2005)
+
+    df = pd.DataFrame({
+        'eventid': np.arange(n) + 197000000000,
+        'iyear': years,
+        'imonth': rng.integers(0, 13, n),
+        'iday': rng.integers(0, 32, n),
+        'country': codes + 1,
+        'country_txt': np.array(countries)[codes],
+        'nkill': np.where(rng.random(n) < 0.2, np.nan, rng.integers(0, 20, n)),
+        'nwound': np.where(rng.random(n) < 0.3, np.nan, rng.integers(0, 30, n))
+    })
+
+    # Five regions, the countries dealt out to them in turn (the regions and the world are rolled up in the stores):
+
+    df['region_txt'] = np.array(['Region A', 'Region B', 'Region C', 'Region D',
+                                 'Region E'])[codes % 5]
+
+    # The twin: a copy of France's attacks
+
+    twin = df[df['country_txt'] == 'France'].copy()
+    twin['eventid'] += n
+    twin['country'] = len(countries) + 1
+    twin['country_txt'] = 'Country 64'
+
+    df = pd.concat([df, twin], ignore_index=True)
+    df.index = df['eventid'].rename('idx')  # (the charts read the file with index_col=0)
+    df.to_csv(path)
+
+
+def synthetic_wpp(path, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for location, scale in (('World', 1000), ('Europe', 100)):
+        for year in range(1950, 2022):
+            for age in list(range(100)) + ['100+']:
+                rows.append((location, year, age,
+                             rng.integers(1, scale) / (1 + (year - 1950) / 50)))
+
+    pd.DataFrame(rows, columns=['Location', 'Time', 'AgeGrp',
+                                'DeathTotal']).to_csv(path, index=False)
+
+
+# Cases ************************************************************************************************************************
+
+# (snapshot name, case name, function returning the figure json); all run in the folder with the synthetic files
+
+
+def cases():
+    return [
+        ('day_08_World', 'day_08 go',
+         lambda: day_08.make_figure().to_json()),
+        ('day_08_World', 'day_08 dict',
+         lambda: day_08.dumps(day_08.figure_dict(*day_08.prepare_data()))),
+        ('day_08_Europe', 'day_08 Europe',
+         lambda: day_08.make_figure(location='Europe').to_json()),
+        ('day_09', 'day_09 go', lambda: day_09.make_figure().to_json()),
+        ('day_09', 'day_09 payloads', lambda: day_09.pair_json()),
+        ('day_09_ties', 'day_09 ties',
+         lambda: day_09.make_figure('France', 'Country 64').to_json()),
+        ('day_09_fatalities_3', 'day_09 window',
+         lambda: day_09.make_figure(window=3, metric='fatalities').to_json()),
+        ('day_09_fatalities_3', 'day_09 window payloads',
+         lambda: day_09.pair_json(window=3, metric='fatalities')),
+        ('day_11', 'day_11 go', lambda: day_11.make_figure().to_json()),
+        ('day_11', 'day_11 dict',
+         lambda: day_11.dumps(day_11.figure_dict(day_11.chart_data()))),
+        ('day_09_regions', 'day_09 regions',
+         lambda: day_09.make_figure('Region A', 'Region C').to_json()),
+        ('day_09_regions', 'day_09 regions payloads',
+         lambda: day_09.pair_json('Region A', 'Region C')),
+        ('day_11_casualties', 'day_11 casualties',
+         lambda: day_11.make_figure(metric='casualties').to_json()),
+        ('day_11_world', 'day_11 world',
+         lambda: day_11.make_figure('World').to_json()),
+        ('day_11_world', 'day_11 world dict',
+         lambda: day_11.dumps(day_11.figure_dict(day_11.chart_data('World')))),
+        ('day_11_week', 'day_11 week',
+         lambda: day_11.dumps(day_11.cells_figure(resolution='week'))),
+        ('day_11_day', 'day_11 day',
+         lambda: day_11.dumps(day_11.cells_figure(resolution='day'))),
+        ('day_09_movers', 'day_09 movers', movers_json)
+    ]
+
+
+# The biggest movers where only a few move: two of the 5 regions between these years (none from 2010 to 2011), and the world
+# never moves, so the lists of k=5 must not be padded with the ones that stayed or went the other way.
+
+
+def movers_json():
+    return json.dumps({
+        '{} {} {}'.format(level, direction, years): day_09.biggest_movers(
+            *years, k=5, direction=direction, level=level)
+        for level in ('region', 'world')
+        for direction in ('risers', 'fallers')
+        for years in ((1979, 1980), (2010, 2012), (2010, 2011))
+    })
+
+
+# Snapshots ********************************************************************************************************************
+
+
+def snapshot_path(name):
+    return os.path.join(GOLDEN_DIR, name + '.json.gz')
+
+
+def read_snapshot(name):
+    with gzip.open(snapshot_path(name), 'rt') as f:
+        return json.load(f)
+
+
+def write_snapshot(name, fig):
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+
+    # (sorted keys and a fixed gzip timestamp: the same figure is always the same file)
+
+    data = json.dumps(fig, sort_keys=True, separators=(',', ':')).encode()
+    with open(snapshot_path(name), 'wb') as f:
+        f.write(gzip.compress(data, mtime=0))
+
+
+def read_timings():
+    try:
+        with open(os.path.join(GOLDEN_DIR, 'timings.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def write_timings(timings):
+    with open(os.path.join(GOLDEN_DIR, 'timings.json'), 'w') as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+
+
+# Run **************************************************************************************************************************
+
+
+def run_case(function, repeats):
+    start = time.perf_counter()
+    fig_json = function()
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        warm.append(time.perf_counter() - start)
+
+    return json.loads(fig_json), cold * 1000, min(warm, default=cold) * 1000
+
+
+def main(mode='check', repeats='3'):
+    repeats = int(repeats)
+
+    data_dir = tempfile.mkdtemp(prefix='golden_figures_')
+    cwd = os.getcwd()
+
+    timings = read_timings()
+    failed = []
+
+    print('{:<24} {:>9} {:>9} {:>9} {:>7}   {}'.format('case', 'cold, ms',
+                                                      'warm, ms', 'was, ms',
+                                                      'speed', 'figure'))
+
+    try:
+        os.chdir(data_dir)
+        synthetic_gtd(day_09.GTD_PATH)
+        synthetic_wpp(day_08.WPP_PATH)
+
+        updated = set()
+
+        for name, case, function in cases():
+            fig, cold, warm = run_case(function, repeats)
+            fig = normalize(fig)
+
+            if mode == 'update' and name not in updated:
+                write_snapshot(name, fig)
+                updated.add(name)
+                status = 'written'
+            elif not os.path.exists(snapshot_path(name)):
+                status = 'NO SNAPSHOT'
+                failed.append(case)
+            else:
+                found = differences(read_snapshot(name), fig)
+                status = 'same' if not found else 'DIFFERENT ({})'.format(
+                    len(found))
+                if found:
+                    failed.append(case)
+                    for difference in found[:10]:
+                        status += '\n    ' + difference
+
+            was = timings.get(case)
+            if mode == 'update':
+                timings[case] = round(warm, 2)
+
+            print('{:<24} {:>9.1f} {:>9.1f} {:>9} {:>7}   {}'.format(
+                case, cold, warm, '-' if was is None else '{:.1f}'.format(was),
+                '-' if was is None else 'x{:.2f}'.format(was / warm), status))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if mode == 'update':
+        write_timings(timings)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
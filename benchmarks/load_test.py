@@ -0,0 +1,299 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+from dashboard import server as chart_server
+from golden_figures import synthetic_gtd, synthetic_wpp
+
+# LOAD TEST ********************************************************************************************************************
+
+# How many dashboard users one process serves: a number of simulated users (threads), each going through selection sessions
+# as a person at the dashboard does (a chart, then a few changes of the pair, the country, the location, with a few hovered
+# points after each figure; see "Sessions"), as fast as the server answers or with a think time between the requests. The
+# server is dashboard/server.py, either started in this process (on the synthetic data of the golden figures, in a temporary
+# folder, or on the data files of a folder, served from refresh snapshots built there at start) or already running (a url,
+# run from its data folder: the choices are read here).
+#
+# Every few seconds a line of the requests done in that interval: throughput, latency percentiles, errors, the hit rate of the
+# server's caches and its memory (from /metrics), and at the end the same per route and chart, the hits and misses of each
+# cache, and the growth of the memory over the run:
+#
+#     python path/to/benchmarks/load_test.py [users] [seconds] [synthetic|data_dir|url] [think_ms] [hovers] [location,...]
+#
+# In-process, the users and the server share one interpreter (and its GIL), and the memory is that of both: for sizing, start
+# the server on its own and give its url.
+
+REPORT_EVERY = 5  # seconds
+
+chart_mix = dict(day_09=0.5, day_11=0.35, day_08=0.15)  # the share of the sessions of each chart
+
+# Sessions *********************************************************************************************************************
+
+# A few countries get most of the selections: the choices of each chart are taken in the order of the selector (the most
+# attacks first), with Zipf weights. A session is a chart with 2-8 selections, each one a change of the one before: mostly the
+# second country of the Day 9 pair, sometimes the first one, the window or the metric; the Day 11 country, sometimes the
+# resolution; the Day 8 location.
+
+
+def zipf_weights(n, s=1.1):
+    weights = 1 / np.arange(1, n + 1)**s
+    return weights / weights.sum()
+
+
+def selection_options(locations=('World', )):
+    table, index = day_09.load_data()
+    table, index = day_09.level_table(table, index, 'country')
+    order = np.argsort(-np.nansum(table[0], axis=1), kind='stable')
+
+    return dict(day_09=[index['countries'][i] for i in order],
+                day_11=day_11.top_country_names(),
+                day_08=list(locations))
+
+
+def pick(rng, choices, exclude=None):
+    while True:
+        choice = choices[rng.choice(len(choices), p=zipf_weights(len(choices)))]
+        if choice != exclude or len(choices) == 1:
+            return choice
+
+
+def session(rng, options):
+    chart = rng.choice(list(chart_mix), p=list(chart_mix.values()))
+    choices = options[chart]
+
+    if chart == 'day_09':
+        params = dict(country_1=pick(rng, choices), window=1, metric='events')
+        params['country_2'] = pick(rng, choices, params['country_1'])
+    elif chart == 'day_11':
+        params = dict(country_txt=pick(rng, choices), resolution='month')
+    else:
+        params = dict(location=pick(rng, choices))
+
+    for step in range(rng.integers(2, 9)):
+        if step > 0:
+            change = rng.random()
+
+            if chart == 'day_09' and change < 0.6:
+                params['country_2'] = pick(rng, choices, params['country_1'])
+            elif chart == 'day_09' and change < 0.85:
+                params['country_1'] = pick(rng, choices, params['country_2'])
+            elif chart == 'day_09' and change < 0.95:
+                params['window'] = day_09.windows[rng.integers(len(day_09.windows))]  # (an int, or 'decade')
+            elif chart == 'day_09':
+                params['metric'] = str(rng.choice(day_09.metrics))
+            elif chart == 'day_11' and change < 0.8:
+                params['country_txt'] = pick(rng, choices)
+            elif chart == 'day_11':
+                params['resolution'] = str(rng.choice(['month', 'week', 'day'], p=[0.5, 0.4, 0.1]))
+            else:
+                params['location'] = pick(rng, choices)
+
+        yield chart, dict(params)
+
+
+# The hovered points: keys of the lazy-hover figure (see "Lazy hover" in each day's code), taken from its traces
+
+
+def hover_keys(fig_json):
+    keys = []
+    for trace in json.loads(fig_json)['data']:
+        if trace.get('hoverinfo') == 'none' and isinstance(trace.get('customdata'), list):
+            keys.extend(np.ravel(trace['customdata']).tolist())
+    return keys
+
+
+# Users ************************************************************************************************************************
+
+# Each request is recorded as (time done, route, chart, ms, ok); list.append is atomic, so the users share one list.
+
+
+def get(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=120) as response:
+            body = response.read().decode()
+        ok = True
+    except (urllib.error.URLError, OSError):  # (HTTPError is an URLError)
+        body, ok = None, False
+    return body, (time.perf_counter() - start) * 1000, ok
+
+
+def user(base_url, options, seed, stop, records, think_ms=0, hovers=2):
+    rng = np.random.default_rng(seed)
+
+    def request(route, chart, params):
+        url = '{}/{}/{}?{}'.format(base_url, route, chart, urllib.parse.urlencode(params))
+        body, ms, ok = get(url)
+        records.append((time.perf_counter(), route, chart, ms, ok))
+
+        if think_ms:
+            time.sleep(rng.exponential(think_ms / 1000))
+        return body
+
+    while not stop.is_set():
+        for chart, params in session(rng, options):
+            if stop.is_set():
+                break
+
+            fig_json = request('figure', chart, dict(params, hover='lazy'))
+            if fig_json is None or not hovers:
+                continue
+
+            keys = hover_keys(fig_json)
+            for key in rng.choice(keys, min(hovers, len(keys)), replace=False) if keys else []:
+                request('hover', chart, dict(params, key=int(key)))
+
+
+# Report ***********************************************************************************************************************
+
+
+def read_metrics(base_url):
+    with urllib.request.urlopen(base_url + '/metrics', timeout=30) as response:
+        return json.loads(response.read())
+
+
+def hit_rate(before, after, names=None):
+    hits = misses = 0
+    for name, stats in after['caches'].items():
+        if names is None or name in names:
+            hits += stats['hits'] - before['caches'][name]['hits']
+            misses += stats['misses'] - before['caches'][name]['misses']
+    return hits / (hits + misses) if hits + misses else float('nan')
+
+
+def latency_line(name, records, seconds):
+    ms = np.array([record[3] for record in records])
+    errors = sum(not record[4] for record in records)
+    if not len(ms):
+        return '{:<22} {:>7} {:>8}'.format(name, 0, '-')
+
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return '{:<22} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>6}'.format(
+        name, len(ms), len(ms) / seconds, p50, p90, p99, ms.max(), errors)
+
+
+def run(base_url, options, users=8, seconds=30, think_ms=0, hovers=2):
+    records = []
+    stop = threading.Event()
+
+    first = read_metrics(base_url)
+    start = time.perf_counter()
+    memory = [(0.0, first['rss_mb'])]
+
+    threads = [
+        threading.Thread(target=user,
+                         args=(base_url, options, seed, stop, records, think_ms, hovers),
+                         daemon=True) for seed in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+
+    print('{:>6} {:>7} {:>8} {:>8} {:>8} {:>8} {:>6} {:>8} {:>8}'.format(
+        's', 'reqs', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'errors', 'hits', 'rss MB'))
+
+    done = 0
+    last = first
+    while time.perf_counter() - start < seconds:
+        time.sleep(min(REPORT_EVERY, max(seconds - (time.perf_counter() - start), 0)))
+
+        now = read_metrics(base_url)
+        elapsed = time.perf_counter() - start
+        interval = records[done:]  # (the ones appended since the last line)
+        done += len(interval)
+
+        ms = np.array([record[3] for record in interval]) if interval else np.zeros(1)
+        print('{:>6.0f} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>6} {:>8.0%} {:>8.1f}'.format(
+            elapsed, len(interval), len(interval) / (elapsed - memory[-1][0]), *np.percentile(ms, [50, 90, 99]),
+            sum(not record[4] for record in interval), hit_rate(last, now), now['rss_mb']))
+
+        memory.append((elapsed, now['rss_mb']))
+        last = now
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    # The whole run
+
+    elapsed = time.perf_counter() - start
+    final = read_metrics(base_url)
+
+    print('\n{:<22} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8} {:>6}'.format('route', 'reqs', 'req/s', 'p50 ms', 'p90 ms',
+                                                                    'p99 ms', 'max ms', 'errors'))
+    print(latency_line('all', records, elapsed))
+    for route in ('figure', 'hover'):
+        for chart in ('day_08', 'day_09', 'day_11'):
+            print(latency_line('{} {}'.format(route, chart),
+                               [record for record in records if record[1:3] == (route, chart)], elapsed))
+
+    print('\n{:<22} {:>9} {:>9} {:>8}'.format('cache', 'hits', 'misses', 'hit rate'))
+    for name, stats in sorted(final['caches'].items()):
+        hits = stats['hits'] - first['caches'][name]['hits']
+        misses = stats['misses'] - first['caches'][name]['misses']
+        if hits + misses:
+            print('{:<22} {:>9} {:>9} {:>8.1%}'.format(name, hits, misses, hits / (hits + misses)))
+
+    # (the growth over the second half is the one to watch: by then the caches should be full)
+
+    times, rss = np.array(memory).T
+    second_half = times >= times[-1] / 2
+    slope = np.polyfit(times[second_half], rss[second_half], 1)[0] * 60 if second_half.sum() > 1 else float('nan')
+
+    print('\nmemory: {:.1f} MB -> {:.1f} MB (peak {:.1f} MB), {:+.1f} MB/min over the second half'.format(
+        rss[0], final['rss_mb'], max(rss.max(), final['rss_mb']), slope))
+
+    return 1 if any(not record[4] for record in records) else 0
+
+
+def main(users='8', seconds='30', target='synthetic', think_ms='0', hovers='2', locations=None):
+    users, seconds, think_ms, hovers = int(users), float(seconds), float(think_ms), int(hovers)
+    locations = locations.split(',') if locations else None
+
+    if target.startswith('http'):
+        return run(target.rstrip('/'), selection_options(locations or ('World', )), users, seconds, think_ms, hovers)
+
+    cwd = os.getcwd()
+    data_dir = tempfile.mkdtemp(prefix='load_test_') if target == 'synthetic' else target
+
+    try:
+        os.chdir(data_dir)
+
+        if target == 'synthetic':
+            synthetic_gtd(day_09.GTD_PATH)
+            synthetic_wpp(day_08.WPP_PATH)
+            locations = locations or ('World', 'Europe')
+
+        options = selection_options(locations or ('World', ))
+        server = chart_server.start_server(access_log=os.devnull, locations=options['day_08'])
+
+        try:
+            return run('http://127.0.0.1:{}'.format(server.server_port), options, users, seconds, think_ms, hovers)
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        os.chdir(cwd)
+        if target == 'synthetic':
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
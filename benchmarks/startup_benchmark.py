@@ -0,0 +1,79 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import re
+import sys
+import time
+import subprocess
+
+# STARTUP BENCHMARK ************************************************************************************************************
+
+# Each chart module is imported in a fresh interpreter with -X importtime, which prints one line per imported module to stderr:
+# "import time: self [us] | cumulative | imported package". The heavy packages (pandas, plotly.graph_objects) should not show
+# up there at all, since they are imported only when the raw data is prepared or a figure is built.
+#
+# Then the cache-hit path (figure_json with the figure already cached) is timed in a fresh interpreter as well. Run it from the
+# folder with the data files (and the built stores/figure cache):
+#
+#     python path/to/benchmarks/startup_benchmark.py
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'Day_08_Humans.day_08_chart_code', 'Day_09_High_Low.day_09_chart_code',
+    'Day_11_Circular.day_11_chart_code'
+]
+
+HEAVY = ['pandas', 'plotly', 'plotly.graph_objects']
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(statement):
+    code = 'import sys; sys.path.insert(0, {!r}); {}'.format(REPO, statement)
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True,
+                            text=True)
+    wall = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.splitlines()[-1])
+
+    # Only the top-level imports (no indentation) add up to the whole import time:
+
+    modules = dict()
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))  # cumulative, us
+            if match.group(3) == ' ':
+                total += int(match.group(2))
+
+    return total, modules, wall
+
+
+def report(title, statement):
+    print('{:<24} {:>10} {:>8} {:>8}  {}'.format(title, 'import, ms',
+                                                 'wall, ms', 'modules',
+                                                 'heavy imports'))
+
+    for module in MODULES:
+        total, modules, wall = import_times(statement.format(module))
+        heavy = [name for name in HEAVY if name in modules]
+        print('{:<24} {:>10.1f} {:>8.1f} {:>8}  {}'.format(
+            module.split('.')[1], total / 1000, wall * 1000, len(modules),
+            ', '.join(heavy) or '-'))
+
+    print()
+
+
+def main():
+    report('import', 'import {0}')
+    report('cache hit', 'import {0}; {0}.figure_json()')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import re
+import json
+import functools
+
+import numpy as np
+
+from common.profiling import profiled
+
+# The parts of the plain-dict figures that are the same for the three charts: the template, the serialization, the lazy hover
+# labels and the sums of the regions. plotly itself is never imported here.
+
+# Plain-dict figures ***********************************************************************************************************
+
+
+@functools.lru_cache()
+def default_template():
+    import importlib.util
+
+    # plotly's default template, read straight from its package data, so that plotly itself doesn't have to be imported:
+
+    plotly_dir = importlib.util.find_spec('plotly').submodule_search_locations[0]
+    with open(os.path.join(plotly_dir, 'package_data', 'templates',
+                           'plotly.json')) as f:
+        return json.load(f)
+
+
+def json_default(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'f':
+            return np.where(np.isnan(obj), None, obj).tolist()  # NaN -> null, as in plotly's json
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+@profiled('figures.dumps')  # (inside the span of the chart that asked for it, e.g. day_09.figure_json)
+def dumps(fig):
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(fig, default=json_default, allow_nan=False)
+
+    return orjson.dumps(fig,
+                        default=json_default,
+                        option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+# Lazy hover *******************************************************************************************************************
+
+
+def hover_label(template, values):
+
+    # (%{customdata[k]} as it is, %{customdata[k]:format} with its d3 format: the ones the charts use, ',.0f', ',.1f' and
+    # ',.0%', mean the same in python; the <extra> box is left out)
+
+    def fill(match):
+        value = values[int(match.group(1))]
+        return str(value) if match.group(2) is None else format(
+            value, match.group(2))
+
+    text = re.sub(r'%\{customdata\[(\d+)\](?::([^}]*))?\}', fill,
+                  template.replace('<extra></extra>', ''))
+    return re.sub(r'\s*<br>\s*', '<br>', text)
+
+
+# Regions **********************************************************************************************************************
+
+
+def roll_up(values, regions):
+
+    # The countries (axis 1) summed into their regions, and the regions into the world, in numpy (not grouped again from the
+    # attacks):
+
+    names, codes = np.unique(regions, return_inverse=True)
+
+    shape = list(values.shape)
+    shape[1] = len(names)
+
+    region_values = np.zeros(shape)
+    np.add.at(region_values, (slice(None), codes), values)
+
+    return names.tolist() + ['World'], np.concatenate(
+        (region_values, region_values.sum(axis=1, keepdims=True)), axis=1)
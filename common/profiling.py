@@ -0,0 +1,136 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import time
+import json
+import atexit
+import threading
+import functools
+import contextlib
+import tracemalloc
+
+# The helpers shared by the three charts and by the modules around them (the dashboard, the event index, the exports): the
+# spans of the profiler and the temporary files. Only the standard library is imported here.
+
+# PROFILING ********************************************************************************************************************
+
+# Each stage of the pipeline runs inside a named span that records its wall time, CPU time, peak traced memory (tracemalloc)
+# and the rows it returned. Profiling is off by default, and then a span costs a single check of PROFILE_DIR. To switch it on,
+# point the VIZZES_PROFILE environment variable to a folder (or set PROFILE_DIR here): at exit, each process writes the spans of
+# all the charts there as one Chrome trace (vizzes_trace_<pid>.json), which opens in chrome://tracing, Perfetto or speedscope.
+# The spans are named after their chart (day_08.prepare_data...), so a server that has built the three charts has one trace.
+
+PROFILE_DIR = os.environ.get('VIZZES_PROFILE')
+
+trace_events = []
+open_spans = threading.local()  # the stack of the spans that are running in this thread
+
+
+def rows(result):
+    if isinstance(result, tuple):
+        return [rows(r) for r in result]
+    if hasattr(result, 'shape'):  # data frames and arrays
+        return int(result.shape[0])
+    if isinstance(result, list):  # e.g. the animation frames
+        return len(result)
+    if isinstance(result, dict) and 'data' in result:  # plain-dict figures: the traces
+        return len(result['data'])
+    if hasattr(result, 'data') and isinstance(result.data, tuple):  # go.Figure
+        return len(result.data)
+    return None
+
+
+@contextlib.contextmanager
+def span(name):
+    if PROFILE_DIR is None:
+        yield dict()
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    # The peak is reset at the start of every span, so the peak reached so far is handed over to the enclosing span first (and
+    # the span's own peak is handed back to it at the end):
+
+    stack = open_spans.__dict__.setdefault('stack', [])
+    if stack:
+        stack[-1]['peak'] = max(stack[-1]['peak'],
+                                tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+
+    memory = tracemalloc.get_traced_memory()[0]
+    record = dict(name=name,
+                  ph='X',
+                  pid=os.getpid(),
+                  tid=threading.get_ident(),
+                  args=dict(),
+                  peak=memory)
+    stack.append(record)
+
+    cpu = time.thread_time()
+    start = time.perf_counter()
+
+    try:
+        yield record['args']
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.thread_time() - cpu
+
+        stack.pop()
+        peak = max(record.pop('peak'), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+        record.update(ts=start * 1e6, dur=wall * 1e6)
+        record['args'].update(cpu_ms=cpu * 1000,
+                              peak_kb=(peak - memory) / 1024)
+        trace_events.append(record)
+
+
+def profiled(name):
+
+    # The decorator for the stage functions: the span is named after the stage, and its args get the row count of the output.
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if PROFILE_DIR is None:
+                return function(*args, **kwargs)
+
+            with span(name) as span_args:
+                result = function(*args, **kwargs)
+                span_args['rows'] = rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# Every file here is written to a temporary file first, then moved into place. The temporary name is one per process and
+# thread: two requests of the server building the same file at once each write their own, and the last move wins.
+
+
+def tmp_path(path):
+    return '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def write_trace(trace_dir=None):
+    if not trace_events:
+        return None
+
+    trace_dir = trace_dir or PROFILE_DIR
+    os.makedirs(trace_dir, exist_ok=True)
+    trace_path = os.path.join(trace_dir,
+                              'vizzes_trace_{}.json'.format(os.getpid()))
+
+    with open(tmp_path(trace_path), 'w') as f:
+        json.dump(dict(traceEvents=trace_events, displayTimeUnit='ms'), f)
+    os.replace(tmp_path(trace_path), trace_path)
+
+    return trace_path
+
+
+atexit.register(write_trace)
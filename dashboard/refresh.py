@@ -0,0 +1,374 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+from query import events
+
+# REFRESH SERVICE **************************************************************************************************************
+
+# On the dashboard, the charts are served by a long-lived process, and a new GTD or WPP file must not be read in a request.
+# Here the source files are polled in the background; once a file has changed (and stopped changing, so a half-copied file
+# isn't read), its stores, payloads and default figures are rebuilt in a process pool, into a new versioned snapshot folder:
+#
+#     snapshots/gtd-000002/  day_09_ranks.*, day_09_payloads*.npz (every window, metric and level), day_11_counts.* (and its
+#                            sparse week/day cells), gtd_events.*, figure_cache/
+#     snapshots/wpp-000001/  figure_cache/day_08_World.json (and the lazy-hover one, with its hover table)
+#
+# The snapshot in use is swapped only when the new one is complete: in this process by replacing the reference (a request
+# takes the reference once and keeps reading that snapshot, even if a swap happens meanwhile), and for the other worker
+# processes by renaming a pointer file (snapshots/gtd.json) over the old one. The previous snapshots are kept for a while,
+# since they can still be read. The charts are read from the snapshots with path=None: the stores are served as they are and
+# the raw files are never touched in a request.
+#
+#     service = new_service()
+#     await start(service)  # loads the current snapshots (or builds them) and starts watching
+#     fig_json = figure_json(service, 'day_09', country_1='France', country_2=None)
+#     metrics(service)  # refresh durations, swap latencies, versions, errors
+
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_FORMAT = 3  # the contents above; a snapshot of an older format is rebuilt at start
+POLL_INTERVAL = 5  # s
+KEEP_SNAPSHOTS = 3  # per source, the current one included
+
+sources = {'gtd': day_09.GTD_PATH, 'wpp': day_08.WPP_PATH}
+locations = ['World']  # the Day 8 figures built into a snapshot (the other locations need the WPP file)
+
+# Snapshots ********************************************************************************************************************
+
+
+def build_snapshot(source, path, snapshot_path, locations=locations):
+
+    # This runs in a worker process. The snapshot is built in a temporary folder and renamed when it's complete.
+
+    start = time.perf_counter()
+    source_mtime = os.path.getmtime(path)
+
+    build_path = snapshot_path + '.tmp'
+    shutil.rmtree(build_path, ignore_errors=True)
+    os.makedirs(build_path)
+
+    cache_dir = os.path.join(build_path, day_09.FIGURE_CACHE)
+
+    if source == 'gtd':
+        store_path = os.path.join(build_path, day_09.STORE_PATH)
+        day_09.load_data(path, store_path)
+
+        # (the payloads of every window, metric and level: a request reads them and never writes into the snapshot)
+
+        for window in day_09.windows:
+            for metric in day_09.metrics:
+                for level in day_09.level_names:
+                    day_09.load_payloads(path, store_path,
+                                         os.path.join(build_path, day_09.PAYLOAD_PATH),
+                                         window, metric, level)
+
+        store_path = os.path.join(build_path, day_11.STORE_PATH)
+        day_11.load_data(path, store_path)
+        day_11.figure_json(path=path,
+                           store_path=store_path,
+                           cache_dir=cache_dir)
+
+        # (the week and day cells, and the attacks of the drill-down, are read from the raw file too: they can't be built
+        # from the snapshot later)
+
+        for resolution in ('week', 'day'):
+            day_11.load_cells(path, store_path, resolution)
+        events.load_events(path, os.path.join(build_path, events.EVENT_PATH))
+    else:
+        for location in locations:
+            for hover in ('embedded', 'lazy'):
+                day_08.figure_json(path, cache_dir, location, hover)
+
+    os.replace(build_path, snapshot_path)
+
+    return dict(path=snapshot_path,
+                version=os.path.basename(snapshot_path),
+                source_mtime=source_mtime,
+                build_seconds=time.perf_counter() - start,
+                locations=list(locations) if source == 'wpp' else None,
+                format=SNAPSHOT_FORMAT)
+
+
+def pointer_path(snapshot_dir, source):
+    return os.path.join(snapshot_dir, source + '.json')
+
+
+def read_pointer(snapshot_dir, source):
+    try:
+        with open(pointer_path(snapshot_dir, source)) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    return snapshot if os.path.isdir(snapshot['path']) else None
+
+
+def write_pointer(snapshot_dir, source, snapshot):
+    path = pointer_path(snapshot_dir, source)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def next_snapshot_path(snapshot_dir, source):
+    versions = [
+        int(name.split('-')[1]) for name in os.listdir(snapshot_dir)
+        if name.startswith(source + '-') and not name.endswith('.tmp')
+    ]
+    return os.path.join(snapshot_dir,
+                        '{}-{:06d}'.format(source,
+                                           max(versions, default=0) + 1))
+
+
+def remove_old_snapshots(snapshot_dir, source, keep=KEEP_SNAPSHOTS):
+    names = sorted(name for name in os.listdir(snapshot_dir)
+                   if name.startswith(source + '-') and not name.endswith('.tmp'))
+    for name in names[:-keep]:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+# Service **********************************************************************************************************************
+
+
+def new_service(sources=sources,
+                locations=locations,
+                snapshot_dir=SNAPSHOT_DIR,
+                poll_interval=POLL_INTERVAL,
+                workers=2):
+    return dict(sources=dict(sources),
+                locations=list(locations),
+                snapshot_dir=snapshot_dir,
+                poll_interval=poll_interval,
+                workers=workers,
+                pool=None,
+                watcher=None,
+                snapshots=dict(),
+                refreshing=dict(),
+                metrics={
+                    source: dict(version=None,
+                                 refreshes=0,
+                                 last_refresh_seconds=None,
+                                 last_build_seconds=None,
+                                 last_swap_ms=None,
+                                 last_error=None)
+                    for source in sources
+                })
+
+
+async def refresh(service, source):
+    if service['refreshing'].get(source):
+        return  # (one rebuild per source at a time)
+    service['refreshing'][source] = True
+
+    source_metrics = service['metrics'][source]
+    start = time.perf_counter()
+
+    try:
+        snapshot = await asyncio.get_running_loop().run_in_executor(
+            service['pool'], build_snapshot, source,
+            service['sources'][source],
+            next_snapshot_path(service['snapshot_dir'], source),
+            service['locations'])
+
+        # The swap: the pointer file for the other processes, the reference for this one.
+
+        swap_start = time.perf_counter()
+        write_pointer(service['snapshot_dir'], source, snapshot)
+        service['snapshots'][source] = snapshot
+        swap_ms = (time.perf_counter() - swap_start) * 1000
+
+        remove_old_snapshots(service['snapshot_dir'], source)
+
+        source_metrics.update(version=snapshot['version'],
+                              refreshes=source_metrics['refreshes'] + 1,
+                              last_refresh_seconds=time.perf_counter() - start,
+                              last_build_seconds=snapshot['build_seconds'],
+                              last_swap_ms=swap_ms,
+                              last_error=None)
+    except Exception as error:  # the previous snapshot stays in use
+        source_metrics['last_error'] = '{}: {}'.format(
+            type(error).__name__, error)
+    finally:
+        service['refreshing'][source] = False
+
+
+def source_state(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+async def watch(service):
+    previous = dict()
+
+    while True:
+        for source, path in service['sources'].items():
+            state = source_state(path)
+            snapshot = service['snapshots'].get(source)
+
+            # A changed file is rebuilt only when it looks the same as at the previous poll:
+
+            if state is not None and state == previous.get(source) and (
+                    snapshot is None or state[0] != snapshot['source_mtime']):
+                asyncio.ensure_future(refresh(service, source))
+
+            previous[source] = state
+
+        await asyncio.sleep(service['poll_interval'])
+
+
+async def start(service):
+    os.makedirs(service['snapshot_dir'], exist_ok=True)
+    service['pool'] = concurrent.futures.ProcessPoolExecutor(
+        max_workers=service['workers'])
+
+    missing = []
+    for source in service['sources']:
+        snapshot = read_pointer(service['snapshot_dir'], source)
+        if snapshot is None or snapshot.get('format') != SNAPSHOT_FORMAT or (
+                source == 'wpp' and not set(service['locations']) <= set(snapshot['locations'])):
+            missing.append(source)
+        else:
+            service['snapshots'][source] = snapshot
+            service['metrics'][source]['version'] = snapshot['version']
+
+    await asyncio.gather(*[refresh(service, source) for source in missing])
+
+    service['watcher'] = asyncio.ensure_future(watch(service))
+
+
+async def stop(service):
+    if service['watcher'] is not None:
+        service['watcher'].cancel()
+    if service['pool'] is not None:
+        service['pool'].shutdown()
+
+
+# Requests *********************************************************************************************************************
+
+
+def current_snapshot(service, source):
+
+    # In another worker process (no service running there), the pointer file is read instead:
+
+    if source in service['snapshots']:
+        return service['snapshots'][source]
+    return read_pointer(service['snapshot_dir'], source)
+
+
+def snapshot_dir(service, source):
+    snapshot = current_snapshot(service, source)
+    if snapshot is None:  # (its first build failed: see metrics())
+        raise ValueError('no {} snapshot'.format(source))
+    return snapshot['path']
+
+
+# The charts, their hover labels and the attacks of a clicked point, all from the current snapshots (and never from the raw
+# files: path=None). What a snapshot doesn't have can't be built from it (a ValueError): a Day 8 location other than the
+# service's locations, a Day 9 window other than day_09.windows, the dense Day 11 cells.
+
+
+def figure_json(service, chart, **kwargs):
+    if chart == 'day_08':
+        snapshot = current_snapshot(service, 'wpp')
+        if kwargs.get('location', 'World') not in (snapshot or {}).get('locations', service['locations']):
+            raise ValueError('{} is not in the wpp snapshot'.format(kwargs['location']))
+
+        return day_08.figure_json(None,
+                                  os.path.join(snapshot_dir(service, 'wpp'),
+                                               day_08.FIGURE_CACHE), **kwargs)
+
+    gtd_dir = snapshot_dir(service, 'gtd')
+
+    if chart == 'day_09':
+        return day_09.pair_json(path=None,
+                                store_path=os.path.join(gtd_dir, day_09.STORE_PATH),
+                                payload_path=os.path.join(gtd_dir, day_09.PAYLOAD_PATH),
+                                **kwargs)
+
+    return day_11.figure_json(path=None,
+                              store_path=os.path.join(gtd_dir, day_11.STORE_PATH),
+                              cache_dir=os.path.join(gtd_dir, day_11.FIGURE_CACHE),
+                              **kwargs)
+
+
+def hover_text(service, chart, key, **kwargs):
+    if chart == 'day_08':
+        return day_08.hover_text(key,
+                                 path=None,
+                                 cache_dir=os.path.join(snapshot_dir(service, 'wpp'), day_08.FIGURE_CACHE),
+                                 **kwargs)
+
+    gtd_dir = snapshot_dir(service, 'gtd')
+
+    if chart == 'day_09':
+        return day_09.hover_text(key,
+                                 path=None,
+                                 store_path=os.path.join(gtd_dir, day_09.STORE_PATH),
+                                 payload_path=os.path.join(gtd_dir, day_09.PAYLOAD_PATH),
+                                 **kwargs)
+
+    return day_11.hover_text(key, path=None, store_path=os.path.join(gtd_dir, day_11.STORE_PATH), **kwargs)
+
+
+def event_cell(service, chart, key, **kwargs):
+    gtd_dir = snapshot_dir(service, 'gtd')
+
+    if chart == 'day_09':
+        return day_09.event_cell(key,
+                                 path=None,
+                                 store_path=os.path.join(gtd_dir, day_09.STORE_PATH),
+                                 payload_path=os.path.join(gtd_dir, day_09.PAYLOAD_PATH),
+                                 **kwargs)
+
+    return day_11.event_cell(key, path=None, store_path=os.path.join(gtd_dir, day_11.STORE_PATH), **kwargs)
+
+
+def drill_down(service, *args, **kwargs):
+    return events.drill_down(*args,
+                             path=None,
+                             event_path=os.path.join(snapshot_dir(service, 'gtd'), events.EVENT_PATH),
+                             **kwargs)
+
+
+def biggest_movers(service, *args, **kwargs):
+    return day_09.biggest_movers(*args,
+                                 path=None,
+                                 store_path=os.path.join(snapshot_dir(service, 'gtd'), day_09.STORE_PATH),
+                                 **kwargs)
+
+
+def metrics(service):
+    return {
+        source: dict(source_metrics,
+                     refreshing=bool(service['refreshing'].get(source)))
+        for source, source_metrics in service['metrics'].items()
+    }
+
+
+async def main():
+    service = new_service()
+    await start(service)
+    try:
+        while True:
+            print(json.dumps(metrics(service)))
+            await asyncio.sleep(60)
+    finally:
+        await stop(service)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,601 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import re
+import json
+import time
+import asyncio
+import threading
+import collections
+import concurrent.futures
+import http.server
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+from query import events
+
+from dashboard import refresh
+
+# plotly is needed here only for the html pages (plotly.io.to_html), not for the figures or the hover labels.
+
+# CHART SERVER *****************************************************************************************************************
+
+# The three charts behind a small local http server (the standard library's threaded one, no framework), with their hover
+# labels served on demand: a figure asked with hover=lazy carries an integer key per hovered point instead of its hover data
+# (see "Lazy hover" in each day's code), and the page fetches the label of a key when the point is hovered. The labels are
+# made from the stores and tables the figures are built from, and cached by key (an LRU in each day's code).
+#
+#     GET /figure/day_09?country_1=France&country_2=Iraq&hover=lazy    the figure's json
+#     GET /hover/day_09?key=1234&window=3                              the hover label of a key: {"text": ...}
+#     GET /page/day_11?country_txt=Iraq&resolution=week                an html page with the lazy-hover figure
+#     GET /events/day_11?country_txt=Iraq&key=1234&page=0              the attacks of a clicked point, a page of them
+#     GET /events?country=Iraq&year=2014&month=6&day=10&page=2         the same, by country and date (see query/events.py)
+#     GET /movers/day_09?year_a=2010&year_b=2015&k=10&direction=risers  the countries that rose (or fell) the most (top k)
+#     GET /metrics                                                     requests, cache hits and misses, memory, pre-warming
+#
+# Run it from the folder with the data files (the requests are logged to stderr, or appended to the access log file if one is
+# given, in the standard library's format, and so are the server's address and the pre-warming summary). The requests are
+# served from the snapshots of the refresh service (see refresh.py), started here: the stores are built there, in the
+# background, and a request never reads the raw files (snapshot_dir=none: from the data files, as the charts' own code does,
+# for working on a chart). The most requested figures of a log or a list are built at startup, in the background (see
+# "Pre-warming"):
+#
+#     python path/to/dashboard/server.py [port] [access_log] [prewarm_from] [snapshot_dir|none]
+
+PORT = 8050
+ACCESS_LOG = os.environ.get('VIZZES_ACCESS_LOG')
+PREWARM_FROM = os.environ.get('VIZZES_PREWARM')  # an access log or a priority list (by default, the access log)
+PREWARM_TOP = int(os.environ.get('VIZZES_PREWARM_TOP', 50))  # the number of figures built
+PREWARM_WORKERS = 4
+SNAPSHOT_DIR = os.environ.get('VIZZES_SNAPSHOTS', refresh.SNAPSHOT_DIR)
+
+service = None  # the refresh service the requests are served from (see start_refresh())
+
+
+def optional(value):
+    return None if value.lower() == 'none' else value
+
+
+def window(value):
+    return value if value == 'decade' else int(value)  # (a number of years, or 'decade': see "Time windows" in Day 9)
+
+
+# The query parameters of each chart, with their types (the others are ignored), and the ones its hover labels depend on:
+
+chart_params = {
+    'day_08': dict(location=str),
+    'day_09': dict(country_1=str,
+                   country_2=optional,
+                   window=window,
+                   metric=str,
+                   background=str),
+    'day_11': dict(country_txt=str,
+                   n=int,
+                   active_after=int,
+                   metric=str,
+                   resolution=str)
+}
+
+hover_params = {
+    'day_08': ['location'],
+    'day_09': ['country_1', 'window', 'metric'],
+    'day_11': ['country_txt', 'metric', 'resolution']
+}
+
+# (and those of a list of attacks asked by country and date)
+
+event_params = dict(country=str, year=int, month=int, day=int, last_year=int, page=int)
+
+# (and those of the Day 9 biggest movers)
+
+mover_params = dict(year_a=int, year_b=int, k=int, direction=str, window=window, metric=str, level=str)
+
+# Charts ***********************************************************************************************************************
+
+
+def figure_json(chart, hover='embedded', **kwargs):
+    if service is not None:
+        return refresh.figure_json(service, chart, hover=hover, **kwargs)
+
+    if chart == 'day_08':
+        return day_08.figure_json(hover=hover, **kwargs)
+    if chart == 'day_09':
+        return day_09.pair_json(hover=hover, **kwargs)
+    return day_11.figure_json(hover=hover, **kwargs)
+
+
+def hover_text(chart, key, **kwargs):
+    if key < 0:
+        raise ValueError('negative key')
+
+    kwargs = {name: kwargs[name] for name in hover_params[chart] if name in kwargs}
+    if service is not None:
+        return refresh.hover_text(service, chart, key, **kwargs)
+
+    module = {'day_08': day_08, 'day_09': day_09, 'day_11': day_11}[chart]
+    return module.hover_text(key, **kwargs)
+
+
+def event_cell(chart, key, **kwargs):
+    if service is not None:
+        return refresh.event_cell(service, chart, key, **kwargs)
+    return {'day_09': day_09, 'day_11': day_11}[chart].event_cell(key, **kwargs)
+
+
+def drill_down(*args, **kwargs):
+    if service is not None:
+        return refresh.drill_down(service, *args, **kwargs)
+    return events.drill_down(*args, **kwargs)
+
+
+def events_json(chart, query):
+    params = urllib.parse.parse_qs(query)
+    page = int(params.get('page', ['0'])[-1])
+
+    if chart is None:
+        kwargs = {
+            name: convert(params[name][-1])
+            for name, convert in event_params.items() if name in params
+        }
+        return json.dumps(drill_down(**kwargs))
+
+    key = int(params['key'][-1])
+    if key < 0:
+        raise ValueError('negative key')
+
+    kwargs = parse_query(chart, query)
+    if chart == 'day_09':
+        country, first_year, last_year = event_cell(
+            chart, key, **{name: kwargs[name] for name in ('country_1', 'window', 'metric') if name in kwargs})
+        return json.dumps(drill_down(country, first_year, last_year=last_year, page=page))
+
+    country, year, month = event_cell(
+        chart, key, **{name: kwargs[name] for name in ('country_txt', 'resolution') if name in kwargs})
+    return json.dumps(drill_down(country, year, month, page=page))
+
+
+def movers_json(query):
+    params = urllib.parse.parse_qs(query)
+    kwargs = {
+        name: convert(params[name][-1])
+        for name, convert in mover_params.items() if name in params
+    }
+    if service is not None:
+        return json.dumps(refresh.biggest_movers(service, **kwargs))
+    return json.dumps(day_09.biggest_movers(**kwargs))
+
+
+# The page's side of the lazy hover: on a hover event, the label of the point's key is fetched (once, then it's kept in the
+# page) and shown in a box next to the pointer, styled as the charts' own hover labels.
+
+hover_js = """
+(function () {
+    var gd = document.getElementById('{plot_id}');
+    var url = HOVER_URL;
+    var labels = {};
+    var current = null;
+
+    var box = document.createElement('div');
+    box.style.cssText = 'position: fixed; display: none; pointer-events: none; z-index: 10; padding: 4px 8px; ' +
+        'background: #010101; color: #d9d9d9; border: 1px solid #777777; font: 13px "Bodoni MT Condensed", serif; ' +
+        'white-space: nowrap';
+    document.body.appendChild(box);
+
+    function show(key, event) {
+        if (current !== key) return;
+        box.innerHTML = labels[key];
+        box.style.display = 'block';
+        if (event) {
+            box.style.left = (event.clientX + 12) + 'px';
+            box.style.top = (event.clientY + 12) + 'px';
+        }
+    }
+
+    gd.on('plotly_hover', function (e) {
+        var point = e.points[0];
+        if (point.customdata === undefined) return;
+
+        var key = point.customdata;
+        current = key;
+
+        if (key in labels) {
+            show(key, e.event);
+        } else {
+            fetch(url + '&key=' + key).then(function (response) { return response.json(); }).then(function (body) {
+                labels[key] = body.text;
+                show(key, e.event);
+            });
+        }
+    });
+
+    gd.on('plotly_unhover', function () {
+        current = null;
+        box.style.display = 'none';
+    });
+})();
+"""
+
+# On Day 9 and Day 11, a click on a point lists its attacks, a page at a time, in a panel at the bottom right of the page.
+
+events_js = """
+(function () {
+    var gd = document.getElementById('{plot_id}');
+    var url = EVENTS_URL;
+
+    var panel = document.createElement('div');
+    panel.style.cssText = 'position: fixed; display: none; right: 12px; bottom: 12px; z-index: 10; max-height: 60%; ' +
+        'overflow: auto; padding: 6px 10px; background: #010101; color: #d9d9d9; border: 1px solid #777777; ' +
+        'font: 12px "Bodoni MT Condensed", serif';
+    document.body.appendChild(panel);
+
+    function cell(value) {
+        return '<td style="padding: 0 6px">' + (value === null ? '' : value) + '</td>';
+    }
+
+    function load(key, page) {
+        fetch(url + '&key=' + key + '&page=' + page).then(function (response) {
+            return response.json();
+        }).then(function (body) {
+            var html = '<div>' + body.country + ', ' + body.years.join('-') + (body.month ? '/' + body.month : '') + ': ' +
+                body.total + ' attacks' + (body.pages > 1 ? ', page ' + (page + 1) + ' of ' + body.pages : '') +
+                ' <a href="#" data-page="' + (page - 1) + '"' + (page > 0 ? '' : ' hidden') + '>&lt;</a>' +
+                ' <a href="#" data-page="' + (page + 1) + '"' + (page + 1 < body.pages ? '' : ' hidden') + '>&gt;</a>' +
+                ' <a href="#" data-page="close">x</a></div><table><tr>' + body.columns.map(cell).join('') + '</tr>' +
+                body.rows.map(function (row) { return '<tr>' + row.map(cell).join('') + '</tr>'; }).join('') + '</table>';
+
+            panel.innerHTML = html;
+            panel.style.display = 'block';
+            panel.querySelectorAll('a').forEach(function (link) {
+                link.onclick = function (event) {
+                    event.preventDefault();
+                    if (link.dataset.page === 'close') {
+                        panel.style.display = 'none';
+                    } else {
+                        load(key, parseInt(link.dataset.page));
+                    }
+                };
+            });
+        });
+    }
+
+    gd.on('plotly_click', function (e) {
+        var point = e.points[0];
+        if (point.customdata !== undefined) load(point.customdata, 0);
+    });
+})();
+"""
+
+
+def page_html(chart, query, **kwargs):
+    import plotly.io as pio
+
+    fig = json.loads(figure_json(chart, 'lazy', **kwargs))
+    hover_url = '/hover/{}?{}'.format(chart, query)
+
+    post_script = [hover_js.replace('HOVER_URL', json.dumps(hover_url))]
+    if chart in ('day_09', 'day_11'):
+        events_url = '/events/{}?{}'.format(chart, query)
+        post_script.append(events_js.replace('EVENTS_URL', json.dumps(events_url)))
+
+    return pio.to_html(fig,
+                       include_plotlyjs='cdn',
+                       post_script=post_script,
+                       validate=False)
+
+
+# Metrics **********************************************************************************************************************
+
+# What a load test (benchmarks/load_test.py) needs to see from the server's side: the requests served per route and chart,
+# the hits and misses of the caches on the serving path (the LRUs of each day's code, and the figure json files of Day 8 and
+# Day 11) and the process's resident memory. The counts only ever grow; a client takes the difference between two reads.
+
+request_counts = collections.Counter()
+
+
+def cache_stats():
+    caches = {
+        'day_08.hover_table': day_08.read_hover_table,
+        'day_08.hover_labels': day_08.table_label,
+        'day_09.payloads': day_09.read_payloads,
+        'day_09.hover_labels': day_09.payload_label,
+        'day_09.country_labels': day_09.country_label,
+        'day_11.cells': day_11.read_cells,
+        'day_11.geometry': day_11.polar_geometry,
+        'day_11.hover_labels': day_11.cell_label
+    }
+
+    stats = dict()
+    for name, cache in caches.items():
+        info = cache.cache_info()
+        stats[name] = dict(hits=info.hits, misses=info.misses, size=info.currsize)
+    stats['day_08.figure_cache'] = dict(day_08.figure_cache_stats)
+    stats['day_11.figure_cache'] = dict(day_11.figure_cache_stats)
+
+    return stats
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):  # (not Linux: the peak instead, in KB on Linux and in bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def metrics():
+    requests = {
+        '{} {}'.format(*key): count
+        for key, count in sorted(request_counts.items())
+    }
+    return dict(requests=requests,
+                caches=cache_stats(),
+                rss_mb=rss_mb(),
+                prewarm=dict(prewarm_status),
+                refresh=None if service is None else refresh.metrics(service))
+
+
+# Pre-warming ******************************************************************************************************************
+
+# A new process serves its first requests at the full cost of the pipelines (the stores, the payloads, the figures). So at
+# startup, the figures asked most often are built in a thread pool, in the order of their counts, while the server already
+# takes requests. Threads, not processes: the LRUs of each day's code are warmed as well as the files (a request that comes
+# before its figure is warm builds it itself, and the last of the two writes wins).
+#
+# The counts come from a file of requests: an access log of this server, or a priority list, one request path per line (the
+# order of the list is the order of the warming):
+#
+#     /figure/day_11?country_txt=France
+#     /figure/day_09?country_1=United States&country_2=Afghanistan&hover=lazy
+#
+# A page counts as its lazy-hover figure; the hover labels aren't warmed (there are too many keys, and one costs little). The
+# default figure of each chart is warmed after the counted ones. The first figure of each chart is built before the others
+# (the three at once), so that the pool doesn't build the same stores several times at once. The status is in /metrics:
+# coverage is the share of the figures that are warm, traffic the share of the counted requests they were.
+
+default_priorities = [
+    '/figure/day_11?country_txt=France',
+    '/figure/day_09?country_1=United States&country_2=Afghanistan',
+    '/figure/day_08?location=World'
+]
+
+prewarm_status = dict(total=0, done=0, failed=0, coverage=None, traffic=None, seconds=None)
+prewarm_lock = threading.Lock()
+
+
+def request_path(line):
+    if line.startswith('/'):
+        return line.strip()
+    found = re.search(r'"GET (\S+) HTTP', line)
+    return found.group(1) if found else None
+
+
+def count_figures(lines, top=PREWARM_TOP):
+    counts = collections.Counter()  # (equal counts stay in the order first seen)
+
+    for line in lines:
+        url = urllib.parse.urlsplit((request_path(line) or '').replace(' ', '+'))
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] not in ('figure', 'page') or parts[1] not in chart_params:
+            continue
+
+        hover = 'lazy' if parts[0] == 'page' else urllib.parse.parse_qs(url.query).get('hover', ['embedded'])[-1]
+        try:
+            kwargs = parse_query(parts[1], url.query)
+        except ValueError:
+            continue
+
+        counts[parts[1], hover, tuple(sorted(kwargs.items()))] += 1
+
+    return counts.most_common(top)
+
+
+def warm_one(figure, count, start, counts):
+    chart, hover, kwargs = figure
+    try:
+        figure_json(chart, hover, **dict(kwargs))
+        failed = False
+    except (KeyError, ValueError, IndexError, OSError):  # (a country no longer in the data...)
+        failed = True
+
+    with prewarm_lock:
+        prewarm_status['failed' if failed else 'done'] += 1
+        counts['warm'] += 0 if failed else count
+
+        prewarm_status['coverage'] = prewarm_status['done'] / prewarm_status['total']
+        prewarm_status['traffic'] = counts['warm'] / counts['all']
+        if prewarm_status['done'] + prewarm_status['failed'] == prewarm_status['total']:
+            prewarm_status['seconds'] = time.perf_counter() - start
+
+
+def prewarm(source=None, top=PREWARM_TOP, workers=PREWARM_WORKERS):
+    start = time.perf_counter()
+
+    counted = []
+    if source is not None and os.path.exists(source):
+        with open(source) as f:
+            counted = count_figures(f, top)
+
+    # (the charts' defaults, the first figures of a page, come last, and count only when there's nothing else)
+
+    figures = counted + [(figure, 0 if counted else 1)
+                         for figure, _ in count_figures(default_priorities)
+                         if figure not in dict(counted)]
+
+    prewarm_status.update(total=len(figures), done=0, failed=0, coverage=0.0, traffic=0.0, seconds=None)
+    counts = dict(warm=0, all=sum(count for _, count in figures))
+
+    charts = set()
+    firsts, rest = [], []
+    for figure in figures:
+        (rest if figure[0][0] in charts else firsts).append(figure)
+        charts.add(figure[0][0])
+
+    def run():
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for batch in (firsts, rest):
+                list(pool.map(lambda figure: warm_one(*figure, start, counts), batch))
+
+        log_line('pre-warmed {done} of {total} figures ({traffic:.0%} of the requests counted) in {seconds:.1f} s, '
+                 '{failed} failed'.format(**prewarm_status))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+# Server ***********************************************************************************************************************
+
+
+def parse_query(chart, query):
+    params = urllib.parse.parse_qs(query)
+    return {
+        name: convert(params[name][-1])
+        for name, convert in chart_params[chart].items() if name in params
+    }
+
+
+def respond(chart, route, query):
+    kwargs = parse_query(chart, query)
+    params = urllib.parse.parse_qs(query)
+
+    if route == 'figure':
+        return 'application/json', figure_json(
+            chart, params.get('hover', ['embedded'])[-1], **kwargs)
+    if route == 'hover':
+        return 'application/json', json.dumps(
+            dict(text=hover_text(chart, int(params['key'][-1]), **kwargs)))
+    return 'text/html', page_html(chart, query, **kwargs)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    access_log = None  # (an open file, see main())
+    log_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.access_log is None:
+            return super().log_message(format, *args)
+
+        with self.log_lock:
+            self.access_log.write('{} - - [{}] {}\n'.format(
+                self.address_string(), self.log_date_time_string(),
+                format % args))
+            self.access_log.flush()
+
+    def send_body(self, content_type, body):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+
+        if parts == ['metrics']:
+            return self.send_body('application/json', json.dumps(metrics()))
+
+        if (parts[0] == 'events' and (len(parts) == 1 or parts[1] in ('day_09', 'day_11'))) or parts == ['movers', 'day_09']:
+            try:
+                if parts[0] == 'movers':
+                    body = movers_json(url.query)
+                else:
+                    body = events_json(parts[1] if len(parts) == 2 else None, url.query)
+            except (KeyError, ValueError, IndexError, TypeError) as error:  # (TypeError: no country or year)
+                return self.send_error(400, '{}: {}'.format(type(error).__name__, error))
+
+            request_counts[parts[0], parts[-1]] += 1
+            return self.send_body('application/json', body)
+
+        if len(parts) != 2 or parts[0] not in ('figure', 'hover',
+                                               'page') or parts[1] not in chart_params:
+            return self.send_error(404)
+
+        try:
+            content_type, body = respond(parts[1], parts[0], url.query)
+        except (KeyError, ValueError, IndexError) as error:  # (an unknown country, a bad key...)
+            return self.send_error(400, '{}: {}'.format(type(error).__name__, error))
+
+        request_counts[parts[0], parts[1]] += 1
+        self.send_body(content_type, body)
+
+
+# The server's own lines (pre-warming, the address) go where the requests are logged: the access log, or stderr. (Not in the
+# format of the requests, so count_figures() skips them when the log is read back for pre-warming.)
+
+
+def log_line(text):
+    with Handler.log_lock:
+        out = sys.stderr if Handler.access_log is None else Handler.access_log
+        out.write(text + '\n')
+        out.flush()
+
+
+def make_server(port=PORT, access_log=ACCESS_LOG):
+    Handler.access_log = None if access_log is None else open(access_log, 'a')
+    return http.server.ThreadingHTTPServer(('127.0.0.1', int(port)), Handler)
+
+
+# The refresh service runs in an event loop of its own thread. It's ready once the current snapshots are loaded, or built
+# when there are none yet (the first start takes the time of a refresh):
+
+
+def start_refresh(snapshot_dir=SNAPSHOT_DIR, locations=refresh.locations):
+    global service
+
+    if snapshot_dir is None or snapshot_dir.lower() == 'none':
+        service = None
+        return None
+
+    new_service = refresh.new_service(locations=locations, snapshot_dir=snapshot_dir)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(refresh.start(new_service))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+    service = new_service
+    return service
+
+
+# The server in a thread of the calling process (port=0 for any free port), for the load test; server.shutdown() stops it:
+
+
+def start_server(port=0, access_log=None, snapshot_dir=SNAPSHOT_DIR, locations=refresh.locations):
+    start_refresh(snapshot_dir, locations)
+    server = make_server(port, access_log)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(port=PORT, access_log=ACCESS_LOG, prewarm_from=PREWARM_FROM, snapshot_dir=SNAPSHOT_DIR):
+    start_refresh(snapshot_dir)
+    server = make_server(port, access_log)  # (listening from here: the requests wait for serve_forever(), not for the warming)
+    prewarm(prewarm_from or access_log)
+    log_line('serving http://127.0.0.1:{}/page/day_09'.format(server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,75 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+
+# plotly is needed here for plotly.io.to_html (the page around the figure), not for building the figure.
+
+# HTML EXPORT ******************************************************************************************************************
+
+# Day 8 as a standalone html page, with its frames built in the browser (see "Compact frames" in day_08_chart_code.py): the
+# page carries the figure without the 72 frames, plus one year x age group matrix and the frame template, instead of the
+# frames' full json. plotly.js comes from the CDN by default ('cdn'), or is inlined with include_plotlyjs=True (+3.5 MB, but
+# the page then works offline). Run it from the folder with the WPP file:
+#
+#     python path/to/export/html_export.py [out_dir] [cdn|inline] [location ...]
+
+
+def page_html(dff, dffl, include_plotlyjs='cdn'):
+    import plotly.io as pio
+
+    return pio.to_html(day_08.figure_dict(dff, dffl, with_frames=False),
+                       include_plotlyjs=include_plotlyjs,
+                       post_script=day_08.frames_script(
+                           day_08.compact_frames(dff, dffl)),
+                       validate=False)
+
+
+def compact_html(location='World', path=day_08.WPP_PATH, include_plotlyjs='cdn'):
+    return page_html(*day_08.prepare_data(path, location), include_plotlyjs)
+
+
+def export_pages(locations=('World', ),
+                 out_dir='html',
+                 include_plotlyjs='cdn',
+                 path=day_08.WPP_PATH):
+    os.makedirs(out_dir, exist_ok=True)
+
+    pages = []
+    for location in locations:
+        start = time.perf_counter()
+        dff, dffl = day_08.prepare_data(path, location)
+        html = page_html(dff, dffl, include_plotlyjs)
+
+        out_path = os.path.join(out_dir, 'day_08_{}.html'.format(location))
+        with open(out_path, 'w') as f:
+            f.write(html)
+        elapsed = time.perf_counter() - start
+
+        # (the figure's json with all its frames, for comparison: from the same frames)
+
+        full_size = len(day_08.dumps(day_08.figure_dict(dff, dffl)))
+
+        pages.append(dict(path=out_path, size=len(html.encode()), full_size=full_size, seconds=elapsed))
+
+    return pages
+
+
+def main(out_dir='html', plotlyjs='cdn', *locations):
+    pages = export_pages(locations or ('World', ), out_dir,
+                         'cdn' if plotlyjs == 'cdn' else True)
+
+    for page in pages:
+        print('{}: {:.0f} KB page ({:.0f} KB of figure json with the frames) '
+              'in {:.1f} s'.format(page['path'], page['size'] / 1024,
+                                   page['full_size'] / 1024, page['seconds']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,130 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+# kaleido (>= 1.0) is needed for the export only, so it's imported in render(). It drives a local Chrome; if there's
+# none yet, run kaleido_get_chrome (or plotly_get_chrome) once, and after that everything runs offline. The calls were checked
+# against the sources of kaleido 1.0 and 1.5, and kaleido 1.5 takes them (Kaleido(n=..., mathjax=False), the async specs),
+# but no image was rendered: the Chrome where this was written couldn't start (missing system libraries).
+
+# STATIC EXPORT ****************************************************************************************************************
+
+# The png files in the Day folders were exported by hand, one at a time. Here all the variants (Day 8, Day 9 for every ranked
+# country, Day 11 for every top country) are rendered by one long-lived kaleido browser with `workers` tabs: the figure json
+# is fed to the tabs as they free up, and each tab writes its image while the others keep rendering. Starting the browser is
+# paid once per run instead of once per image. The figures are built with the fast paths (cached json, the Day 9 payloads,
+# the Day 11 plain-dict builder), one at a time in a worker thread (see render()), so building overlaps rendering. Each chart
+# is rendered at the size of its hand-exported image. Run it from the folder with the data files:
+#
+#     python path/to/export/static_export.py [format] [workers] [out_dir]
+
+EXPORT_SIZES = dict(day_08=(1142, 821), day_09=(1117, 821), day_11=(1142, 820))  # (width, height) of the hand-exported images
+
+# Figure jobs ******************************************************************************************************************
+
+
+def figure_jobs():
+    yield 'day_08', 'day_08_World', day_08.figure_json()
+
+    yield 'day_09', 'day_09_United States_Afghanistan', day_09.pair_json()
+    for country in day_09.load_payloads()['countries'].tolist():
+        yield 'day_09', 'day_09_{}'.format(country), day_09.pair_json(country, None)
+
+    for country in day_11.top_country_names():
+        yield 'day_11', 'day_11_{}'.format(country), day_11.dumps(
+            day_11.figure_dict(day_11.chart_data(country)))
+
+
+def kaleido_specs(jobs, image_format, out_dir, scale=1):
+    for chart, name, fig_json in jobs:
+        width, height = EXPORT_SIZES[chart]
+        yield dict(fig=json.loads(fig_json),
+                   path=os.path.join(out_dir,
+                                     '{}.{}'.format(name, image_format)),
+                   opts=dict(format=image_format,
+                             width=width,
+                             height=height,
+                             scale=scale))
+
+
+# Export ***********************************************************************************************************************
+
+# kaleido takes the specs from an iterable as fast as it yields them (a render task for each, waiting for a free tab), and
+# from a plain generator it would build them in the event loop, which then can't pass the rendered images on meanwhile. So
+# the specs are handed over as an async iterable that builds each one in a worker thread: the loop keeps serving the tabs.
+
+
+async def threaded(specs):
+    specs, end = iter(specs), object()
+    while True:
+        spec = await asyncio.to_thread(next, specs, end)
+        if spec is end:
+            return
+        yield spec
+
+
+async def render(specs, workers, error_log):
+    import kaleido
+
+    # plotly.js comes from plotly's own package data (kaleido's default when plotly is installed), and mathjax isn't loaded at
+    # all (no LaTeX in the charts), so no page is fetched from a CDN.
+
+    # (kaleido 1.0 fills an error_log list with the failed renders; later versions have no error_log and return them)
+
+    async with kaleido.Kaleido(n=workers, mathjax=False) as k:
+        if 'error_log' in inspect.signature(k.write_fig_from_object).parameters:
+            await k.write_fig_from_object(threaded(specs), error_log=error_log)
+        else:
+            error_log.extend(await k.write_fig_from_object(threaded(specs)))
+
+
+def export_images(image_format='png', workers=4, out_dir='images'):
+    os.makedirs(out_dir, exist_ok=True)
+
+    count = 0
+
+    def counted(specs):
+        nonlocal count
+        for spec in specs:
+            count += 1
+            yield spec
+
+    error_log = []
+
+    start = time.perf_counter()
+    specs = counted(kaleido_specs(figure_jobs(), image_format, out_dir))
+    asyncio.run(render(specs, workers, error_log))
+    elapsed = time.perf_counter() - start
+
+    return count, elapsed, error_log
+
+
+def main(image_format='png', workers='4', out_dir='images'):
+    count, elapsed, error_log = export_images(image_format, int(workers),
+                                              out_dir)
+
+    # (the rate is that of the images written: a failed render is one error, and no image)
+
+    written = count - len(error_log)
+    print('{} {} images in {:.1f} s with {} renderers: {:.1f} images/s, {} failed'.format(
+        written, image_format, elapsed, workers, written / elapsed, len(error_log)))
+
+    for error in error_log:
+        print('    ' + str(error))
+
+    return 1 if error_log else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
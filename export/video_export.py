@@ -0,0 +1,210 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import time
+import copy
+import asyncio
+import hashlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Day_08_Humans import day_08_chart_code as day_08
+
+from static_export import EXPORT_SIZES, render
+
+# Rendering needs kaleido (>= 1.0) and a local Chrome, as in static_export.py; encoding needs the ffmpeg binary. (The ffmpeg
+# command lines were run with ffmpeg 7.0 on a short list of synthetic 1142 x 821 frames: a 1142 x 820 yuv420p mp4 and a gif,
+# with the durations of the concat list. The rendering wasn't run: no Chrome where this was written.)
+
+# VIDEO EXPORT *****************************************************************************************************************
+
+# Day 8 is an animation, and outside a browser it can only be shared as a video. Here each frame is applied to the base figure
+# (as plotly.js does when it animates: the frame's traces are merged into the figure's traces with the same index), with the
+# slider moved to the frame's year and the play buttons removed. The frame figures are rendered to png by the kaleido tabs
+# in parallel and encoded with ffmpeg into an mp4 or a gif, one per location, 250 ms per frame, as on the dashboard.
+#
+# The png frames are cached under their content hash: after a style tweak, only the frames whose figure has changed are
+# rendered again. Run it from the folder with the WPP file:
+#
+#     python path/to/export/video_export.py [mp4|gif] [workers] [out_dir] [location ...]
+
+FRAME_CACHE = 'frame_cache'
+FRAME_DURATION = 0.25  # s
+LAST_FRAME_DURATION = 2  # s, the last year stays on the screen a bit longer
+WIDTH, HEIGHT = EXPORT_SIZES['day_08']
+
+# Frames ***********************************************************************************************************************
+
+
+def merge(target, update):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def frame_figures(fig):
+    layout = copy.deepcopy(fig['layout'])
+    layout.pop('updatemenus', None)
+
+    for i, frame in enumerate(fig['frames']):
+        data = copy.deepcopy(fig['data'])
+        for trace, update in zip(frame['traces'], frame['data']):
+            merge(data[trace], update)
+
+        frame_layout = copy.deepcopy(layout)
+        frame_layout['sliders'][0]['active'] = i
+
+        yield dict(data=data, layout=frame_layout)
+
+
+def frame_path(frame_fig, cache_dir=FRAME_CACHE):
+    key = hashlib.sha1('{}x{}'.format(WIDTH, HEIGHT).encode())
+    key.update(json.dumps(frame_fig, sort_keys=True).encode())
+    return os.path.join(cache_dir, key.hexdigest() + '.png')
+
+
+def is_rendered(png_path):
+
+    # (kaleido creates the file before rendering into it, and removes it if the render fails, but an interrupted run leaves it
+    # empty: not a cached frame)
+
+    return os.path.exists(png_path) and os.path.getsize(png_path) > 0
+
+
+def location_figure(location, path=day_08.WPP_PATH):
+    dff, dffl = day_08.prepare_data(path, location)
+    return json.loads(day_08.dumps(day_08.figure_dict(dff, dffl)))
+
+
+# Encoding *********************************************************************************************************************
+
+
+def encode(frame_paths, out_path, video_format='mp4'):
+
+    # The frames go to ffmpeg through a concat list, with the duration of each one:
+
+    list_path = out_path + '.txt'
+    with open(list_path, 'w') as f:
+        for i, path in enumerate(frame_paths):
+            f.write("file '{}'\n".format(os.path.abspath(path)))
+            f.write('duration {}\n'.format(LAST_FRAME_DURATION if i == len(
+                frame_paths) - 1 else FRAME_DURATION))
+        f.write("file '{}'\n".format(os.path.abspath(
+            frame_paths[-1])))  # (the last duration is applied only if the file is repeated)
+
+    if video_format == 'gif':
+        video_filter = 'split[a][b];[a]palettegen[p];[b][p]paletteuse'
+        codec = []
+    else:
+        # (libx264 with yuv420p needs an even width and height, and the images are 1142 x 821: scaled to 1142 x 820)
+
+        video_filter = 'scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p'
+        codec = ['-c:v', 'libx264', '-movflags', '+faststart']
+
+    try:
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+            '-i', list_path, '-vf', video_filter
+        ] + codec + [out_path],
+                       check=True)
+    finally:
+        os.remove(list_path)
+
+
+# Export ***********************************************************************************************************************
+
+
+def export_videos(locations=('World', ),
+                  video_format='mp4',
+                  workers=4,
+                  out_dir='videos',
+                  cache_dir=FRAME_CACHE,
+                  path=day_08.WPP_PATH):
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # All the frames of all the locations are collected first, so that the missing ones are rendered in a single batch:
+
+    frame_paths = dict()
+    missing = dict()
+
+    for location in locations:
+        frame_paths[location] = []
+        for frame_fig in frame_figures(location_figure(location, path)):
+            png_path = frame_path(frame_fig, cache_dir)
+            frame_paths[location].append(png_path)
+            if not is_rendered(png_path):
+                missing[png_path] = frame_fig
+
+    n_frames = sum(len(paths) for paths in frame_paths.values())
+
+    error_log = []
+
+    start = time.perf_counter()
+
+    if missing:
+        specs = [
+            dict(fig=frame_fig,
+                 path=png_path,
+                 opts=dict(format='png', width=WIDTH, height=HEIGHT, scale=1))
+            for png_path, frame_fig in missing.items()
+        ]
+        asyncio.run(render(specs, workers, error_log))
+
+    rendered = time.perf_counter()
+
+    # A location with a frame that failed to render isn't encoded (ffmpeg would stop at the missing file), and a failed
+    # encoding doesn't stop the other locations: both go to the error log.
+
+    videos = 0
+    for location, paths in frame_paths.items():
+        not_rendered = [png_path for png_path in paths if not is_rendered(png_path)]
+        if not_rendered:
+            error_log.append('{}: {} of {} frames not rendered, not encoded'.format(
+                location, len(not_rendered), len(paths)))
+            continue
+
+        try:
+            encode(paths,
+                   os.path.join(out_dir,
+                                'day_08_{}.{}'.format(location, video_format)),
+                   video_format)
+            videos += 1
+        except (subprocess.CalledProcessError, OSError) as error:  # (OSError: no ffmpeg)
+            error_log.append('{}: {}'.format(location, error))
+
+    encoded = time.perf_counter()
+
+    return dict(frames=n_frames,
+                rendered=len(missing),
+                render_seconds=rendered - start,
+                videos=videos,
+                encode_seconds=encoded - rendered,
+                error_log=error_log)
+
+
+def main(video_format='mp4', workers='4', out_dir='videos', *locations):
+    report = export_videos(locations or ('World', ), video_format,
+                           int(workers), out_dir)
+
+    print('{} frames, {} rendered ({} cached) in {:.1f} s, {} videos encoded '
+          'in {:.1f} s'.format(report['frames'], report['rendered'],
+                               report['frames'] - report['rendered'],
+                               report['render_seconds'], report['videos'],
+                               report['encode_seconds']))
+
+    for error in report['error_log']:
+        print('    ' + str(error))
+
+    return 1 if report['error_log'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,374 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import csv
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Day_08_Humans import day_08_chart_code as day_08
+from Day_09_High_Low import day_09_chart_code as day_09
+from Day_11_Circular import day_11_chart_code as day_11
+
+# An engine is needed here, DuckDB or Polars (either one, imported lazily when the engine is opened). Neither is needed by the
+# charts themselves: this is an optional backend.
+
+# QUERY ENGINE *****************************************************************************************************************
+
+# Every variation of the charts (another attack type, a range of years...) used to mean copying a script and chaining more
+# pandas groupby/merge steps over the whole GTD csv. Here the raw files are converted once into Parquet (the columnar cache:
+# only the columns the charts and the usual filters need, written by the engine itself, next to nothing else), and registered
+# as the tables 'gtd' and 'wpp' of an in-process engine:
+#
+# - 'duckdb': the tables are views over the Parquet files, and the queries are SQL;
+# - 'polars': the tables are lazy frames (scan_parquet), and the queries are Polars expressions (or SQL, for the ad-hoc ones).
+#
+# Either way, only the columns a query uses are read and the filters are pushed down into the Parquet scan, and the work is
+# spread over all the cores. The Day 9 ranking and the Day 11 country/month/year counts are written as queries that return
+# the same frames as the charts' prepare_data(), so a variation is a store built from a query:
+#
+#     engine = open_engine('duckdb')
+#     day_09.write_store(*day_09_data(engine, where={'attacktype1_txt': 'Bombing/Explosion'}), 'day_09_ranks_bombings')
+#     query(engine, 'SELECT region_txt, count(*) AS attacks FROM gtd GROUP BY 1 ORDER BY 2 DESC')  # -> a pandas frame
+#
+# and the chart is built from that store (store_path='day_09_ranks_bombings', path=None). benchmarks/engine_benchmark.py checks
+# the queries against the pandas path and times them.
+
+COLUMNAR_DIR = 'columnar_cache'
+ENGINE = os.environ.get('VIZZES_ENGINE', 'duckdb')
+
+gtd_columns = [
+    'eventid', 'iyear', 'imonth', 'iday', 'country', 'country_txt', 'region_txt',
+    'provstate', 'attacktype1_txt', 'targtype1_txt', 'weaptype1_txt', 'gname',
+    'success', 'suicide', 'nkill', 'nwound'
+]  # (the ones the file has)
+
+wpp_columns = ['Location', 'Time', 'AgeGrp', 'DeathTotal']
+
+# The types of the columns the queries compute with (the others are inferred):
+
+column_types = {
+    'eventid': 'int',
+    'iyear': 'int',
+    'imonth': 'int',
+    'iday': 'int',
+    'country': 'int',
+    'nkill': 'float',
+    'nwound': 'float',
+    'Time': 'int',
+    'DeathTotal': 'float'
+}
+
+# Columnar cache ***************************************************************************************************************
+
+
+def csv_header(path):
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
+
+
+def sql_string(value):
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def columnar_cache(engine, path, columns, columnar_dir=COLUMNAR_DIR):
+    parquet_path = os.path.join(
+        columnar_dir,
+        os.path.splitext(os.path.basename(path))[0] + '.parquet')
+
+    if os.path.exists(parquet_path) and os.path.getmtime(
+            parquet_path) >= os.path.getmtime(path):
+        return parquet_path
+
+    os.makedirs(columnar_dir, exist_ok=True)
+
+    columns = [column for column in columns if column in csv_header(path)]
+    types = {
+        column: column_types[column]
+        for column in columns if column in column_types
+    }
+
+    if engine['name'] == 'duckdb':
+        sql_types = {'int': 'BIGINT', 'float': 'DOUBLE'}
+        engine['con'].execute(
+            'COPY (SELECT {} FROM read_csv({}, header = true, types = {{{}}})) TO {} (FORMAT parquet)'.
+            format(
+                ', '.join('"{}"'.format(column) for column in columns),
+                sql_string(path), ', '.join(
+                    '{}: {}'.format(sql_string(column), sql_types[kind])
+                    for column, kind in types.items()),
+                sql_string(parquet_path + '.tmp')))
+    else:
+        pl = engine['pl']
+        polars_types = {'int': pl.Int64, 'float': pl.Float64}
+        pl.scan_csv(path,
+                    schema_overrides={
+                        column: polars_types[kind]
+                        for column, kind in types.items()
+                    },
+                    infer_schema_length=100000).select(columns).sink_parquet(
+                        parquet_path + '.tmp')
+
+    os.replace(parquet_path + '.tmp', parquet_path)
+
+    return parquet_path
+
+
+# Engines **********************************************************************************************************************
+
+
+def register(engine, table, parquet_path):
+    engine['tables'][table] = parquet_path
+
+    if engine['name'] == 'duckdb':
+        engine['con'].execute(
+            'CREATE OR REPLACE VIEW {} AS SELECT * FROM read_parquet({})'.format(
+                table, sql_string(parquet_path)))
+    else:
+        engine['frames'][table] = engine['pl'].scan_parquet(parquet_path)
+
+
+def open_engine(name=ENGINE,
+                gtd_path=day_09.GTD_PATH,
+                wpp_path=day_08.WPP_PATH,
+                columnar_dir=COLUMNAR_DIR,
+                threads=None):
+    engine = dict(name=name, tables=dict(), frames=dict())
+
+    if name == 'duckdb':
+        import duckdb
+
+        engine['con'] = duckdb.connect()
+        if threads is not None:
+            engine['con'].execute('SET threads = {}'.format(int(threads)))
+    elif name == 'polars':
+        if threads is not None:
+            os.environ['POLARS_MAX_THREADS'] = str(threads)  # (read once, when polars is imported)
+
+        import polars as pl
+
+        engine['pl'] = pl
+    else:
+        raise ValueError('unknown engine: {}'.format(name))
+
+    # (a missing file is just a missing table)
+
+    for table, path, columns in (('gtd', gtd_path, gtd_columns),
+                                 ('wpp', wpp_path, wpp_columns)):
+        if path is not None and os.path.exists(path):
+            register(engine, table,
+                     columnar_cache(engine, path, columns, columnar_dir))
+
+    return engine
+
+
+def to_pandas(engine, result):
+    import pandas as pd
+
+    if engine['name'] == 'duckdb':
+        return result.df()
+
+    # (polars' own to_pandas() needs pyarrow; the columns go through numpy instead)
+
+    frame = result.collect() if hasattr(result, 'collect') else result
+    return pd.DataFrame({column: frame[column].to_numpy() for column in frame.columns})
+
+
+def query(engine, sql):
+
+    # An ad-hoc query on the tables, as a pandas frame
+
+    if engine['name'] == 'duckdb':
+        return to_pandas(engine, engine['con'].sql(sql))
+    return to_pandas(engine,
+                     engine['pl'].SQLContext(frames=engine['frames']).execute(sql))
+
+
+# Filters **********************************************************************************************************************
+
+# where: {column: value or list of values}, years: (first, last); both are applied before the aggregation, in the scan.
+
+
+def sql_filters(where=None, years=None):
+    conditions = []
+
+    for column, values in (where or dict()).items():
+        values = values if isinstance(values, (list, tuple)) else [values]
+        conditions.append('"{}" IN ({})'.format(
+            column, ', '.join(
+                sql_string(value) if isinstance(value, str) else str(value)
+                for value in values)))
+
+    if years is not None:
+        conditions.append('iyear BETWEEN {:d} AND {:d}'.format(*years))
+
+    return ''.join(' AND ' + condition for condition in conditions)
+
+
+def polars_filters(engine, where=None, years=None):
+    pl = engine['pl']
+    condition = pl.lit(True)
+
+    for column, values in (where or dict()).items():
+        values = values if isinstance(values, (list, tuple)) else [values]
+        condition &= pl.col(column).is_in(values)
+
+    if years is not None:
+        condition &= pl.col('iyear').is_between(*years)
+
+    return condition
+
+
+# Day 9 ************************************************************************************************************************
+
+# The same frames as day_09.prepare_data(): the ranked country x year rows (the countries with attacks after 2010, each year
+# dense-ranked by attacks, no 1993), the years, and all the country x year sums with the regions (for the roll-up).
+
+
+def day_09_years(years=None):
+    chart_years = np.arange(1970, 1993).tolist() + np.arange(1994, 2021).tolist()
+    if years is None:
+        return chart_years
+    return [year for year in chart_years if years[0] <= year <= years[1]]
+
+
+def day_09_data(engine, where=None, years=None):
+    if engine['name'] == 'duckdb':
+        filters = sql_filters(where, years)
+
+        engine['con'].execute("""
+            CREATE OR REPLACE TEMP TABLE day_09_counts AS
+            SELECT iyear, country_txt,
+                   count(DISTINCT eventid) AS eventid,
+                   coalesce(sum(nkill), 0) AS nkill,
+                   coalesce(sum(nwound), 0) AS nwound,
+                   min(iyear) OVER (PARTITION BY country_txt) AS min_year,
+                   max(iyear) OVER (PARTITION BY country_txt) AS max_year
+            FROM gtd
+            WHERE iyear < 2021{}
+            GROUP BY iyear, country_txt""".format(filters))
+
+        dff1 = to_pandas(
+            engine, engine['con'].sql("""
+            SELECT iyear, country_txt, eventid, nkill, nwound, min_year, max_year,
+                   dense_rank() OVER (PARTITION BY iyear ORDER BY eventid DESC) AS rank
+            FROM day_09_counts
+            WHERE max_year >= 2011 AND iyear <> 1993
+            ORDER BY iyear, eventid DESC, country_txt"""))
+
+        dff_all = to_pandas(
+            engine, engine['con'].sql("""
+            SELECT c.iyear, c.country_txt, c.eventid, c.nkill, c.nwound, r.region_txt
+            FROM day_09_counts c
+            JOIN (SELECT country_txt, arg_min(region_txt, eventid) AS region_txt
+                  FROM gtd WHERE iyear < 2021{} GROUP BY country_txt) r USING (country_txt)
+            ORDER BY c.iyear, c.eventid DESC, c.country_txt""".format(filters)))
+    else:
+        pl = engine['pl']
+        gtd = engine['frames']['gtd'].filter((pl.col('iyear') < 2021)
+                                             & polars_filters(engine, where, years))
+
+        counts = gtd.group_by('iyear', 'country_txt').agg(
+            pl.col('eventid').n_unique().alias('eventid'),
+            pl.col('nkill').sum(),
+            pl.col('nwound').sum()).with_columns(
+                pl.col('iyear').min().over('country_txt').alias('min_year'),
+                pl.col('iyear').max().over('country_txt').alias('max_year'))
+
+        regions = gtd.group_by('country_txt').agg(
+            pl.col('region_txt').sort_by('eventid').first())
+
+        order = dict(by=['iyear', 'eventid', 'country_txt'],
+                     descending=[False, True, False])
+
+        ranked = counts.filter((pl.col('max_year') >= 2011)
+                               & (pl.col('iyear') != 1993)).with_columns(
+                                   pl.col('eventid').rank(
+                                       'dense', descending=True).over('iyear').alias(
+                                           'rank')).sort(**order)
+
+        dff1, dff_all = pl.collect_all([
+            ranked.select('iyear', 'country_txt', 'eventid', 'nkill', 'nwound',
+                          'min_year', 'max_year', 'rank'),
+            counts.join(regions, on='country_txt').sort(**order).select(
+                'iyear', 'country_txt', 'eventid', 'nkill', 'nwound',
+                'region_txt')
+        ])
+        dff1, dff_all = to_pandas(engine, dff1), to_pandas(engine, dff_all)
+
+    return dff1, day_09_years(years), dff_all
+
+
+# Day 11 ***********************************************************************************************************************
+
+# The same frame as day_11.prepare_data(): the attacks (and their victims) of each country, month and year, with the month
+# names and their order on the circles (month_order = 13 - imonth, December is the inner circle) and the regions.
+
+
+def day_11_data(engine, where=None, years=None):
+    if engine['name'] == 'duckdb':
+        filters = sql_filters(where, years)
+
+        dff = to_pandas(
+            engine, engine['con'].sql("""
+            WITH g AS (SELECT * FROM gtd WHERE imonth > 0{}),
+                 r AS (SELECT country_txt, arg_min(region_txt, eventid) AS region_txt
+                       FROM g GROUP BY country_txt)
+            SELECT g.country, g.country_txt, 13 - g.imonth AS month_order, g.iyear,
+                   count(g.eventid) AS eventid,
+                   coalesce(sum(g.nkill), 0) AS nkill,
+                   coalesce(sum(g.nwound), 0) AS nwound,
+                   any_value(r.region_txt) AS region_txt
+            FROM g JOIN r USING (country_txt)
+            WHERE g.iyear < 2021
+            GROUP BY g.country, g.country_txt, g.imonth, g.iyear
+            ORDER BY g.country, g.country_txt, month_order, g.iyear""".format(
+                filters)))
+    else:
+        pl = engine['pl']
+        gtd = engine['frames']['gtd'].filter((pl.col('imonth') > 0)
+                                             & polars_filters(engine, where, years))
+
+        regions = gtd.group_by('country_txt').agg(
+            pl.col('region_txt').sort_by('eventid').first())
+
+        dff = to_pandas(
+            engine,
+            gtd.filter(pl.col('iyear') < 2021).group_by(
+                'country', 'country_txt', 'imonth', 'iyear').agg(
+                    pl.col('eventid').count(),
+                    pl.col('nkill').sum(),
+                    pl.col('nwound').sum()).join(
+                        regions, on='country_txt').with_columns(
+                            (13 - pl.col('imonth')).alias('month_order')).sort(
+                                'country', 'country_txt', 'month_order',
+                                'iyear').select('country', 'country_txt',
+                                                'month_order', 'iyear',
+                                                'eventid', 'nkill', 'nwound',
+                                                'region_txt'))
+
+    dff.insert(3, 'month', dff['month_order'].map(lambda m: day_11.month_dict[13 - m]))
+
+    return dff
+
+
+# Stores ***********************************************************************************************************************
+
+
+def build_stores(engine, name, where=None, years=None, store_dir='.'):
+
+    # A variation as its own Day 9 and Day 11 stores (day_09_ranks_<name>, day_11_counts_<name>); the charts are then built
+    # from them with path=None
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    store_paths = dict(
+        day_09=os.path.join(store_dir, '{}_{}'.format(day_09.STORE_PATH, name)),
+        day_11=os.path.join(store_dir, '{}_{}'.format(day_11.STORE_PATH, name)))
+
+    day_09.write_store(*day_09_data(engine, where, years), store_paths['day_09'])
+    day_11.write_store(day_11_data(engine, where, years), store_paths['day_11'])
+
+    return store_paths
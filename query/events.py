@@ -0,0 +1,251 @@
+# PACKAGES *********************************************************************************************************************
+
+import os
+import sys
+import json
+import functools
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.profiling import tmp_path  # (the files are written to a temporary file first, then moved into place)
+
+# pandas is needed here only to build the index (reading the GTD csv), not to read it.
+
+# EVENT INDEX ******************************************************************************************************************
+
+# The attacks behind a Day 11 cell (a country, year and month) or a Day 9 point (a country and a year, or the years of its
+# window), for the list shown when the point is clicked. A boolean mask over the whole GTD costs a pass over every attack per
+# click; here the attacks are sorted once by country, year, month, day and eventid, and written as one .npy file per column
+# (memory-mapped when read, so a page of results reads only its own rows), with an offset table: for every country x year x
+# month (0, the unknown month, to 12) the row where its attacks start,
+#
+#     offsets[(country * years + year - first year) * 13 + month]    (and they end where the next cell starts)
+#
+# so a cell is two lookups, a year is 13 consecutive cells (one range), and so is a run of years. A day of a month is found by
+# binary search over the day column within the month's rows (sorted). None of it depends on the number of attacks in the
+# database, only on the size of the page. A region or the world is the ranges of its countries (in the regions of the
+# stores: the region of a country's first attack).
+#
+#     drill_down('France', 2015, month=11)                   # the first page: {'total': ..., 'pages': ..., 'rows': [...], ...}
+#     drill_down('Iraq', 2012, last_year=2014, page=3)       # a point of the Day 9 3-year window chart
+#
+# The text columns are stored as codes into their sorted values (-1 for a missing one), kept in the index.
+
+GTD_PATH = 'globalterrorismdb.csv'
+EVENT_PATH = 'gtd_events'  # -> gtd_events.json (the index) + gtd_events_offsets.npy + gtd_events_<column>.npy
+PAGE_SIZE = 50
+
+event_columns = [
+    'eventid', 'iyear', 'imonth', 'iday', 'provstate', 'city', 'attacktype1_txt',
+    'targtype1_txt', 'weaptype1_txt', 'gname', 'nkill', 'nwound'
+]  # (the ones the file has)
+
+# Building the index ***********************************************************************************************************
+
+
+def write_events(path=GTD_PATH, event_path=EVENT_PATH):
+    import pandas as pd
+
+    wanted = set(event_columns) | {'country_txt', 'region_txt'}
+    df = pd.read_csv(path, usecols=lambda column: column in wanted, low_memory=False)
+    columns = [column for column in event_columns if column in df.columns]
+
+    countries, country_codes = np.unique(df['country_txt'].to_numpy(dtype='str'), return_inverse=True)
+    df['country_code'] = country_codes
+
+    df = df.sort_values(by=['country_code', 'iyear', 'imonth', 'iday', 'eventid'], kind='stable')
+
+    if 'region_txt' in df.columns:
+        regions = df.drop_duplicates('country_code').set_index('country_code')['region_txt'].dropna().to_dict()
+    else:
+        regions = dict()
+
+    # The offset table
+
+    years = np.arange(df['iyear'].min(), df['iyear'].max() + 1)
+    cells = (df['country_code'].to_numpy() * len(years) + df['iyear'].to_numpy() - years[0]) * 13 + df['imonth'].to_numpy()
+    counts = np.bincount(cells, minlength=len(countries) * len(years) * 13)
+
+    offsets = np.zeros(len(counts) + 1, dtype='int64')
+    np.cumsum(counts, out=offsets[1:])
+
+    # The columns: the numbers as they are (with NaN for a missing one), the text as codes
+
+    arrays = dict(offsets=offsets)
+    values = dict()
+    for column in columns:
+        if df[column].dtype == 'object' or str(df[column].dtype) in ('str', 'string'):
+            codes, uniques = pd.factorize(df[column], sort=True)
+            arrays[column] = codes.astype('int32')
+            values[column] = [str(value) for value in uniques]
+        elif df[column].isna().any():
+            arrays[column] = df[column].to_numpy(dtype='float')
+        else:
+            arrays[column] = df[column].to_numpy(dtype='int64')
+
+    for name, array in arrays.items():
+        file_path = '{}_{}.npy'.format(event_path, name)
+        with open(tmp_path(file_path), 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path(file_path), file_path)
+
+    # The index goes last: its presence is what marks the files as complete
+
+    index = {
+        'countries': countries.tolist(),
+        'regions': [regions.get(code) for code in range(len(countries))],
+        'years': years.tolist(),
+        'columns': columns,
+        'values': values,
+        'rows': len(df)
+    }
+    with open(tmp_path(event_path + '.json'), 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path(event_path + '.json'), event_path + '.json')
+
+
+def events_are_fresh(path=GTD_PATH, event_path=EVENT_PATH):
+
+    # (path=None: no raw file to compare with, the index is served as it is)
+
+    if not os.path.exists(event_path + '.json'):
+        return False
+    return path is None or not os.path.exists(path) or os.path.getmtime(
+        event_path + '.json') >= os.path.getmtime(path)
+
+
+@functools.lru_cache(maxsize=1)
+def read_events(event_path, mtime):
+    with open(event_path + '.json') as f:
+        index = json.load(f)
+
+    arrays = {
+        name: np.load('{}_{}.npy'.format(event_path, name), mmap_mode='r')
+        for name in ['offsets'] + index['columns']
+    }
+
+    # The countries of each name a chart can ask for: a country, a region, the world
+
+    members = {country: [code] for code, country in enumerate(index['countries'])}
+    for code, region in enumerate(index['regions']):
+        if region is not None:
+            members.setdefault(region, []).append(code)
+    members['World'] = list(range(len(index['countries'])))
+
+    return dict(index=index, arrays=arrays, members=members)
+
+
+def load_events(path=GTD_PATH, event_path=EVENT_PATH):
+    if not events_are_fresh(path, event_path):
+        write_events(path, event_path)
+
+    # (re-read only when the index has changed)
+
+    return read_events(event_path, os.path.getmtime(event_path + '.json'))
+
+
+# Drill-down *******************************************************************************************************************
+
+
+def event_ranges(events, country, first_year, last_year, month=None, day=None):
+
+    # (a day is searched within a month's rows, the only ones sorted by day; a month out of 0-12 would read another cell)
+
+    if month is not None and not 0 <= month <= 12:
+        raise ValueError('month {} (0-12)'.format(month))
+    if day is not None and month is None:
+        raise ValueError('a day needs its month')
+
+    index, offsets = events['index'], events['arrays']['offsets']
+    years = index['years']
+
+    first_year, last_year = max(first_year, years[0]), min(last_year, years[-1])
+    if first_year > last_year:
+        return []
+
+    ranges = []
+    for code in events['members'][country]:  # (KeyError: not a country, region or world of the index)
+        row = code * len(years) * 13
+
+        if month is None:
+            cells = [(row + (first_year - years[0]) * 13, row + (last_year - years[0] + 1) * 13)]
+        else:
+            cells = [(cell, cell + 1) for cell in (row + (year - years[0]) * 13 + month
+                                                   for year in range(first_year, last_year + 1))]
+
+        for first_cell, end_cell in cells:
+            start, end = int(offsets[first_cell]), int(offsets[end_cell])
+
+            if day is not None and end > start:
+                days = events['arrays']['iday'][start:end]
+                start, end = start + int(np.searchsorted(days, day, 'left')), start + int(np.searchsorted(days, day, 'right'))
+
+            if end > start:
+                ranges.append((start, end))
+
+    return ranges
+
+
+def page_rows(events, ranges, page=0, page_size=PAGE_SIZE):
+
+    # The rows of one page, picked from the ranges in order
+
+    skip, left = page * page_size, page_size
+    positions = []
+    for start, end in ranges:
+        if skip >= end - start:
+            skip -= end - start
+            continue
+
+        take = min(end - start - skip, left)
+        positions.append(np.arange(start + skip, start + skip + take))
+        skip, left = 0, left - take
+        if not left:
+            break
+
+    positions = np.concatenate(positions) if positions else np.zeros(0, dtype='int64')
+
+    index, arrays = events['index'], events['arrays']
+    columns = []
+    for column in index['columns']:
+        values = arrays[column][positions]
+        if column in index['values']:
+            text = index['values'][column]
+            columns.append([text[code] if code >= 0 else None for code in values.tolist()])
+        elif values.dtype.kind == 'f':
+            columns.append([None if np.isnan(value) else value for value in values.tolist()])
+        else:
+            columns.append(values.tolist())
+
+    return [list(row) for row in zip(*columns)]
+
+
+def drill_down(country,
+               year,
+               month=None,
+               day=None,
+               last_year=None,
+               page=0,
+               page_size=PAGE_SIZE,
+               path=GTD_PATH,
+               event_path=EVENT_PATH):
+    if page < 0 or page_size < 1:
+        raise ValueError('bad page')
+
+    events = load_events(path, event_path)
+    last_year = year if last_year is None else last_year
+
+    ranges = event_ranges(events, country, year, last_year, month, day)
+    total = sum(end - start for start, end in ranges)
+
+    return dict(country=country,
+                years=[year, last_year],
+                month=month,
+                day=day,
+                total=total,
+                page=page,
+                pages=-(-total // page_size),
+                columns=events['index']['columns'],
+                rows=page_rows(events, ranges, page, page_size))